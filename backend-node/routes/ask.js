@@ -1,59 +1,142 @@
 const express = require("express");
 const router = express.Router();
-const runPython = require("../utils/runPython");
+const ragService = require("../utils/ragService");
 const { connectToDatabase } = require("../utils/database");
 
-router.post("/", async (req, res) => {
-  const {
-    question,
-    indexPath,
-    idMapPath,
-    llm_model,
-    embedding_model,
+/**
+ * Map the /ask request body onto a RAG service payload.
+ */
+function buildPayload(body) {
+  const { question, indexPath, idMapPath, books, library, llm_model, embedding_model, retrieval_mode, rerank } = body;
+  const payload = { query: question };
+
+  if (Array.isArray(books) && books.length) {
+    // Federated search across a shelf of uploaded books
+    payload.books = books
+      .filter((b) => b && b.indexPath && b.idMapPath)
+      .map((b) => ({ index: b.indexPath, id_map: b.idMapPath, ...(b.name ? { name: b.name } : {}) }));
+  } else if (library === true) {
+    // Every uploaded book embedded with this model (library index)
+    payload.library = true;
+  } else if (indexPath && idMapPath) {
+    payload.index = indexPath;
+    payload.id_map = idMapPath;
+  }
+  if (llm_model) payload.llm_model = llm_model;
+  if (embedding_model) payload.embed_model = embedding_model;
+  if (retrieval_mode) payload.retrieval_mode = retrieval_mode;
+  if (typeof rerank === "boolean") payload.rerank = rerank;
+  return payload;
+}
+
+async function logConversation(body, output) {
+  const { question, session_id, user_id } = body;
+  if (!user_id || !session_id) return;
+
+  const db = await connectToDatabase();
+  const logs = db.collection("conversations");
+  await logs.insertOne({
+    user_id,
     session_id,
-    user_id
-  } = req.body;
+    question,
+    answer: output.answer || "(No answer)",
+    model: output.llm_model,
+    embedding_model: output.embed_model,
+    cached: Boolean(output.cached),
+    prompt_tokens: output.prompt ? output.prompt.prompt_tokens : null,
+    timestamp: new Date()
+  });
+}
+
+function formatResponse(output) {
+  return {
+    answer: output.answer || "(No answer)",
+    model: output.llm_model || "unknown",
+    embedding_model: output.embed_model || "unknown",
+    cached: Boolean(output.cached),
+    prompt_tokens: output.prompt ? output.prompt.prompt_tokens : null,
+    ...(output.sources ? { sources: output.sources } : {})
+  };
+}
+
+router.post("/", async (req, res) => {
+  const { question } = req.body;
 
   if (!question || typeof question !== "string") {
     return res.status(400).json({ error: "Missing or invalid question" });
   }
 
-  const args = ["--query", question];
+  try {
+    const output = await ragService.ask(buildPayload(req.body));
+    if (output.cached) console.log("[ASK] Served answer from cache");
+
+    await logConversation(req.body, output);
+    res.json(formatResponse(output));
+  } catch (err) {
+    console.error("RAG service error:", err.message);
+    res.status(500).json({ error: "Internal error from RAG service", detail: err.message });
+  }
+});
+
+/**
+ * POST /ask/stream
+ * Same request body as /ask. Relays the answer as Server-Sent Events:
+ *   event: token  data: { token }
+ *   event: done   data: { answer, model, embedding_model, cached, ttft_ms }
+ *   event: error  data: { error, detail }
+ */
+router.post("/stream", async (req, res) => {
+  const { question } = req.body;
 
-  if (indexPath && idMapPath) {
-    args.push("--index", indexPath);
-    args.push("--id_map", idMapPath);
+  if (!question || typeof question !== "string") {
+    return res.status(400).json({ error: "Missing or invalid question" });
   }
-  if (llm_model) args.push("--llm_model", llm_model);
-  if (embedding_model) args.push("--embed_model", embedding_model);
+
+  res.set({
+    "Content-Type": "text/event-stream",
+    "Cache-Control": "no-cache",
+    Connection: "keep-alive",
+    "X-Accel-Buffering": "no"
+  });
+  res.flushHeaders();
+
+  const send = (event, data) => {
+    res.write(`event: ${event}\ndata: ${JSON.stringify(data)}\n\n`);
+  };
+
+  const t0 = process.hrtime.bigint();
+  let firstTokenMs = null;
+
+  // Browser gone before the answer finished: stop the upstream generation so it
+  // does not keep holding one of the RAG service's Ollama slots
+  const upstream = new AbortController();
+  res.on("close", () => {
+    if (!res.writableEnded) upstream.abort();
+  });
 
   try {
-    const output = await runPython("rag_rag_engine.py", args);
-    const { answer, llm_model: modelUsed, embed_model: embedUsed } = output;
-
-    if (user_id && session_id) {
-      const db = await connectToDatabase();
-      const logs = db.collection("conversations");
-      await logs.insertOne({
-        user_id,
-        session_id,
-        question,
-        answer: answer || "(No answer)",
-        model: modelUsed,
-        embedding_model: embedUsed,
-        timestamp: new Date()
-      });
-    }
+    const output = await ragService.askStream(buildPayload(req.body), (token) => {
+      if (firstTokenMs === null) {
+        firstTokenMs = Number(process.hrtime.bigint() - t0) / 1e6;
+        console.log(`[ASK TIMING] first token relayed in ${firstTokenMs.toFixed(1)} ms`);
+      }
+      send("token", { token });
+    }, upstream.signal);
 
-    res.json({
-      answer: answer || "(No answer)",
-      model: modelUsed || "unknown",
-      embedding_model: embedUsed || "unknown"
+    send("done", { ...formatResponse(output), ttft_ms: output.ttft_ms });
+    res.end();
+    logConversation(req.body, output).catch((err) => {
+      console.error("History logging error:", err.message);
     });
   } catch (err) {
-    console.error("Python script error:", err.message);
-    res.status(500).json({ error: "Internal error from Python script", detail: err.message });
+    if (upstream.signal.aborted) {
+      console.log("[ASK] Client disconnected, stream aborted");
+      return;
+    }
+    console.error("RAG service error:", err.message);
+    send("error", { error: "Internal error from RAG service", detail: err.message });
+    res.end();
   }
 });
 
-module.exports = router;
\ No newline at end of file
+module.exports = router;
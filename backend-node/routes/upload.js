@@ -3,50 +3,55 @@ const multer = require("multer");
 const path = require("path");
 const runPython = require("../utils/runPython");
 const fs = require("fs");
+const os = require("os");
 
 const router = express.Router();
 const upload = multer({ dest: "uploads/" });
 
+// Processes used to extract PDF pages in parallel
+const PDF_WORKERS = process.env.PDF_WORKERS || String(Math.min(4, os.cpus().length));
 
+
+/**
+ * POST /upload
+ * Ingest a PDF through the content-addressed cache: a PDF already indexed
+ * with the same embedding model returns its existing index immediately, and
+ * a revised edition only re-embeds the chunks whose text changed.
+ */
 router.post("/", upload.single("pdf"), async (req, res) => {
   const file = req.file;
   if (!file) return res.status(400).json({ error: "Missing file" });
 
   const filename = path.parse(file.originalname).name;
-  const base = filename + "_" + Date.now();
   const pdfPath = path.resolve(file.path);
-  const jsonlOut = `materials/jsonl/${base}.qa_with_answers.jsonl`;
-  const indexOut = `materials/embeddings/faiss_${base}.index`;
-  const idMapOut = `materials/embeddings/id_map_${base}.json`;
   const embed_model = req.body?.embedding_model || "all-MiniLM-L6-v2";
-
+  // libraryBookId of an earlier edition to take out of the library (opt-in)
+  const replaces = req.body?.replacesBookId;
 
   try {
-    // await runPython("probability_pipeline_multi.py", [
-    //   "--pdf", pdfPath,
-    //   "--prefix", base,
-    //   "--force"
-    // ]);
-    const jsonlOut = `materials/jsonl/${base}.qa_with_answers.jsonl`;
-
-    await runPython("qa_rule_based_generator.py", [
-    "--pdf", pdfPath,
-    "--out", jsonlOut,
-    "--chunk_size", "180"
-    ]);
-
-
-    await runPython("build_faiss_index_core.py", [
-      jsonlOut,
-      embed_model,
-      indexOut,
-      idMapOut
+    const result = await runPython("ingest_cache.py", [
+      "--pdf", pdfPath,
+      "--name", filename,
+      "--embed_model", embed_model,
+      "--chunk_size", "180",
+      "--workers", PDF_WORKERS,
+      ...(typeof replaces === "string" && replaces ? ["--replaces", replaces] : [])
     ]);
-
-    res.json({ success: true, indexPath: indexOut, idMapPath: idMapOut });
+    if (result.cached) console.log(`[UPLOAD] Reused existing index for ${filename}`);
+    else console.log(`[UPLOAD] Indexed ${filename}: ${result.encoded} chunks embedded, ${result.reused} reused`);
+
+    res.json({
+      success: true,
+      indexPath: result.indexPath,
+      idMapPath: result.idMapPath,
+      cached: Boolean(result.cached),
+      libraryBookId: result.libraryBookId || null
+    });
   } catch (err) {
     console.error(err.message);
     res.status(500).json({ error: "Failed to process PDF" });
+  } finally {
+    fs.promises.unlink(pdfPath).catch(() => {});
   }
 });
 
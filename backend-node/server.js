@@ -4,6 +4,7 @@ const app = express();
 const askRoute = require("./routes/ask");
 const uploadRoute = require("./routes/upload");
 const historyRoute = require("./routes/history");
+const ragService = require("./utils/ragService");
 
 require("dotenv").config(); 
 const mongoose = require("mongoose");
@@ -27,4 +28,11 @@ app.use("/history", historyRoute);
 const PORT = 5000;
 app.listen(PORT, () => {
   console.log(`Server listening on http://localhost:${PORT}`);
+  // Warm up the RAG service so the first question does not pay the model load
+  ragService.start().catch((err) => console.error("[RAG] Failed to start:", err.message));
+});
+
+process.on("SIGINT", () => {
+  ragService.stop();
+  process.exit(0);
 });
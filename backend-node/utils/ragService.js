@@ -0,0 +1,349 @@
+const { spawn } = require("child_process");
+const http = require("http");
+const path = require("path");
+const readline = require("readline");
+
+const ROOT_DIR = path.resolve(__dirname, "../../");
+const SCRIPT_PATH = path.resolve(__dirname, "../../scripts", "rag_server.py");
+
+const HOST = process.env.RAG_SERVER_HOST || "127.0.0.1";
+const PORT = Number(process.env.RAG_SERVER_PORT || 5001);
+const TRANSPORT = process.env.RAG_TRANSPORT || "http"; // "http" | "stdio"
+const STARTUP_TIMEOUT_MS = Number(process.env.RAG_STARTUP_TIMEOUT_MS || 120000);
+const REQUEST_TIMEOUT_MS = Number(process.env.RAG_REQUEST_TIMEOUT_MS || 300000);
+const HEALTH_INTERVAL_MS = Number(process.env.RAG_HEALTH_INTERVAL_MS || 15000);
+const MAX_HEALTH_FAILURES = 3;
+const MAX_RESTART_DELAY_MS = 30000;
+
+/**
+ * Supervises the long-lived rag_server.py process.
+ *
+ * Spawns the service on first use, waits for it to become healthy, polls
+ * /health in the background and restarts the process with backoff when it
+ * dies or stops answering. If a service is already listening on the
+ * configured port (e.g. started by hand), it is used as-is.
+ */
+class RagService {
+  constructor() {
+    this.proc = null;
+    this.readyPromise = null;
+    this.stopping = false;
+    this.restartDelay = 1000;
+    this.healthFailures = 0;
+    this.healthTimer = null;
+    // stdio transport state
+    this.nextId = 1;
+    this.pending = new Map();
+    this.stdioReady = null;
+  }
+
+  start() {
+    if (!this.readyPromise) {
+      this.stopping = false;
+      this.readyPromise = this._boot().catch((err) => {
+        this.readyPromise = null;
+        throw err;
+      });
+    }
+    return this.readyPromise;
+  }
+
+  stop() {
+    this.stopping = true;
+    clearInterval(this.healthTimer);
+    this.healthTimer = null;
+    if (this.proc) this.proc.kill();
+    this.proc = null;
+    this.readyPromise = null;
+  }
+
+  /**
+   * Answer one question.
+   *
+   * @param {object} payload - { query, index, id_map, embed_model, llm_model, top_k }
+   * @returns {Promise<object>} - { answer, llm_model, embed_model, cached }
+   */
+  async ask(payload) {
+    await this.start();
+    if (TRANSPORT === "stdio") return this._stdioRequest(payload);
+    return this._httpRequest("POST", "/ask", payload, REQUEST_TIMEOUT_MS);
+  }
+
+  /**
+   * Answer one question, streaming answer fragments as they are generated.
+   *
+   * @param {object} payload - same fields as ask()
+   * @param {(token: string) => void} onToken - called for every fragment
+   * @param {AbortSignal} [signal] - aborting closes the upstream request, which stops generation
+   *                                 (HTTP transport; over stdio the answer is only discarded)
+   * @returns {Promise<object>} - final { answer, llm_model, embed_model, cached, ttft_ms }
+   */
+  async askStream(payload, onToken, signal = null) {
+    await this.start();
+    if (TRANSPORT === "stdio") return this._stdioRequest({ ...payload, stream: true }, REQUEST_TIMEOUT_MS, onToken);
+    return this._httpStream(payload, onToken, signal);
+  }
+
+  async health() {
+    if (TRANSPORT === "stdio") return this._stdioRequest({ op: "health" }, 5000);
+    return this._httpRequest("GET", "/health", null, 5000);
+  }
+
+  // ---------- lifecycle ----------
+
+  async _boot() {
+    if (TRANSPORT === "http") {
+      try {
+        await this.health();
+        console.log(`[RAG] Using existing service at http://${HOST}:${PORT}`);
+        this._startHealthChecks();
+        return;
+      } catch (_) {
+        // nothing listening yet, spawn our own
+      }
+    }
+
+    this._spawn();
+    await this._waitUntilHealthy();
+    this.restartDelay = 1000;
+    this._startHealthChecks();
+    console.log(`[RAG] Service ready (transport=${TRANSPORT}, pid=${this.proc && this.proc.pid})`);
+  }
+
+  _spawn() {
+    const args = ["-3", SCRIPT_PATH];
+    if (TRANSPORT === "stdio") args.push("--stdio");
+    else args.push("--host", HOST, "--port", String(PORT));
+
+    console.log(" Starting RAG service:", "py", ...args);
+    const proc = spawn("py", args, { cwd: ROOT_DIR });
+    this.proc = proc;
+
+    proc.stderr.on("data", (data) => {
+      console.error("[RAG STDERR]", data.toString().trimEnd());
+    });
+
+    if (TRANSPORT === "stdio") {
+      this.stdioReady = new Promise((resolve) => {
+        const rl = readline.createInterface({ input: proc.stdout });
+        rl.on("line", (line) => this._onStdioLine(line, resolve));
+      });
+    } else {
+      proc.stdout.on("data", (data) => {
+        console.log("[RAG STDOUT]", data.toString().trimEnd());
+      });
+    }
+
+    proc.on("exit", (code, signal) => {
+      if (this.proc !== proc) return;
+      console.warn(`[RAG] Service exited (code=${code}, signal=${signal})`);
+      this.proc = null;
+      this.readyPromise = null;
+      this._rejectPending(new Error("RAG service exited"));
+      if (!this.stopping) this._scheduleRestart();
+    });
+  }
+
+  async _waitUntilHealthy() {
+    const deadline = Date.now() + STARTUP_TIMEOUT_MS;
+    if (TRANSPORT === "stdio") {
+      let timer;
+      try {
+        await Promise.race([
+          this.stdioReady,
+          new Promise((_, reject) => {
+            timer = setTimeout(() => reject(new Error("RAG service startup timed out")), STARTUP_TIMEOUT_MS);
+          }),
+        ]);
+      } finally {
+        clearTimeout(timer);
+      }
+      return;
+    }
+    while (Date.now() < deadline) {
+      if (!this.proc) throw new Error("RAG service exited during startup");
+      try {
+        await this.health();
+        return;
+      } catch (_) {
+        await new Promise((r) => setTimeout(r, 500));
+      }
+    }
+    throw new Error("RAG service startup timed out");
+  }
+
+  _scheduleRestart() {
+    clearInterval(this.healthTimer);
+    this.healthTimer = null;
+    const delay = this.restartDelay;
+    this.restartDelay = Math.min(this.restartDelay * 2, MAX_RESTART_DELAY_MS);
+    console.warn(`[RAG] Restarting service in ${delay} ms`);
+    setTimeout(() => {
+      if (this.stopping) return;
+      this.start().catch((err) => console.error("[RAG] Restart failed:", err.message));
+    }, delay);
+  }
+
+  _startHealthChecks() {
+    clearInterval(this.healthTimer);
+    this.healthFailures = 0;
+    this.healthTimer = setInterval(async () => {
+      try {
+        await this.health();
+        this.healthFailures = 0;
+      } catch (err) {
+        this.healthFailures += 1;
+        console.warn(`[RAG] Health check failed (${this.healthFailures}/${MAX_HEALTH_FAILURES}):`, err.message);
+        if (this.healthFailures >= MAX_HEALTH_FAILURES) {
+          this.healthFailures = 0;
+          if (this.proc) {
+            this.proc.kill(); // exit handler schedules the restart
+          } else {
+            this.readyPromise = null;
+            this._scheduleRestart();
+          }
+        }
+      }
+    }, HEALTH_INTERVAL_MS);
+    this.healthTimer.unref();
+  }
+
+  // ---------- HTTP transport ----------
+
+  _httpRequest(method, route, body, timeoutMs) {
+    return new Promise((resolve, reject) => {
+      const data = body ? JSON.stringify(body) : null;
+      const req = http.request(
+        {
+          host: HOST,
+          port: PORT,
+          path: route,
+          method,
+          headers: data
+            ? { "Content-Type": "application/json", "Content-Length": Buffer.byteLength(data) }
+            : {},
+        },
+        (res) => {
+          let raw = "";
+          res.setEncoding("utf8");
+          res.on("data", (chunk) => (raw += chunk));
+          res.on("end", () => {
+            let parsed;
+            try {
+              parsed = JSON.parse(raw);
+            } catch (e) {
+              return reject(new Error(`Invalid JSON from RAG service: ${e.message}`));
+            }
+            if (res.statusCode >= 400) {
+              return reject(new Error(parsed.error || `RAG service returned ${res.statusCode}`));
+            }
+            resolve(parsed);
+          });
+        }
+      );
+      req.setTimeout(timeoutMs, () => req.destroy(new Error("RAG service request timed out")));
+      req.on("error", reject);
+      if (data) req.write(data);
+      req.end();
+    });
+  }
+
+  _httpStream(payload, onToken, signal = null) {
+    return new Promise((resolve, reject) => {
+      const data = JSON.stringify(payload);
+      let settled = false;
+      const settle = (fn, value) => {
+        if (!settled) {
+          settled = true;
+          fn(value);
+        }
+      };
+
+      const req = http.request(
+        {
+          host: HOST,
+          port: PORT,
+          path: "/ask/stream",
+          method: "POST",
+          headers: { "Content-Type": "application/json", "Content-Length": Buffer.byteLength(data) },
+        },
+        (res) => {
+          const rl = readline.createInterface({ input: res });
+          rl.on("line", (line) => {
+            if (!line.trim()) return;
+            let msg;
+            try {
+              msg = JSON.parse(line);
+            } catch (e) {
+              return settle(reject, new Error(`Invalid JSON from RAG service: ${e.message}`));
+            }
+            if (msg.token !== undefined) onToken(msg.token);
+            else if (msg.error) settle(reject, new Error(msg.error));
+            else if (msg.done) {
+              const { done, ...result } = msg;
+              settle(resolve, result);
+            }
+          });
+          res.on("end", () => settle(reject, new Error("RAG stream ended without a result")));
+        }
+      );
+      req.setTimeout(REQUEST_TIMEOUT_MS, () => req.destroy(new Error("RAG service request timed out")));
+      req.on("error", (err) => settle(reject, err));
+      if (signal) {
+        const abort = () => req.destroy(new Error("Request aborted by the client"));
+        if (signal.aborted) abort();
+        else signal.addEventListener("abort", abort, { once: true });
+        req.on("close", () => signal.removeEventListener("abort", abort));
+      }
+      req.write(data);
+      req.end();
+    });
+  }
+
+  // ---------- stdio transport ----------
+
+  _stdioRequest(payload, timeoutMs = REQUEST_TIMEOUT_MS, onToken = null) {
+    return new Promise((resolve, reject) => {
+      if (!this.proc) return reject(new Error("RAG service is not running"));
+      const id = this.nextId++;
+      const timer = setTimeout(() => {
+        this.pending.delete(id);
+        reject(new Error("RAG service request timed out"));
+      }, timeoutMs);
+      this.pending.set(id, { resolve, reject, timer, onToken });
+      this.proc.stdin.write(JSON.stringify({ id, ...payload }) + "\n");
+    });
+  }
+
+  _onStdioLine(line, onReady) {
+    let msg;
+    try {
+      msg = JSON.parse(line);
+    } catch (_) {
+      console.log("[RAG STDOUT]", line);
+      return;
+    }
+    if (msg.event === "ready") return onReady();
+
+    const entry = this.pending.get(msg.id);
+    if (!entry) return;
+    if (msg.token !== undefined) {
+      if (entry.onToken) entry.onToken(msg.token);
+      return;
+    }
+    this.pending.delete(msg.id);
+    clearTimeout(entry.timer);
+    if (msg.error) entry.reject(new Error(msg.error));
+    else entry.resolve(msg.result);
+  }
+
+  _rejectPending(err) {
+    for (const { reject, timer } of this.pending.values()) {
+      clearTimeout(timer);
+      reject(err);
+    }
+    this.pending.clear();
+  }
+}
+
+module.exports = new RagService();
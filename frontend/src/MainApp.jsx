@@ -4,6 +4,51 @@ import MathText from "./components/MathText";
 import "./style.css";
 import { v4 as uuidv4 } from "uuid";
 
+/**
+ * Read the Server-Sent Events stream from /ask/stream.
+ * Calls onPartial with the answer so far after every token and resolves
+ * with the final "done" payload.
+ */
+async function readAnswerStream(res, onPartial) {
+  if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = "";
+  let answer = "";
+
+  while (true) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+
+    let sep;
+    while ((sep = buffer.indexOf("\n\n")) !== -1) {
+      const rawEvent = buffer.slice(0, sep);
+      buffer = buffer.slice(sep + 2);
+
+      let event = "message";
+      let data = "";
+      for (const line of rawEvent.split("\n")) {
+        if (line.startsWith("event:")) event = line.slice(6).trim();
+        else if (line.startsWith("data:")) data += line.slice(5).trim();
+      }
+      const payload = data ? JSON.parse(data) : {};
+
+      if (event === "token") {
+        answer += payload.token;
+        onPartial(answer);
+      } else if (event === "done") {
+        if (payload.ttft_ms != null) console.log(`Time to first token: ${payload.ttft_ms} ms`);
+        return payload;
+      } else if (event === "error") {
+        throw new Error(payload.detail || payload.error);
+      }
+    }
+  }
+  throw new Error("Answer stream ended unexpectedly");
+}
+
 export default function MainApp({ userId, setUserId }) {
   const [qas, setQas] = useState([]);
   const [question, setQuestion] = useState("");
@@ -78,7 +123,7 @@ export default function MainApp({ userId, setUserId }) {
     }
 
     setAnswer("...thinking...");
-    fetch("http://localhost:5000/ask", {
+    fetch("http://localhost:5000/ask/stream", {
       method: "POST",
       headers: { "Content-Type": "application/json" },
       body: JSON.stringify({
@@ -91,7 +136,7 @@ export default function MainApp({ userId, setUserId }) {
         user_id: userId
       }),
     })
-      .then((res) => res.json())
+      .then((res) => readAnswerStream(res, (partial) => setAnswer(partial)))
       .then((data) => {
         const cleanAnswer = (data.answer || "").trim() || "(No answer returned)";
         setAnswer(cleanAnswer);
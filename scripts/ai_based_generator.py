@@ -1,52 +1,27 @@
 import argparse
+import hashlib
 import json
-import re
+import time
 import uuid
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import fitz  # PyMuPDF
-import requests
 from tqdm import tqdm
-from sentence_transformers import SentenceTransformer, util
+import numpy as np
+from model_pool import embed_pool
+from ollama_client import ollama
+from text_filters import clean_line, is_numbered_toc_line as is_toc_line, split_sentences
 
 # ========== Configuration ==========
 DEFAULT_MIN_CHARS = 400
-OLLAMA_URL = "http://localhost:11434/api/generate"
+DEFAULT_EMBED_BATCH_SIZE = 256
 OLLAMA_MODEL = "gemma3:latest"
 EMBED_MODEL = "all-MiniLM-L6-v2"
-
-embedder = SentenceTransformer(EMBED_MODEL)
+FALLBACK_QUESTION = "What is this paragraph about?"
+# The embedder is loaded lazily from the shared pool on first use
 # ===================================
 
 
-def clean_line(line: str) -> str:
-    """
-    Remove headers, footers, and common structural markers like chapter titles and figure/table labels.
-    """
-    patterns = [
-        r"^\d+\s+CHAPTER\s+\d+",
-        r"^CHAPTER\s+\d+(\.\d+)?",
-        r"^Figure\s+\d+(\.\d+)?",
-        r"^Table\s+\d+(\.\d+)?",
-        r"^Page\s+\d+$"
-    ]
-    for pattern in patterns:
-        if re.match(pattern, line, re.IGNORECASE):
-            return ""
-    return line.strip()
-
-
-def is_toc_line(line: str) -> bool:
-    """
-    Heuristically detect lines likely to be part of a table of contents.
-    """
-    return (
-        "table of contents" in line.lower() or
-        re.search(r'\.{3,}', line) or
-        re.match(r'\s*\d+(\.\d+)*\s+.*', line) or
-        re.search(r'\s\.+\s\d{1,3}$', line)
-    )
-
-
 def extract_paragraphs(pdf_path: Path, min_chars: int):
     """
     Parse a PDF and yield clean paragraph blocks of at least `min_chars` characters.
@@ -63,7 +38,7 @@ def extract_paragraphs(pdf_path: Path, min_chars: int):
                 continue
             cleaned = clean_line(text)
             if cleaned and not is_toc_line(cleaned):
-                for sentence in re.split(r'(?<=[.!?])\s+', cleaned):
+                for sentence in split_sentences(cleaned):
                     buffer.append(sentence)
                     current_len += len(sentence)
                     if current_len >= min_chars:
@@ -79,9 +54,10 @@ def extract_paragraphs(pdf_path: Path, min_chars: int):
             yield paragraph
 
 
-def generate_question(paragraph: str) -> str:
+def generate_question(paragraph: str):
     """
     Use a local Ollama LLM to generate a question from the given paragraph.
+    Returns (question, is_fallback); the fallback is used when Ollama fails.
     """
     prompt = f"""You are a helpful tutor. Please read the following paragraph and generate a clear and relevant question about it.
 
@@ -90,60 +66,162 @@ Paragraph:
 
 Question:"""
     try:
-        response = requests.post(OLLAMA_URL, json={
-            "model": OLLAMA_MODEL,
-            "prompt": prompt,
-            "stream": False
-        })
-        result = response.json()
+        result = ollama.generate(OLLAMA_MODEL, prompt)
         question = result.get("response", "").strip()
         if "**Question:**" in question:
             question = question.split("**Question:**")[-1].strip()
-        return question
+        return question, False
     except Exception as e:
         print(f"[Ollama Error] {e}")
-        return "What is this paragraph about?"
+        return FALLBACK_QUESTION, True
+
+
+def extract_answers_batched(paragraphs: list, questions: list, batch_size: int = DEFAULT_EMBED_BATCH_SIZE) -> list:
+    """
+    Pick, for every (paragraph, question) pair, the paragraph sentence most
+    similar to the question. All sentences and all questions are embedded in
+    large batches, and the best sentence per paragraph is found with a
+    segment-wise argmax over the flattened sentence scores.
+    """
+    answers = [None] * len(paragraphs)
+    sentences, seg, multi = [], [], []
+    for i, para in enumerate(paragraphs):
+        sents = split_sentences(para)
+        if len(sents) == 1:
+            answers[i] = para.strip()
+            continue
+        seg.extend([len(multi)] * len(sents))
+        sentences.extend(sents)
+        multi.append(i)
+
+    if not multi:
+        return answers
+
+    embedder = embed_pool.get(EMBED_MODEL)
+    sent_emb = embedder.encode(sentences, batch_size=batch_size, convert_to_numpy=True,
+                               normalize_embeddings=True)
+    q_emb = embedder.encode([questions[i] for i in multi], batch_size=batch_size, convert_to_numpy=True,
+                            normalize_embeddings=True)
+
+    # Cosine score of each sentence against its own paragraph's question
+    seg = np.asarray(seg)
+    scores = np.einsum("ij,ij->i", sent_emb, q_emb[seg])
+
+    # Segment-wise argmax: sort by (segment, -score); the stable sort keeps the
+    # first sentence on ties, and the first row of each segment is its best.
+    order = np.lexsort((-scores, seg))
+    firsts = order[np.r_[0, np.flatnonzero(np.diff(seg[order])) + 1]]
+    for k, best in enumerate(firsts):
+        answers[multi[k]] = sentences[best].strip()
+    return answers
 
 
 def extract_answer(paragraph: str, question: str) -> str:
     """
     Use embedding similarity to identify the most relevant sentence in the paragraph that answers the question.
     """
-    sentences = re.split(r'(?<=[.!?])\s+', paragraph)
-    if len(sentences) == 1:
-        return paragraph.strip()
+    return extract_answers_batched([paragraph], [question])[0]
 
-    q_embedding = embedder.encode(question, convert_to_tensor=True)
-    sent_embeddings = embedder.encode(sentences, convert_to_tensor=True)
-    scores = util.cos_sim(q_embedding, sent_embeddings)
-    best_idx = scores.argmax().item()
-    return sentences[best_idx].strip()
 
+def _checkpoint_path(output_path: Path) -> Path:
+    return output_path.with_name(output_path.name + ".checkpoint")
 
-def generate_qa_file(pdf_path: Path, output_path: Path, min_chars: int, max_paras: int = None):
+
+def _para_hash(paragraph: str) -> str:
+    return hashlib.sha1(paragraph.encode("utf-8")).hexdigest()[:16]
+
+
+def load_checkpoint(path: Path, paras: list) -> dict:
+    """Return {paragraph index: record} for paragraphs whose question is done."""
+    done = {}
+    if not path.exists():
+        return done
+    with path.open(encoding="utf-8") as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError:
+                continue  # partially written last line of an interrupted run
+            i = rec.pop("i")
+            if i < len(paras) and rec.pop("hash") == _para_hash(paras[i]):
+                done[i] = rec
+    return done
+
+
+def _generate_record(para: str) -> dict:
+    question, is_fb = generate_question(para)
+    return {
+        "id": str(uuid.uuid4()),
+        "question": question,
+        "is_fallback": is_fb
+    }
+
+
+def generate_qa_file(pdf_path: Path, output_path: Path, min_chars: int, max_paras: int = None,
+                     concurrency: int = 1, embed_batch_size: int = DEFAULT_EMBED_BATCH_SIZE):
     """
     Perform the full QA generation pipeline:
     1. Extract paragraphs from PDF
-    2. Generate a question using LLM
-    3. Find the most relevant answer sentence
-    4. Save as JSONL
+    2. Generate a question using LLM (up to `concurrency` requests in flight)
+    3. Find the most relevant answer sentence for all paragraphs in one batched pass
+    4. Save as JSONL, in paragraph order
+
+    Generated questions are appended to a checkpoint file next to the output,
+    so an interrupted run resumes where it stopped. Fallback questions (Ollama
+    failed) are not checkpointed, so a resumed run asks for them again.
     """
     output_path.parent.mkdir(parents=True, exist_ok=True)
     paras = list(extract_paragraphs(pdf_path, min_chars))
     if max_paras:
         paras = paras[:max_paras]
 
+    checkpoint = _checkpoint_path(output_path)
+    records = load_checkpoint(checkpoint, paras)
+    pending = [i for i in range(len(paras)) if i not in records]
+    if records:
+        print(f"[Resume] {len(records)} paragraphs restored from {checkpoint}")
+
+    t0 = time.time()
+    # Rewrite the checkpoint with only valid records, dropping any torn last line
+    with checkpoint.open("w", encoding="utf-8") as ckpt, \
+            ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        for i, rec in sorted(records.items()):
+            ckpt.write(json.dumps({"i": i, "hash": _para_hash(paras[i]), **rec}, ensure_ascii=False) + "\n")
+
+        futures = {pool.submit(_generate_record, paras[i]): i for i in pending}
+        for future in tqdm(as_completed(futures), total=len(futures), desc="Generating QA"):
+            i = futures[future]
+            records[i] = future.result()
+            if records[i].get("is_fallback"):
+                continue
+            ckpt.write(json.dumps({"i": i, "hash": _para_hash(paras[i]), **records[i]}, ensure_ascii=False) + "\n")
+            ckpt.flush()
+    elapsed = time.time() - t0
+    fallbacks = sum(1 for rec in records.values() if rec.get("is_fallback"))
+    if fallbacks:
+        print(f"[Fallback] {fallbacks} paragraphs got the fallback question; rerun to retry them")
+
+    t_ans = time.time()
+    answers = extract_answers_batched(paras, [records[i]["question"] for i in range(len(paras))],
+                                      batch_size=embed_batch_size)
+    print(f"[Answers] Extracted {len(paras)} answers in {time.time() - t_ans:.1f}s")
+
     with output_path.open("w", encoding="utf-8") as fout:
-        for para in tqdm(paras, desc="Generating QA"):
-            question = generate_question(para)
-            answer = extract_answer(para, question)
+        for i, para in enumerate(paras):
             qa = {
-                "id": str(uuid.uuid4()),
-                "question": question,
-                "answer": answer,
-                "context": para
+                "id": records[i]["id"],
+                "question": records[i]["question"],
+                "answer": answers[i],
+                "context": para,
+                "is_fallback": records[i].get("is_fallback", False)
             }
             fout.write(json.dumps(qa, ensure_ascii=False) + "\n")
+    if not fallbacks:
+        checkpoint.unlink()
+
+    rate = len(pending) / elapsed * 60 if elapsed > 0 else 0.0
+    print(f"[Throughput] {len(pending)} paragraphs in {elapsed:.1f}s "
+          f"({rate:.1f} paragraphs/min, concurrency={concurrency})")
 
 
 if __name__ == "__main__":
@@ -152,11 +230,21 @@ if __name__ == "__main__":
     parser.add_argument("--out", type=str, required=True, help="Path to output QA .jsonl file")
     parser.add_argument("--min_chars", type=int, default=DEFAULT_MIN_CHARS, help="Minimum characters per paragraph")
     parser.add_argument("--max_paras", type=int, default=None, help="Maximum number of paragraphs to process")
+    parser.add_argument("--concurrency", type=int, default=1,
+                        help="Parallel LLM requests (also raises the Ollama client limit for the model "
+                             "unless OLLAMA_MODEL_CONCURRENCY sets it)")
+    parser.add_argument("--embed_batch_size", type=int, default=DEFAULT_EMBED_BATCH_SIZE,
+                        help="Batch size for embedding sentences and questions")
     args = parser.parse_args()
 
+    if OLLAMA_MODEL not in ollama.model_concurrency:
+        ollama.set_model_concurrency(OLLAMA_MODEL, args.concurrency)
+
     generate_qa_file(
         pdf_path=Path(args.pdf),
         output_path=Path(args.out),
         min_chars=args.min_chars,
-        max_paras=args.max_paras
+        max_paras=args.max_paras,
+        concurrency=args.concurrency,
+        embed_batch_size=args.embed_batch_size
     )
@@ -0,0 +1,134 @@
+# answer_cache.py
+"""
+Cache of LLM answers in front of query_ollama.
+
+Exact hits are keyed by (llm model, index identity, retrieved context ids,
+normalized question). With semantic mode enabled, a new question also hits
+when its embedding is within a cosine-similarity threshold of a cached
+question for the same book and LLM. Entries expire after a TTL and the
+least recently used are evicted beyond `max_entries`.
+"""
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from config import (
+    ANSWER_CACHE_MAX_ENTRIES, ANSWER_CACHE_TTL_SECONDS,
+    ANSWER_CACHE_SEMANTIC, ANSWER_CACHE_SIM_THRESHOLD
+)
+from query_cache import normalize_query
+
+
+class _Entry:
+    __slots__ = ("answer", "created", "scope", "q_vec")
+
+    def __init__(self, answer, scope, q_vec):
+        self.answer = answer
+        self.created = time.time()
+        self.scope = scope
+        self.q_vec = q_vec
+
+
+class AnswerCache:
+    def __init__(self, max_entries=ANSWER_CACHE_MAX_ENTRIES, ttl_seconds=ANSWER_CACHE_TTL_SECONDS,
+                 semantic=ANSWER_CACHE_SEMANTIC, sim_threshold=ANSWER_CACHE_SIM_THRESHOLD):
+        """
+        max_entries:   LRU size bound
+        ttl_seconds:   lifetime of an answer
+        semantic:      also match on query-embedding similarity
+        sim_threshold: minimum cosine similarity for a semantic hit
+        """
+        self.max_entries = max_entries
+        self.ttl = ttl_seconds
+        self.semantic = semantic
+        self.sim_threshold = sim_threshold
+        self._entries = OrderedDict()   # key -> _Entry
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    @staticmethod
+    def make_key(llm_model, book, context_ids, question):
+        raw = json.dumps([llm_model, book, list(context_ids), normalize_query(question)])
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, llm_model, book, context_ids, question):
+        """Exact lookup; returns the cached answer or None."""
+        key = self.make_key(llm_model, book, context_ids, question)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(key, entry):
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.exact_hits += 1
+            return entry.answer
+
+    def get_semantic(self, llm_model, book, q_vec):
+        """Nearest cached question for this book/LLM above the threshold, or None."""
+        if not self.semantic:
+            return None
+        q = _unit(q_vec)
+        scope = (llm_model, book)
+        with self._lock:
+            candidates = [(k, e) for k, e in self._entries.items()
+                          if e.scope == scope and e.q_vec is not None]
+            candidates = [(k, e) for k, e in candidates if not self._expired(k, e)]
+            if not candidates:
+                return None
+            sims = np.stack([e.q_vec for _, e in candidates]) @ q
+            best = int(np.argmax(sims))
+            if sims[best] < self.sim_threshold:
+                return None
+            key, entry = candidates[best]
+            self._entries.move_to_end(key)
+            self.semantic_hits += 1
+            return entry.answer
+
+    def put(self, llm_model, book, context_ids, question, answer, q_vec=None):
+        key = self.make_key(llm_model, book, context_ids, question)
+        entry = _Entry(answer, (llm_model, book), _unit(q_vec) if q_vec is not None else None)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _expired(self, key, entry) -> bool:
+        """Drop the entry if its TTL has passed (caller holds the lock)."""
+        if time.time() - entry.created <= self.ttl:
+            return False
+        del self._entries[key]
+        self.expirations += 1
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            hits = self.exact_hits + self.semantic_hits
+            lookups = hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+            }
+
+
+def _unit(vec):
+    vec = np.asarray(vec, dtype=np.float32)
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm > 0 else vec
@@ -0,0 +1,292 @@
+# bm25_index.py
+"""
+Lexical BM25 index stored next to each FAISS index (`<index>.bm25`), plus
+the rank fusion used by hybrid retrieval.
+
+Embeddings blur exact terms ("Bernoulli", "Chebyshev", symbols such as
+"σ" or "≤"); BM25 over the same chunks catches them. Document ids are the
+chunk positions, i.e. the same ids FAISS returns.
+
+File layout (integers little-endian):
+
+    magic    8 bytes  b"BBBM2501"
+    hlen     uint64   length of the JSON header
+    header   JSON     counts, BM25 parameters and section offsets
+    vocab    UTF-8    terms joined by "\n" (term id = line number)
+    doc_len  uint32   tokens per document
+    offsets  uint64   n_terms + 1 posting list boundaries
+    doc_ids  uint32   postings, grouped by term, ascending doc id
+    tfs      uint16   term frequency of each posting
+
+The file is memory-mapped; a query only touches the posting lists of its
+own terms.
+"""
+
+import json
+import mmap
+import os
+import re
+import struct
+import tempfile
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from config import BM25_K1, BM25_B, HYBRID_RRF_K, HYBRID_VECTOR_WEIGHT
+
+MAGIC = b"BBBM2501"
+BM25_EXT = ".bm25"
+_HEADER = struct.Struct("<8sQ")
+_POSTING = np.dtype([("term", "<u4"), ("doc", "<u4"), ("tf", "<u2")])
+
+# Words (incl. Greek letters and digits) and single non-ASCII math symbols
+_TOKEN_RE = re.compile(r"\w+|[^\w\s\x00-\x7f]")
+STOPWORDS = frozenset("""
+a an and are as at be by can do does for from has have how if in into is it its of on or
+that the their then there these this to was what when where which who why will with
+""".split())
+
+
+def tokenize(text: str) -> list:
+    return [t for t in _TOKEN_RE.findall(text.casefold()) if t not in STOPWORDS]
+
+
+def bm25_path(index_path: str) -> str:
+    return f"{index_path}{BM25_EXT}"
+
+
+# ========== Building ==========
+class BM25Writer:
+    """
+    Accumulates documents in order and writes the index on `close`.
+    Postings are spooled to a temporary file, so memory holds only the
+    vocabulary, document lengths and document frequencies.
+    """
+
+    SPILL_BLOCK = 1 << 20   # postings placed per step when writing
+
+    def __init__(self, path: str, k1: float = BM25_K1, b: float = BM25_B):
+        self.path = path
+        self.k1, self.b = k1, b
+        self._vocab = {}
+        self._df = np.zeros(1024, dtype=np.int64)
+        self._doc_len = array("I")
+        self._n_postings = 0
+        self._spill = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def add_many(self, texts):
+        terms, docs, tfs = array("I"), array("I"), array("H")
+        for text in texts:
+            counts = Counter(tokenize(text))
+            doc = len(self._doc_len)
+            self._doc_len.append(sum(counts.values()))
+            for term, tf in counts.items():
+                terms.append(self._vocab.setdefault(term, len(self._vocab)))
+                docs.append(doc)
+                tfs.append(min(tf, 0xFFFF))
+        if not terms:
+            return
+        block = np.empty(len(terms), dtype=_POSTING)
+        block["term"], block["doc"], block["tf"] = terms, docs, tfs
+        self._spill.write(block.tobytes())
+        self._n_postings += len(block)
+
+        if len(self._vocab) > len(self._df):
+            self._df = np.concatenate([self._df, np.zeros(len(self._vocab) * 2 - len(self._df), dtype=np.int64)])
+        self._df[:len(self._vocab)] += np.bincount(block["term"], minlength=len(self._vocab))
+
+    def close(self):
+        n_terms, n_docs = len(self._vocab), len(self._doc_len)
+        vocab = "\n".join(sorted(self._vocab, key=self._vocab.get)).encode("utf-8")
+        offsets = np.zeros(n_terms + 1, dtype="<u8")
+        np.cumsum(self._df[:n_terms], out=offsets[1:])
+
+        sections, pos = {}, 0
+        for name, dtype, count in (("vocab", "u1", len(vocab)), ("doc_len", "<u4", n_docs),
+                                   ("offsets", "<u8", n_terms + 1), ("doc_ids", "<u4", self._n_postings),
+                                   ("tfs", "<u2", self._n_postings)):
+            sections[name] = [pos, dtype, count]
+            pos += -(-count * np.dtype(dtype).itemsize // 8) * 8   # keep sections 8-byte aligned
+        header = json.dumps({
+            "n_docs": n_docs, "n_terms": n_terms, "n_postings": self._n_postings,
+            "avgdl": (sum(self._doc_len) / n_docs) if n_docs else 0.0,
+            "k1": self.k1, "b": self.b, "sections": sections
+        }).encode("utf-8")
+        header += b" " * (-(len(header) + _HEADER.size) % 8)
+        base = _HEADER.size + len(header)
+
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, len(header)))
+            f.write(header)
+            for name, data in (("vocab", vocab), ("doc_len", np.frombuffer(self._doc_len, np.uint32).astype("<u4")),
+                               ("offsets", offsets)):
+                f.seek(base + sections[name][0])
+                f.write(bytes(data))
+            f.truncate(base + pos)
+
+        if self._n_postings:
+            doc_ids = np.memmap(tmp, dtype="<u4", mode="r+", offset=base + sections["doc_ids"][0],
+                                shape=(self._n_postings,))
+            tfs = np.memmap(tmp, dtype="<u2", mode="r+", offset=base + sections["tfs"][0],
+                            shape=(self._n_postings,))
+            # Documents were added in order, so a stable placement keeps each list sorted by doc id
+            cursor = offsets[:-1].astype(np.int64)
+            self._spill.seek(0)
+            while True:
+                block = np.frombuffer(self._spill.read(self.SPILL_BLOCK * _POSTING.itemsize), dtype=_POSTING)
+                if not len(block):
+                    break
+                order = np.argsort(block["term"], kind="stable")
+                terms = block["term"][order].astype(np.int64)
+                counts = np.bincount(terms, minlength=n_terms)
+                rank = np.arange(len(terms)) - (np.cumsum(counts) - counts)[terms]
+                dest = cursor[terms] + rank
+                doc_ids[dest] = block["doc"][order]
+                tfs[dest] = block["tf"][order]
+                cursor += counts
+            doc_ids.flush()
+            tfs.flush()
+            del doc_ids, tfs
+        self._spill.close()
+        os.replace(tmp, self.path)
+
+    def abort(self):
+        self._spill.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def write_bm25(texts, path: str):
+    """Build and save the BM25 index of `texts` (document id = position)."""
+    with BM25Writer(path) as writer:
+        writer.add_many(texts)
+
+
+# ========== Searching ==========
+class BM25Index:
+    """Read-only BM25 index over a memory-mapped .bm25 file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, hlen = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} is not a BM25 index")
+        header = json.loads(self._mm[_HEADER.size:_HEADER.size + hlen])
+        base = _HEADER.size + hlen
+
+        def section(name):
+            offset, dtype, count = header["sections"][name]
+            return np.frombuffer(self._mm, dtype=dtype, count=count, offset=base + offset)
+
+        self.n_docs = header["n_docs"]
+        self.avgdl = header["avgdl"] or 1.0
+        self.k1, self.b = header["k1"], header["b"]
+        vocab = bytes(section("vocab")).decode("utf-8")
+        self.vocab = {term: i for i, term in enumerate(vocab.split("\n"))} if vocab else {}
+        self.doc_len = section("doc_len")
+        self.offsets = section("offsets")
+        self.doc_ids = section("doc_ids")
+        self.tfs = section("tfs")
+        df = np.diff(self.offsets).astype(np.float64)
+        self.idf = np.log1p((self.n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    def __len__(self) -> int:
+        return self.n_docs
+
+    def search(self, query: str, k: int):
+        """(scores, doc ids) of the k best documents, best first; may return fewer than k."""
+        term_ids = sorted({self.vocab[t] for t in tokenize(query) if t in self.vocab})
+        docs, contribs = [], []
+        for t in term_ids:
+            start, end = int(self.offsets[t]), int(self.offsets[t + 1])
+            d = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            norm = self.k1 * (1 - self.b + self.b * self.doc_len[d] / self.avgdl)
+            docs.append(d)
+            contribs.append(self.idf[t] * tf * (self.k1 + 1) / (tf + norm))
+        if not docs:
+            return np.empty(0, dtype=np.float32), np.empty(0, dtype=np.int64)
+
+        docs, contribs = np.concatenate(docs), np.concatenate(contribs)
+        ids, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=contribs).astype(np.float32)
+        if len(ids) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            ids, scores = ids[top], scores[top]
+        order = np.lexsort((ids, -scores))
+        return scores[order], ids[order].astype(np.int64)
+
+    def resident_bytes(self) -> int:
+        """Heap cost of an open index; postings stay mapped."""
+        return sum(len(t) + 80 for t in self.vocab) + self.idf.nbytes
+
+    def close(self):
+        self.doc_len = self.offsets = self.doc_ids = self.tfs = None
+        self._mm.close()
+
+
+def load_bm25(index_path: str):
+    """BM25 index stored next to a FAISS index, or None for indexes built without one."""
+    path = bm25_path(index_path)
+    return BM25Index(path) if os.path.exists(path) else None
+
+
+# ========== Fusion ==========
+def reciprocal_rank_fusion(rankings, k: int = HYBRID_RRF_K, weights=None) -> list:
+    """
+    Fuse ranked id lists: score(d) = sum_i w_i / (k + rank_i(d)), ranks from 1.
+    Returns [(id, score)] best first.
+    """
+    weights = weights or [1.0] * len(rankings)
+    scores = {}
+    for ranking, w in zip(rankings, weights):
+        for rank, doc in enumerate(ranking, start=1):
+            scores[doc] = scores.get(doc, 0.0) + w / (k + rank)
+    return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+
+def weighted_fusion(scored, weights) -> list:
+    """
+    Fuse [(ids, scores)] lists (higher score = better) by min-max normalizing
+    each list to [0, 1] and summing with `weights`; ids missing from a list
+    get 0 from it. Returns [(id, score)] best first.
+    """
+    fused = {}
+    for (ids, scores), w in zip(scored, weights):
+        if not len(ids):
+            continue
+        scores = np.asarray(scores, dtype=np.float64)
+        span = scores.max() - scores.min()
+        norm = (scores - scores.min()) / span if span > 0 else np.ones_like(scores)
+        for doc, s in zip(ids, norm):
+            fused[int(doc)] = fused.get(int(doc), 0.0) + w * float(s)
+    return sorted(fused.items(), key=lambda item: (-item[1], item[0]))
+
+
+def hybrid_fuse(vector_ids, vector_scores, bm25_ids, bm25_scores, k: int, fusion: str = "rrf",
+                vector_weight: float = HYBRID_VECTOR_WEIGHT) -> list:
+    """Top-k ids from a vector ranking and a BM25 ranking (scores: higher = better)."""
+    if fusion == "rrf":
+        fused = reciprocal_rank_fusion([list(vector_ids), list(bm25_ids)],
+                                       weights=[2 * vector_weight, 2 * (1 - vector_weight)])
+    elif fusion == "weighted":
+        fused = weighted_fusion([(vector_ids, vector_scores), (bm25_ids, bm25_scores)],
+                                [vector_weight, 1 - vector_weight])
+    else:
+        raise ValueError(f"Unknown fusion {fusion!r}; expected 'rrf' or 'weighted'")
+    return [int(doc) for doc, _ in fused[:k]]
@@ -1,19 +1,72 @@
 # build_faiss_index_core.py
 
+import hashlib
 import json
-from sentence_transformers import SentenceTransformer
-import faiss
+import time
 import numpy as np
+from sentence_transformers import SentenceTransformer
 from pathlib import Path
+from tqdm import tqdm
+from config import FAISS_INDEX_TYPE, FAISS_METRIC, STREAM_BATCH_SIZE
+from bm25_index import BM25Writer, bm25_path, write_bm25
+from chunk_store import id_map_writer, write_id_map
+from embedding_store import embedding_store
+from faiss_index import build_index, create_index, normalize, train_index, train_size, training_rows, write_index
+
+
+def chunk_hash(context: str) -> str:
+    """Content key of a chunk; together with the model name it identifies an embedding."""
+    return hashlib.sha256(context.encode("utf-8")).hexdigest()
+
+
+def lazy_encoder(model_name: str, show_progress_bar: bool = False):
+    """encode(texts) -> array; the model is only loaded if something needs encoding."""
+    model = None
+
+    def encode(texts):
+        nonlocal model
+        model = model or SentenceTransformer(model_name, trust_remote_code=True)
+        return model.encode(texts, show_progress_bar=show_progress_bar, convert_to_numpy=True)
+    return encode
+
+
+def iter_chunk_batches(jsonl_path: str, batch_size: int):
+    """Lists of id_map entries (at most batch_size each), reading the JSONL line by line."""
+    batch = []
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for i, line in enumerate(f):
+            obj = json.loads(line)
+            ctx = obj.get("context", "").strip()
+            if len(ctx) > 30:
+                batch.append({
+                    "index": i,
+                    "context": ctx,
+                    "question": obj.get("question", ""),
+                    "chunk_hash": chunk_hash(ctx)
+                })
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+    if batch:
+        yield batch
 
 
 def build_index_with_model(
     jsonl_path: str,
     model_name: str,
     index_out_path: str,
-    id_map_out_path: str
+    id_map_out_path: str,
+    store=None,
+    index_type: str = FAISS_INDEX_TYPE,
+    metric: str = FAISS_METRIC,
+    **index_params
 ):
-    """Encode contexts with specified model and build FAISS index."""
+    """
+    Encode contexts with specified model and build FAISS index.
+    Embeddings come from the chunk embedding store; only chunks it has not
+    seen with this model are encoded (and then added to it).
+    index_type/metric/index_params select the FAISS index (see faiss_index.py).
+    """
     print(f"\n[Embedding] Using model: {model_name}")
     print(f"[Input] Loading: {jsonl_path}")
 
@@ -27,23 +80,115 @@ def build_index_with_model(
                 id_map.append({
                     "index": i,
                     "context": ctx,
-                    "question": obj.get("question", "")
+                    "question": obj.get("question", ""),
+                    "chunk_hash": chunk_hash(ctx)
                 })
 
-    print(f"[Encoding] Total contexts: {len(contexts)}")
-    model = SentenceTransformer(model_name, trust_remote_code=True)
-    embeddings = model.encode(contexts, show_progress_bar=True, convert_to_numpy=True)
+    store = store or embedding_store
+    encode = lazy_encoder(model_name, show_progress_bar=True)
+    hashes = [item["chunk_hash"] for item in id_map]
+    embeddings, encoded = store.get_or_encode(model_name, hashes, contexts, encode)
+    print(f"[Encoding] Total contexts: {len(contexts)} (from store {len(contexts) - encoded}, encoded {encoded})")
+
+    t_build = time.perf_counter()
+    index, meta = build_index(embeddings, index_type, metric, **index_params)
+    meta["build_seconds"] = round(time.perf_counter() - t_build, 3)
+    print(f"[Index] {meta['index_type']} ({meta['metric']}) over {index.ntotal} vectors in {meta['build_seconds']}s")
+
+    write_index(index, {**meta, "embed_model": model_name}, index_out_path)
+    write_bm25(contexts, bm25_path(index_out_path))
+    write_id_map(id_map, id_map_out_path)
+
+    print(f"[Saved] Index → {index_out_path} (+ BM25)")
+    print(f"[Saved] ID Map → {id_map_out_path}")
+    return {"total": len(contexts), "reused": len(contexts) - encoded, "encoded": encoded}
+
+def build_index_streaming(
+    jsonl_path: str,
+    model_name: str,
+    index_out_path: str,
+    id_map_out_path: str,
+    store=None,
+    index_type: str = FAISS_INDEX_TYPE,
+    metric: str = FAISS_METRIC,
+    batch_size: int = STREAM_BATCH_SIZE,
+    **index_params
+):
+    """
+    Same output as build_index_with_model, built batch by batch so memory
+    does not grow with the input: one batch of chunks and vectors is held at
+    a time, chunk records are appended to the id_map as they are read and
+    vectors go straight into the index (plus, for IVF types, a training
+    sample capped at faiss_index.MAX_TRAIN_POINTS). BM25 postings are
+    spooled to disk the same way.
+
+    Flat/HNSW indexes are filled in a single pass. IVF indexes are trained
+    on the sample collected during that pass and filled in a second pass
+    that reads the vectors back from the embedding store.
+    """
+    print(f"\n[Embedding] Using model: {model_name} (streaming, batch size {batch_size})")
+    print(f"[Input] Counting chunks: {jsonl_path}")
+    n_chunks = sum(len(batch) for batch in iter_chunk_batches(jsonl_path, batch_size))
+    if not n_chunks:
+        raise ValueError(f"No usable chunks in {jsonl_path}")
+
+    store = store or embedding_store
+    encode = lazy_encoder(model_name)
+    index = meta = sample_rows = None
+    samples, encoded, start = [], 0, 0
+    build_seconds = 0.0   # training and adding only, comparable with build_index_with_model
+
+    def prepare(vectors):
+        return normalize(vectors) if metric == "cosine" else vectors
+
+    with id_map_writer(id_map_out_path) as id_map, BM25Writer(bm25_path(index_out_path)) as bm25, \
+            tqdm(total=n_chunks, unit="chunk", desc="Embedding") as progress:
+        for batch in iter_chunk_batches(jsonl_path, batch_size):
+            vectors, n_encoded = store.get_or_encode(model_name, [item["chunk_hash"] for item in batch],
+                                                     [item["context"] for item in batch], encode)
+            vectors = prepare(vectors)
+            encoded += n_encoded
+            for item in batch:
+                id_map.append(item)
+            bm25.add_many(item["context"] for item in batch)
 
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
+            if index is None:
+                index, meta = create_index(vectors.shape[1], n_chunks, index_type, metric, **index_params)
+                if not index.is_trained:
+                    sample_rows = training_rows(n_chunks, train_size(meta, n_chunks))
+            if index.is_trained:
+                t_add = time.perf_counter()
+                index.add(vectors)
+                build_seconds += time.perf_counter() - t_add
+            elif sample_rows is None:
+                samples.append(vectors)
+            else:
+                lo, hi = np.searchsorted(sample_rows, [start, start + len(batch)])
+                samples.append(vectors[sample_rows[lo:hi] - start])
+            start += len(batch)
+            progress.update(len(batch))
 
-    faiss.write_index(index, index_out_path)
-    with open(id_map_out_path, "w", encoding="utf-8") as f:
-        json.dump(id_map, f, ensure_ascii=False, indent=2)
+    if not index.is_trained:
+        t_train = time.perf_counter()
+        train_index(index, meta, np.concatenate(samples))
+        build_seconds += time.perf_counter() - t_train
+        del samples
+        for batch in tqdm(iter_chunk_batches(jsonl_path, batch_size), total=-(-n_chunks // batch_size),
+                          unit="batch", desc="Adding to IVF"):
+            vectors, _ = store.get_or_encode(model_name, [item["chunk_hash"] for item in batch],
+                                             [item["context"] for item in batch], encode)
+            vectors = prepare(vectors)
+            t_add = time.perf_counter()
+            index.add(vectors)
+            build_seconds += time.perf_counter() - t_add
+    meta["build_seconds"] = round(build_seconds, 3)
+    print(f"[Encoding] Total contexts: {n_chunks} (from store {n_chunks - encoded}, encoded {encoded})")
+    print(f"[Index] {meta['index_type']} ({meta['metric']}) over {index.ntotal} vectors in {meta['build_seconds']}s")
 
-    print(f"[Saved] Index → {index_out_path}")
+    write_index(index, {**meta, "embed_model": model_name}, index_out_path)
+    print(f"[Saved] Index → {index_out_path} (+ BM25)")
     print(f"[Saved] ID Map → {id_map_out_path}")
+    return {"total": n_chunks, "reused": n_chunks - encoded, "encoded": encoded}
 
 import argparse
 
@@ -52,15 +197,32 @@ if __name__ == "__main__":
     parser.add_argument("jsonl_path", type=str, help="Path to input QA .jsonl file")
     parser.add_argument("model_name", type=str, help="Embedding model name")
     parser.add_argument("index_out_path", type=str, help="Path to save FAISS index")
-    parser.add_argument("id_map_out_path", type=str, help="Path to save ID map")
+    parser.add_argument("id_map_out_path", type=str, help="Path to save ID map (.chunks, or legacy .json)")
+    parser.add_argument("--index_type", type=str, default=FAISS_INDEX_TYPE,
+                        help="auto | flat | hnsw | ivf_flat | ivf_pq")
+    parser.add_argument("--metric", type=str, default=FAISS_METRIC, help="cosine | l2")
+    parser.add_argument("--nlist", type=int, default=None, help="IVF lists (default ~4*sqrt(n))")
+    parser.add_argument("--nprobe", type=int, default=None, help="IVF lists searched per query")
+    parser.add_argument("--ef_search", type=int, default=None, help="HNSW search breadth")
+    parser.add_argument("--stream", action="store_true", help="Bounded-memory build, batch by batch")
+    parser.add_argument("--batch_size", type=int, default=STREAM_BATCH_SIZE, help="Chunks per batch with --stream")
     args = parser.parse_args()
 
-    build_index_with_model(
+    build_args = dict(
         jsonl_path=args.jsonl_path,
         model_name=args.model_name,
         index_out_path=args.index_out_path,
-        id_map_out_path=args.id_map_out_path
+        id_map_out_path=args.id_map_out_path,
+        index_type=args.index_type,
+        metric=args.metric,
+        nlist=args.nlist,
+        nprobe=args.nprobe,
+        ef_search=args.ef_search
     )
+    if args.stream:
+        build_index_streaming(batch_size=args.batch_size, **build_args)
+    else:
+        build_index_with_model(**build_args)
 
     result = {
         "success": True,
@@ -0,0 +1,197 @@
+# chunk_store.py
+"""
+Compact, memory-mapped replacement for the id_map JSON files.
+
+File layout (all integers little-endian uint64):
+
+    magic   8 bytes  b"BBCHNK01"
+    n       number of chunks
+    offsets n + 1 byte offsets into the blob
+    blob    one compact UTF-8 JSON object per chunk
+            ({"index", "context", "question", "chunk_hash"})
+
+Opening a store only maps the file; `store[i]` decodes a single record, so a
+query that needs three contexts reads three records instead of parsing the
+whole id_map. `load_id_map` accepts both this format and legacy JSON.
+"""
+
+import argparse
+import json
+import mmap
+import os
+import shutil
+import struct
+import tempfile
+from array import array
+
+import numpy as np
+
+MAGIC = b"BBCHNK01"
+CHUNK_STORE_EXT = ".chunks"
+_HEADER = struct.Struct("<8sQ")
+
+
+class ChunkStore:
+    """Read-only, list-like view of a .chunks file."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self._n = _HEADER.unpack_from(self._mm, 0)
+        if magic != MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} is not a chunk store")
+        self._offsets = np.frombuffer(self._mm, dtype="<u8", count=self._n + 1, offset=_HEADER.size)
+        self._blob_start = _HEADER.size + 8 * (self._n + 1)
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __getitem__(self, i: int) -> dict:
+        # No wrap-around for negative ids: FAISS pads missing results with -1,
+        # which must fail rather than silently return the last chunk
+        if not 0 <= i < self._n:
+            raise IndexError("chunk index out of range")
+        start, end = int(self._offsets[i]), int(self._offsets[i + 1])
+        return json.loads(self._mm[self._blob_start + start:self._blob_start + end])
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self[i]
+
+    def resident_bytes(self) -> int:
+        """Heap cost of an open store; record pages are mapped, not copied."""
+        return 8 * (self._n + 1) + 256
+
+    def close(self):
+        self._offsets = None
+        self._mm.close()
+
+
+class ChunkStoreWriter:
+    """
+    Streams records into a .chunks file. Records are spooled to a temporary
+    file as they arrive and only the offsets (8 bytes per chunk) stay in
+    memory; `close` assembles the final file and swaps it in atomically.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._blob = tempfile.TemporaryFile(dir=os.path.dirname(os.path.abspath(path)))
+        self._offsets = array("Q", [0])
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def append(self, entry: dict):
+        data = json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        self._blob.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+
+    def close(self):
+        tmp = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(MAGIC, len(self)))
+            f.write(np.frombuffer(self._offsets, dtype=np.uint64).astype("<u8").tobytes())
+            self._blob.seek(0)
+            shutil.copyfileobj(self._blob, f, 1 << 20)
+        self._blob.close()
+        os.replace(tmp, self.path)
+
+    def abort(self):
+        self._blob.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class JsonIdMapWriter:
+    """Streaming writer for legacy id_map JSON (same layout as json.dump(indent=2))."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._tmp = f"{path}.{os.getpid()}.tmp"
+        self._f = open(self._tmp, "w", encoding="utf-8")
+        self._f.write("[")
+        self._n = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    def append(self, entry: dict):
+        data = json.dumps(entry, ensure_ascii=False, indent=2).replace("\n", "\n  ")
+        self._f.write(("," if self._n else "") + "\n  " + data)
+        self._n += 1
+
+    def close(self):
+        self._f.write("\n]" if self._n else "]")
+        self._f.close()
+        os.replace(self._tmp, self.path)
+
+    def abort(self):
+        self._f.close()
+        os.remove(self._tmp)
+
+    __enter__ = ChunkStoreWriter.__enter__
+    __exit__ = ChunkStoreWriter.__exit__
+
+
+def write_chunk_store(entries, path: str):
+    """Write entries (dicts) to a .chunks file atomically."""
+    with ChunkStoreWriter(path) as writer:
+        for entry in entries:
+            writer.append(entry)
+
+
+def is_chunk_store(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_id_map(path: str):
+    """ChunkStore for .chunks files, a list for legacy id_map JSON."""
+    if is_chunk_store(path):
+        return ChunkStore(path)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def id_map_writer(path: str):
+    """Streaming writer in the format implied by the extension (.chunks or legacy JSON)."""
+    if path.endswith(CHUNK_STORE_EXT):
+        return ChunkStoreWriter(path)
+    return JsonIdMapWriter(path)
+
+
+def write_id_map(id_map: list, path: str):
+    """Write in the format implied by the extension (.chunks or legacy JSON)."""
+    if path.endswith(CHUNK_STORE_EXT):
+        write_chunk_store(id_map, path)
+    else:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(id_map, f, ensure_ascii=False, indent=2)
+
+
+def convert_json_id_map(json_path: str, out_path: str = None) -> str:
+    """Convert a legacy id_map_*.json file; returns the .chunks path."""
+    out_path = out_path or os.path.splitext(json_path)[0] + CHUNK_STORE_EXT
+    with open(json_path, "r", encoding="utf-8") as f:
+        write_chunk_store(json.load(f), out_path)
+    return out_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert id_map JSON files to the binary chunk store")
+    parser.add_argument("json_paths", nargs="+", help="id_map_*.json files")
+    args = parser.parse_args()
+
+    for json_path in args.json_paths:
+        out = convert_json_id_map(json_path)
+        print(f"[Converted] {json_path} ({os.path.getsize(json_path)} B) → {out} ({os.path.getsize(out)} B)")
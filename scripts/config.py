@@ -34,3 +34,113 @@ MODEL_NAME = "all-MiniLM-L6-v2"
 OLLAMA_URL = "http://localhost:11434/api/generate"
 OLLAMA_MODEL = "gemma3:latest"
 
+
+# ========== RAG Query Service ==========
+RAG_SERVER_HOST = os.environ.get("RAG_SERVER_HOST", "127.0.0.1")
+RAG_SERVER_PORT = int(os.environ.get("RAG_SERVER_PORT", "5001"))
+RAG_SERVER_WORKERS = int(os.environ.get("RAG_SERVER_WORKERS", "4"))
+
+# Memory budget for FAISS indexes + id_maps kept resident by the query service
+INDEX_CACHE_MAX_BYTES = int(os.environ.get("INDEX_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# RAM cap and idle timeout for the shared embedding model pool
+EMBED_POOL_MAX_BYTES = int(os.environ.get("EMBED_POOL_MAX_BYTES", str(4 * 1024 ** 3)))
+EMBED_POOL_IDLE_SECONDS = int(os.environ.get("EMBED_POOL_IDLE_SECONDS", "3600"))
+
+# Query micro-batching: wait up to MAX_WAIT_MS for up to MAX_SIZE concurrent queries
+EMBED_BATCH_MAX_SIZE = int(os.environ.get("EMBED_BATCH_MAX_SIZE", "32"))
+EMBED_BATCH_MAX_WAIT_MS = float(os.environ.get("EMBED_BATCH_MAX_WAIT_MS", "5"))
+
+# Query embedding cache: in-memory LRU + sqlite on disk
+QUERY_CACHE_DB = os.path.join(EMBEDDING_DIR, "query_cache.sqlite")
+QUERY_CACHE_MAX_ENTRIES = int(os.environ.get("QUERY_CACHE_MAX_ENTRIES", "10000"))
+QUERY_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("QUERY_CACHE_DISK_MAX_ENTRIES", "200000"))
+
+# LLM answer cache; semantic mode reuses answers for near-identical questions
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+ANSWER_CACHE_TTL_SECONDS = int(os.environ.get("ANSWER_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANSWER_CACHE_SEMANTIC = os.environ.get("ANSWER_CACHE_SEMANTIC", "0") == "1"
+ANSWER_CACHE_SIM_THRESHOLD = float(os.environ.get("ANSWER_CACHE_SIM_THRESHOLD", "0.95"))
+
+# ========== Ingestion Cache ==========
+# Content-addressed record of processed PDFs and the indexes built from them
+INGEST_MANIFEST = os.path.join(EMBEDDING_DIR, "ingest_manifest.json")
+
+# Chunk embeddings keyed by (model, chunk hash), shared by every index build
+EMBEDDING_STORE_DIR = os.path.join(EMBEDDING_DIR, "store")
+EMBEDDING_STORE_DTYPE = os.environ.get("EMBEDDING_STORE_DTYPE", "float32")  # or "float16"
+
+# FAISS index type for new builds: auto | flat | hnsw | ivf_flat | ivf_pq
+FAISS_INDEX_TYPE = os.environ.get("FAISS_INDEX_TYPE", "auto")
+# Similarity for new builds: "cosine" (normalized inner product) or "l2"
+FAISS_METRIC = os.environ.get("FAISS_METRIC", "cosine")
+# Chunks per batch in streaming index builds; inputs above the size
+# threshold are built by streaming instead of in one pass in memory
+STREAM_BATCH_SIZE = int(os.environ.get("STREAM_BATCH_SIZE", "4096"))
+STREAM_BUILD_MIN_BYTES = int(os.environ.get("STREAM_BUILD_MIN_BYTES", str(64 * 1024 ** 2)))
+
+# Lexical BM25 index written next to every FAISS index (<index>.bm25)
+BM25_K1 = float(os.environ.get("BM25_K1", "1.2"))
+BM25_B = float(os.environ.get("BM25_B", "0.75"))
+# Retrieval: "vector", "bm25" or "hybrid" (both rankings fused; indexes
+# without a .bm25 file fall back to vector). Fusion: "rrf" or "weighted".
+RETRIEVAL_MODE = os.environ.get("RETRIEVAL_MODE", "hybrid")
+HYBRID_FUSION = os.environ.get("HYBRID_FUSION", "rrf")
+HYBRID_CANDIDATES = int(os.environ.get("HYBRID_CANDIDATES", "20"))  # taken from each ranking
+HYBRID_RRF_K = int(os.environ.get("HYBRID_RRF_K", "60"))
+HYBRID_VECTOR_WEIGHT = float(os.environ.get("HYBRID_VECTOR_WEIGHT", "0.5"))
+
+# Optional cross-encoder rerank: score RERANK_CANDIDATES retrieved chunks on
+# CPU and keep the best top_k; past RERANK_BUDGET_MS the vector order is used
+RERANK_ENABLED = os.environ.get("RERANK_ENABLED", "0") == "1"
+RERANK_MODEL = os.environ.get("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANK_CANDIDATES = int(os.environ.get("RERANK_CANDIDATES", "20"))
+RERANK_BATCH_SIZE = int(os.environ.get("RERANK_BATCH_SIZE", "8"))
+RERANK_BUDGET_MS = float(os.environ.get("RERANK_BUDGET_MS", "200"))
+RERANK_MAX_LENGTH = int(os.environ.get("RERANK_MAX_LENGTH", "256"))  # tokens per (query, chunk) pair
+
+# Prompt assembly: retrieved context is deduplicated and trimmed to fit
+# PROMPT_MAX_TOKENS. Tokens are counted with a chars-per-token estimate that
+# is calibrated against the prompt_eval_count Ollama reports. Exact counts
+# with the Hugging Face tokenizer of an Ollama model family are opt-in
+# ("family=repo,family=repo", e.g. "qwen2.5=Qwen/Qwen2.5-7B-Instruct";
+# gated repos such as google/gemma-3-4b-it need an HF token).
+PROMPT_MAX_TOKENS = int(os.environ.get("PROMPT_MAX_TOKENS", "1024"))
+PROMPT_TOKENIZERS = {
+    family.strip(): repo.strip()
+    for family, _, repo in (item.partition("=") for item in os.environ.get("PROMPT_TOKENIZERS", "").split(","))
+    if family.strip() and repo.strip()
+}
+PROMPT_CHARS_PER_TOKEN = float(os.environ.get("PROMPT_CHARS_PER_TOKEN", "3.6"))
+PROMPT_DEDUPE_SIMILARITY = float(os.environ.get("PROMPT_DEDUPE_SIMILARITY", "0.8"))  # word-set Jaccard
+
+# Federated search over several books: parallel searches, FEDERATED_CANDIDATES
+# per book merged by calibrated score. Calibration "raw" compares similarities
+# directly (same embed model and metric everywhere), "zscore" standardizes
+# each book's scores for the query, "auto" picks raw when it is valid.
+FEDERATED_WORKERS = int(os.environ.get("FEDERATED_WORKERS", str(min(8, os.cpu_count() or 1))))
+FEDERATED_CANDIDATES = int(os.environ.get("FEDERATED_CANDIDATES", "20"))
+FEDERATED_CALIBRATION = os.environ.get("FEDERATED_CALIBRATION", "auto")
+
+# Library index: every uploaded book embedded with one model, in IndexIDMap
+# shards that take online adds and deletes. Compaction merges shards once
+# there are more than LIBRARY_MAX_SHARDS, or rewrites a shard whose deleted
+# share reaches LIBRARY_COMPACT_DELETED_RATIO.
+LIBRARY_DIR = os.path.join(EMBEDDING_DIR, "library")
+LIBRARY_INDEX_TYPE = os.environ.get("LIBRARY_INDEX_TYPE", "auto")
+LIBRARY_MAX_SHARDS = int(os.environ.get("LIBRARY_MAX_SHARDS", "8"))
+LIBRARY_COMPACT_DELETED_RATIO = float(os.environ.get("LIBRARY_COMPACT_DELETED_RATIO", "0.2"))
+LIBRARY_AUTO_ADD = os.environ.get("LIBRARY_AUTO_ADD", "1") == "1"  # add uploads to their model's library
+
+# ========== Ollama Client ==========
+OLLAMA_CONNECT_TIMEOUT = float(os.environ.get("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.environ.get("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_MAX_RETRIES = int(os.environ.get("OLLAMA_MAX_RETRIES", "2"))
+OLLAMA_RETRY_BACKOFF = float(os.environ.get("OLLAMA_RETRY_BACKOFF", "1.0"))
+# Concurrent generations per model; override per model with "name=n,name=n"
+OLLAMA_MAX_CONCURRENCY = int(os.environ.get("OLLAMA_MAX_CONCURRENCY", "2"))
+OLLAMA_MODEL_CONCURRENCY = {
+    name.strip(): int(n)
+    for name, _, n in (item.rpartition("=") for item in os.environ.get("OLLAMA_MODEL_CONCURRENCY", "").split(","))
+    if name.strip()
+}
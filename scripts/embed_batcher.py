@@ -0,0 +1,89 @@
+# embed_batcher.py
+"""
+Micro-batching layer for query embeddings.
+
+Concurrent callers submit single queries; a worker thread per embedding
+model waits up to `max_wait_ms` (or until `max_batch` queries are queued),
+encodes them with one `model.encode` call and hands each caller its own row.
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from config import EMBED_BATCH_MAX_SIZE, EMBED_BATCH_MAX_WAIT_MS
+
+
+class EmbedBatcher:
+    def __init__(self, pool, max_batch=EMBED_BATCH_MAX_SIZE, max_wait_ms=EMBED_BATCH_MAX_WAIT_MS):
+        """
+        pool:        ModelPool providing the embedding models
+        max_batch:   maximum queries encoded in one call
+        max_wait_ms: how long the first query of a batch waits for company
+        """
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queues = {}
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.items = 0
+
+    def encode(self, model_name, text):
+        """Embed one text, sharing the encode call with concurrent callers."""
+        future = Future()
+        self._queue_for(model_name).put((text, future))
+        return future.result()
+
+    def _queue_for(self, model_name):
+        with self._lock:
+            q = self._queues.get(model_name)
+            if q is None:
+                q = queue.Queue()
+                self._queues[model_name] = q
+                worker = threading.Thread(
+                    target=self._run, args=(model_name, q),
+                    name=f"embed-batcher-{model_name}", daemon=True
+                )
+                worker.start()
+        return q
+
+    def _run(self, model_name, q):
+        while True:
+            batch = [q.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(q.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._encode_batch(model_name, batch)
+
+    def _encode_batch(self, model_name, batch):
+        texts = [text for text, _ in batch]
+        try:
+            with self.pool.acquire(model_name) as model:
+                vectors = model.encode(texts, batch_size=len(texts), convert_to_numpy=True)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        with self._lock:
+            self.batches += 1
+            self.items += len(batch)
+        for (_, future), vec in zip(batch, vectors):
+            future.set_result(vec)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "batches": self.batches,
+                "queries": self.items,
+                "avg_batch_size": round(self.items / self.batches, 2) if self.batches else 0.0,
+                "max_batch": self.max_batch,
+                "max_wait_ms": self.max_wait * 1000.0
+            }
@@ -0,0 +1,286 @@
+# embedding_store.py
+"""
+On-disk store of chunk embeddings keyed by (embed model, chunk_hash).
+
+Each model has its own directory of append-only shards and a small manifest
+listing them:
+
+    <root>/<model slug>/manifest.json
+    <root>/<model slug>/shard_00000_<id>.npy          (rows x dim, float32 or float16)
+    <root>/<model slug>/shard_00000_<id>.hashes.npy   (rows chunk hashes, S64)
+
+Shards and hash lists are opened memory-mapped. Lookups go through a per
+shard sorted table of 64-bit hash prefixes (16 bytes per chunk in RAM) and
+are confirmed against the full hash, so memory stays small even for
+millions of chunks and a lookup only reads the rows it needs. Vectors are
+always returned as float32; float16 storage halves the disk footprint at a
+small precision cost.
+"""
+
+import json
+import os
+import re
+import threading
+import uuid
+from contextlib import contextmanager
+
+import numpy as np
+
+from config import EMBEDDING_STORE_DIR, EMBEDDING_STORE_DTYPE
+
+try:
+    import fcntl
+except ImportError:   # Windows: writers are only serialized within the process
+    fcntl = None
+
+# Upper bound on rows written to a single shard
+SHARD_ROWS = 65536
+HASH_DTYPE = np.dtype("S64")
+_HEX = np.full(256, 0, dtype=np.uint64)
+_HEX[np.frombuffer(b"0123456789", np.uint8)] = np.arange(10, dtype=np.uint64)
+_HEX[np.frombuffer(b"abcdef", np.uint8)] = np.arange(10, 16, dtype=np.uint64)
+
+
+def hash_prefix_keys(hashes) -> np.ndarray:
+    """uint64 of the first 16 hex digits of each chunk hash."""
+    raw = np.ascontiguousarray(hashes, dtype=HASH_DTYPE).view(np.uint8).reshape(-1, HASH_DTYPE.itemsize)
+    keys = np.zeros(len(raw), dtype=np.uint64)
+    for col in range(16):
+        keys = (keys << np.uint64(4)) | _HEX[raw[:, col]]
+    return keys
+
+
+class _Shard:
+    """One shard's memmaps plus its sorted prefix table."""
+
+    def __init__(self, model_dir, entry):
+        self.vectors_file = os.path.join(model_dir, entry["file"])
+        if isinstance(entry["hashes"], list):
+            # Older manifests listed the hashes inline
+            self.hashes = np.asarray(entry["hashes"], dtype=HASH_DTYPE)
+        else:
+            self.hashes = np.load(os.path.join(model_dir, entry["hashes"]), mmap_mode="r")
+        keys = hash_prefix_keys(self.hashes)
+        self.order = np.argsort(keys, kind="stable")
+        self.keys = keys[self.order]
+        self._vectors = None
+
+    @property
+    def vectors(self):
+        if self._vectors is None:
+            self._vectors = np.load(self.vectors_file, mmap_mode="r")
+        return self._vectors
+
+    def locate(self, keys, hashes):
+        """Rows of `hashes` in this shard (-1 where absent)."""
+        left = np.searchsorted(self.keys, keys, side="left")
+        right = np.searchsorted(self.keys, keys, side="right")
+        rows = np.full(len(keys), -1, dtype=np.int64)
+        single = np.flatnonzero(right - left == 1)
+        cand = self.order[left[single]]
+        confirmed = self.hashes[cand] == hashes[single]
+        rows[single[confirmed]] = cand[confirmed]
+        # Shared prefixes (non-hex or colliding hashes) are resolved one by one
+        for i in np.flatnonzero(right - left > 1):
+            for row in self.order[left[i]:right[i]]:
+                if self.hashes[row] == hashes[i]:
+                    rows[i] = row
+                    break
+        return rows
+
+
+class _ModelShards:
+    """Loaded manifest of one model plus its shards."""
+
+    def __init__(self, manifest, mtime):
+        self.manifest = manifest
+        self.mtime = mtime
+        self.shards = []
+
+
+class EmbeddingStore:
+    def __init__(self, root=EMBEDDING_STORE_DIR, dtype=EMBEDDING_STORE_DTYPE):
+        """
+        root:  directory holding one sub-directory per model
+        dtype: storage dtype for new models ("float32" or "float16")
+        """
+        self.root = root
+        self.dtype = np.dtype(dtype)
+        self._models = {}
+        self._lock = threading.Lock()
+
+    def _model_dir(self, model_name) -> str:
+        return os.path.join(self.root, re.sub(r"[^\w.-]+", "_", model_name))
+
+    def _manifest_path(self, model_name) -> str:
+        return os.path.join(self._model_dir(model_name), "manifest.json")
+
+    @contextmanager
+    def _manifest_locked(self, model_name):
+        """Serialize manifest writers across processes (caller holds the thread lock)."""
+        model_dir = self._model_dir(model_name)
+        os.makedirs(model_dir, exist_ok=True)
+        with open(os.path.join(model_dir, "manifest.lock"), "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _shards(self, model_name, reload=False) -> _ModelShards:
+        """
+        Current shards of a model (caller holds the lock). When another
+        process appended shards, only the new ones are opened. `reload`
+        re-reads the manifest even if its mtime looks unchanged (writers do
+        so under the file lock, where it must be exact).
+        """
+        path = self._manifest_path(model_name)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        cached = self._models.get(model_name)
+        if cached is not None and cached.mtime == mtime and not reload:
+            return cached
+        if mtime is None:
+            manifest = {"model": model_name, "dim": None, "dtype": self.dtype.name, "shards": []}
+        else:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+
+        state = _ModelShards(manifest, mtime)
+        if cached is not None and cached.manifest["shards"] == manifest["shards"][:len(cached.shards)]:
+            state.shards = cached.shards
+        model_dir = self._model_dir(model_name)
+        for entry in manifest["shards"][len(state.shards):]:
+            state.shards.append(_Shard(model_dir, entry))
+        self._models[model_name] = state
+        return state
+
+    def _locate(self, state, hashes):
+        """(shard no, row) arrays for `hashes`; shard -1 where not stored."""
+        hashes = np.asarray(hashes, dtype=HASH_DTYPE)
+        keys = hash_prefix_keys(hashes)
+        shard_no = np.full(len(hashes), -1, dtype=np.int64)
+        rows = np.full(len(hashes), -1, dtype=np.int64)
+        for s, shard in enumerate(state.shards):
+            pending = np.flatnonzero(shard_no < 0)
+            if not len(pending):
+                break
+            found = shard.locate(keys[pending], hashes[pending])
+            hit = found >= 0
+            shard_no[pending[hit]] = s
+            rows[pending[hit]] = found[hit]
+        return shard_no, rows
+
+    def get(self, model_name, hashes):
+        """
+        Look up vectors for `hashes`.
+        Returns (vectors, missing): vectors is a float32 (len(hashes), dim)
+        matrix (None if nothing is stored yet) whose rows are only valid for
+        positions not listed in `missing`.
+        """
+        with self._lock:
+            state = self._shards(model_name)
+            dim = state.manifest["dim"]
+            if dim is None:
+                return None, list(range(len(hashes)))
+
+            shard_no, rows = self._locate(state, hashes)
+            vectors = np.zeros((len(hashes), dim), dtype=np.float32)
+            for s in np.unique(shard_no[shard_no >= 0]):
+                out = np.flatnonzero(shard_no == s)
+                order = np.argsort(rows[out])   # ascending rows read the memmap sequentially
+                vectors[out[order]] = state.shards[s].vectors[rows[out[order]]]
+            return vectors, np.flatnonzero(shard_no < 0).tolist()
+
+    def put(self, model_name, hashes, vectors):
+        """
+        Append vectors for chunks not stored yet. The manifest is re-read and
+        replaced under a file lock, so concurrent writers in other processes
+        (uploads, eval workers, library compaction) never drop each other's shards.
+        """
+        vectors = np.asarray(vectors)
+        with self._lock, self._manifest_locked(model_name):
+            state = self._shards(model_name, reload=True)
+            # A copy: the cached state must keep describing exactly the shards it has open
+            manifest = dict(state.manifest, shards=list(state.manifest["shards"]))
+            shard_no, _ = self._locate(state, hashes)
+            keep, seen = [], set()
+            for i in np.flatnonzero(shard_no < 0):
+                if hashes[i] not in seen:
+                    keep.append(i)
+                    seen.add(hashes[i])
+            if not keep:
+                return
+            if manifest["dim"] is None:
+                manifest["dim"] = int(vectors.shape[1])
+            elif manifest["dim"] != vectors.shape[1]:
+                raise ValueError(f"{model_name}: stored dim {manifest['dim']}, got {vectors.shape[1]}")
+
+            model_dir = self._model_dir(model_name)
+            dtype = np.dtype(manifest["dtype"])
+            for start in range(0, len(keep), SHARD_ROWS):
+                part = keep[start:start + SHARD_ROWS]
+                stem = f"shard_{len(manifest['shards']):05d}_{uuid.uuid4().hex[:8]}"
+                _save_npy(os.path.join(model_dir, f"{stem}.npy"), vectors[part].astype(dtype))
+                _save_npy(os.path.join(model_dir, f"{stem}.hashes.npy"),
+                          np.asarray([hashes[i] for i in part], dtype=HASH_DTYPE))
+                manifest["shards"].append({"file": f"{stem}.npy", "hashes": f"{stem}.hashes.npy", "rows": len(part)})
+
+            path = self._manifest_path(model_name)
+            tmp = f"{path}.{os.getpid()}.tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(manifest, f)
+            os.replace(tmp, path)
+            # The shards already open are kept; only the appended ones are opened
+            written = _ModelShards(manifest, os.stat(path).st_mtime_ns)
+            written.shards = state.shards + [_Shard(model_dir, entry)
+                                             for entry in manifest["shards"][len(state.shards):]]
+            self._models[model_name] = written
+
+    def get_or_encode(self, model_name, hashes, texts, encode_fn):
+        """
+        float32 matrix of embeddings for `texts`, encoding (with
+        encode_fn(list_of_texts) -> array) and storing only the missing ones.
+        Returns (vectors, n_encoded).
+        """
+        vectors, missing = self.get(model_name, hashes)
+        if not missing:
+            return vectors, 0
+        encoded = np.asarray(encode_fn([texts[i] for i in missing]), dtype=np.float32)
+        self.put(model_name, [hashes[i] for i in missing], encoded)
+        if vectors is None:
+            vectors = np.zeros((len(hashes), encoded.shape[1]), dtype=np.float32)
+        vectors[missing] = encoded
+        return vectors, len(missing)
+
+    def stats(self) -> dict:
+        out = {}
+        with self._lock:
+            for name in os.listdir(self.root) if os.path.isdir(self.root) else []:
+                path = os.path.join(self.root, name, "manifest.json")
+                if not os.path.exists(path):
+                    continue
+                with open(path, "r", encoding="utf-8") as f:
+                    manifest = json.load(f)
+                out[manifest["model"]] = {
+                    "dim": manifest["dim"],
+                    "dtype": manifest["dtype"],
+                    "shards": len(manifest["shards"]),
+                    "chunks": sum(s["rows"] for s in manifest["shards"])
+                }
+        return out
+
+
+def _save_npy(path, array):
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+# Shared store used by the index builders
+embedding_store = EmbeddingStore()
@@ -0,0 +1,224 @@
+# faiss_index.py
+"""
+FAISS index construction and loading for every index type we build.
+
+Supported types:
+  flat      exact brute-force search (IndexFlat)
+  hnsw      graph index, no training (IndexHNSWFlat)
+  ivf_flat  inverted lists over full vectors (IndexIVFFlat)
+  ivf_pq    inverted lists over product-quantized codes (IndexIVFPQ)
+  auto      flat below 100k chunks, hnsw below 1M, ivf_pq above
+
+Metrics:
+  l2        squared Euclidean distance on raw embeddings
+  cosine    L2-normalized embeddings searched by inner product; IVF-PQ
+            uses L2 on the normalized vectors instead (same ranking, and
+            PQ codebooks fit residuals far better under L2)
+
+Search-time settings (nprobe, efSearch) and the metric are stored next to
+the index in `<index>.meta.json`. `load_index` re-applies the settings,
+because FAISS does not persist them, and returns a `SearchIndex` that
+normalizes queries whenever the index was built for cosine similarity.
+"""
+
+import json
+import math
+import os
+
+import faiss
+import numpy as np
+
+INDEX_TYPES = ("flat", "hnsw", "ivf_flat", "ivf_pq")
+METRICS = {"l2": faiss.METRIC_L2, "cosine": faiss.METRIC_INNER_PRODUCT}
+AUTO_HNSW_MIN_CHUNKS = 100_000
+AUTO_IVF_PQ_MIN_CHUNKS = 1_000_000
+
+HNSW_M = 32
+HNSW_EF_CONSTRUCTION = 200
+HNSW_EF_SEARCH = 64
+IVF_NPROBE = 16
+# k-means wants roughly 39-256 training points per centroid
+IVF_TRAIN_POINTS_PER_LIST = 64
+IVF_MIN_POINTS_PER_LIST = 39
+MAX_TRAIN_POINTS = 500_000
+
+
+def choose_index_type(n_chunks: int) -> str:
+    if n_chunks < AUTO_HNSW_MIN_CHUNKS:
+        return "flat"
+    if n_chunks < AUTO_IVF_PQ_MIN_CHUNKS:
+        return "hnsw"
+    return "ivf_pq"
+
+
+def default_nlist(n_chunks: int) -> int:
+    """~4*sqrt(n) lists, but never fewer training points per list than k-means needs."""
+    return max(1, min(int(4 * math.sqrt(n_chunks)), n_chunks // IVF_MIN_POINTS_PER_LIST))
+
+
+def pq_subquantizers(dim: int) -> int:
+    """Largest common sub-quantizer count that divides dim (>= 4 dims each where possible)."""
+    for m in (64, 48, 32, 24, 16, 12, 8, 4, 2):
+        if dim % m == 0 and dim // m >= 4:
+            return m
+    return 1
+
+
+def training_rows(n: int, n_train: int, seed: int = 0):
+    """Sorted row numbers of a uniform random training sample (None = all rows)."""
+    if n_train >= n:
+        return None
+    return np.sort(np.random.default_rng(seed).choice(n, size=n_train, replace=False))
+
+
+def training_sample(embeddings, n_train: int, seed: int = 0):
+    """Uniform random rows (sorted, so memory-mapped inputs are read sequentially)."""
+    rows = training_rows(len(embeddings), n_train, seed)
+    if rows is None:
+        return np.ascontiguousarray(embeddings, dtype=np.float32)
+    return np.ascontiguousarray(embeddings[rows], dtype=np.float32)
+
+
+def normalize(vectors):
+    """Row-wise L2-normalized float32 copy."""
+    vectors = np.array(vectors, dtype=np.float32, copy=True, ndmin=2)
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def create_index(dim: int, n_chunks: int, index_type: str = "auto", metric: str = "l2", nlist: int = None,
+                 nprobe: int = None, hnsw_m: int = None, ef_search: int = None) -> tuple:
+    """
+    Empty (untrained) index plus its meta dict.
+    Call `train_index` before adding vectors to IVF indexes.
+    """
+    if index_type == "auto":
+        index_type = choose_index_type(n_chunks)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type!r}; expected one of {INDEX_TYPES} or 'auto'")
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric {metric!r}; expected one of {tuple(METRICS)}")
+
+    faiss_metric = faiss.METRIC_L2 if index_type == "ivf_pq" else METRICS[metric]
+    meta = {"index_type": index_type, "dim": dim, "metric": metric}
+    if index_type == "flat":
+        index = faiss.IndexFlat(dim, faiss_metric)
+    elif index_type == "hnsw":
+        meta["hnsw_m"] = hnsw_m or HNSW_M
+        meta["ef_construction"] = HNSW_EF_CONSTRUCTION
+        meta["ef_search"] = ef_search or HNSW_EF_SEARCH
+        index = faiss.IndexHNSWFlat(dim, meta["hnsw_m"], faiss_metric)
+        index.hnsw.efConstruction = meta["ef_construction"]
+    else:
+        meta["nlist"] = nlist or default_nlist(n_chunks)
+        meta["nprobe"] = min(nprobe or IVF_NPROBE, meta["nlist"])
+        quantizer = faiss.IndexFlat(dim, faiss_metric)
+        if index_type == "ivf_flat":
+            index = faiss.IndexIVFFlat(quantizer, dim, meta["nlist"], faiss_metric)
+        else:
+            meta["pq_m"] = pq_subquantizers(dim)
+            # 8-bit codes need >= 256 training points per sub-quantizer
+            meta["pq_nbits"] = max(1, min(8, int(math.log2(max(2, n_chunks // IVF_MIN_POINTS_PER_LIST)))))
+            index = faiss.IndexIVFPQ(quantizer, dim, meta["nlist"], meta["pq_m"], meta["pq_nbits"], faiss_metric)
+    apply_search_params(index, meta)
+    return index, meta
+
+
+def train_size(meta: dict, n_chunks: int) -> int:
+    """Training points used for an IVF index over n_chunks vectors."""
+    return min(n_chunks, MAX_TRAIN_POINTS,
+               max(meta["nlist"] * IVF_TRAIN_POINTS_PER_LIST, 256 * IVF_MIN_POINTS_PER_LIST))
+
+
+def train_index(index, meta: dict, embeddings, seed: int = 0):
+    """Train IVF indexes on a random sample; no-op for flat/hnsw."""
+    if index.is_trained:
+        return
+    sample = training_sample(embeddings, train_size(meta, len(embeddings)), seed)
+    meta["train_points"] = len(sample)
+    index.train(sample)
+
+
+def build_index(embeddings, index_type: str = "auto", metric: str = "l2", **params) -> tuple:
+    """Create, train and fill an index from an in-memory (or memory-mapped) matrix."""
+    if metric == "cosine":
+        embeddings = normalize(embeddings)
+    embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+    index, meta = create_index(embeddings.shape[1], len(embeddings), index_type, metric, **params)
+    train_index(index, meta, embeddings)
+    index.add(embeddings)
+    return index, meta
+
+
+def apply_search_params(index, meta: dict):
+    if meta.get("index_type") == "hnsw":
+        faiss.downcast_index(index).hnsw.efSearch = meta["ef_search"]
+    elif "nprobe" in meta:
+        faiss.extract_index_ivf(index).nprobe = meta["nprobe"]
+
+
+# ========== Persistence ==========
+def meta_path(index_path: str) -> str:
+    return f"{index_path}.meta.json"
+
+
+def write_index(index, meta: dict, index_path: str):
+    faiss.write_index(index, index_path)
+    with open(meta_path(index_path), "w", encoding="utf-8") as f:
+        json.dump({**meta, "ntotal": int(index.ntotal)}, f, indent=2)
+
+
+def read_index_meta(index_path: str) -> dict:
+    """Stored meta, or the implicit meta of a legacy flat index without one."""
+    path = meta_path(index_path)
+    if not os.path.exists(path):
+        return {"index_type": "flat", "metric": "l2"}
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class SearchIndex:
+    """A FAISS index plus its meta; prepares queries to match the build metric."""
+
+    def __init__(self, index, meta: dict):
+        self.index = index
+        self.meta = meta
+        self.metric = meta.get("metric", "l2")
+        self.bm25 = None   # lexical index built alongside, attached by loaders that use it
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def prepare(self, vectors):
+        if self.metric == "cosine":
+            return normalize(vectors)
+        return np.array(vectors, dtype=np.float32, ndmin=2)
+
+    def search(self, vectors, k: int, params=None):
+        """
+        FAISS search for one vector or a matrix of query vectors; returns (D, I).
+        `params` (faiss.SearchParameters) overrides the stored search settings.
+        """
+        return self.index.search(self.prepare(vectors), k, params=params)
+
+    def similarity(self, distances):
+        """
+        Search results as higher-is-better scores: cosine similarity for
+        cosine indexes (whatever FAISS metric they use internally), negated
+        squared distance for L2 indexes.
+        """
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return distances
+        if self.metric == "cosine":
+            # Squared L2 between unit vectors is 2 - 2cos
+            return 1 - distances / 2
+        return -distances
+
+
+def load_index(index_path: str) -> SearchIndex:
+    """Read an index and re-apply its stored search settings."""
+    index = faiss.read_index(index_path)
+    meta = read_index_meta(index_path)
+    apply_search_params(index, meta)
+    return SearchIndex(index, meta)
@@ -0,0 +1,124 @@
+# federated_search.py
+"""
+Search several book indexes at once and merge their hits.
+
+Books are loaded through the index registry and searched in parallel
+threads (FAISS releases the GIL during search), so the latency of a query
+grows with the slowest book rather than with the number of books. The query
+is embedded once per distinct embed model.
+
+Scores from different books are merged after calibration:
+  raw     cosine similarity (or negated L2 distance) as returned, valid when
+          every book uses the same embed model and metric
+  zscore  books are grouped by (embed model, metric), whose scores are
+          comparable, and each group's candidate scores are standardized for
+          this query, so groups with different models or metrics can be
+          ranked together while order within a group is kept
+  auto    raw when there is a single group, otherwise zscore
+"""
+
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import FEDERATED_WORKERS, FEDERATED_CANDIDATES, FEDERATED_CALIBRATION
+
+CALIBRATIONS = ("auto", "raw", "zscore")
+
+
+def book_label(index_path: str) -> str:
+    """Readable book name from an index file name (faiss_<name>_<hash>.index)."""
+    stem = os.path.splitext(os.path.basename(index_path))[0]
+    stem = re.sub(r"^faiss_", "", stem)
+    return re.sub(r"_[0-9a-f]{12}$", "", stem) or stem
+
+
+class FederatedSearcher:
+    def __init__(self, load_fn, embed_fn, workers=FEDERATED_WORKERS):
+        """
+        load_fn:  callable(index_path, id_map_path, embed_model) -> (SearchIndex, id_map)
+        embed_fn: callable(query, embed_model) -> query vector
+        workers:  threads shared by all federated queries
+        """
+        self.load_fn = load_fn
+        self.embed_fn = embed_fn
+        self.workers = workers
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="federated")
+        self._lock = threading.Lock()
+        self.queries = 0
+        self.books_searched = 0
+        self.total_ms = 0.0
+
+    def search(self, query, books, top_k, embed_model, candidates=FEDERATED_CANDIDATES,
+               calibration=FEDERATED_CALIBRATION) -> list:
+        """
+        Top-k hits over `books` ([{"index", "id_map", "name"?}]), best first.
+        Each hit: {"book", "book_no", "id", "score", "similarity", "context"}.
+        """
+        if calibration not in CALIBRATIONS:
+            raise ValueError(f"Unknown calibration {calibration!r}; expected one of {CALIBRATIONS}")
+        if not books:
+            return []
+        t0 = time.perf_counter()
+        loaded = list(self._pool.map(
+            lambda book: self.load_fn(book["index"], book["id_map"], embed_model), books))
+
+        # One query embedding per embed model; books record theirs in the index meta
+        models = [index.meta.get("embed_model") or embed_model for index, _ in loaded]
+        q_vecs = {model: np.asarray(self.embed_fn(query, model), dtype=np.float32) for model in dict.fromkeys(models)}
+
+        n = max(top_k, candidates)
+
+        def search_book(book_no):
+            index, _ = loaded[book_no]
+            D, I = index.search(q_vecs[models[book_no]], n)
+            found = I[0] >= 0
+            return I[0][found], index.similarity(D[0][found])
+
+        results = list(self._pool.map(search_book, range(len(books))))
+
+        groups = [(model, index.metric) for model, (index, _) in zip(models, loaded)]
+        if calibration == "auto":
+            calibration = "raw" if len(set(groups)) == 1 else "zscore"
+        scale = {}
+        if calibration == "zscore":
+            for group in set(groups):
+                pooled = np.concatenate([results[b][1] for b in range(len(books)) if groups[b] == group])
+                if len(pooled):
+                    scale[group] = (float(pooled.mean()), max(float(pooled.std()), 1e-6))
+
+        hits = []
+        for book_no, (ids, sims) in enumerate(results):
+            if not len(ids):
+                continue
+            scores = sims
+            if calibration == "zscore":
+                mean, std = scale[groups[book_no]]
+                scores = (sims - mean) / std
+            label = books[book_no].get("name") or book_label(books[book_no]["index"])
+            for doc, score, sim in zip(ids, scores, sims):
+                hits.append({"book": label, "book_no": book_no, "id": int(doc),
+                             "score": float(score), "similarity": float(sim)})
+        hits.sort(key=lambda h: (-h["score"], h["book_no"], h["id"]))
+        hits = hits[:top_k]
+        for hit in hits:
+            hit["context"] = loaded[hit["book_no"]][1][hit["id"]]["context"]
+
+        with self._lock:
+            self.queries += 1
+            self.books_searched += len(books)
+            self.total_ms += (time.perf_counter() - t0) * 1000
+        return hits
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "queries": self.queries,
+                "avg_books": round(self.books_searched / self.queries, 2) if self.queries else 0.0,
+                "avg_ms": round(self.total_ms / self.queries, 2) if self.queries else 0.0,
+                "workers": self.workers
+            }
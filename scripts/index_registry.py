@@ -0,0 +1,119 @@
+# index_registry.py
+"""
+In-process registry of loaded FAISS indexes and their id_maps.
+
+Entries are keyed by (index path, index mtime, id_map path, id_map mtime,
+embed model), so a rebuilt index is picked up automatically. Resident
+entries are kept in LRU order and evicted once their estimated size
+exceeds the configured memory budget.
+"""
+
+import os
+import sys
+import threading
+from collections import OrderedDict
+
+
+def estimate_id_map_bytes(id_map) -> int:
+    """Rough resident size of a list-of-dicts id_map (or a memory-mapped chunk store)."""
+    if hasattr(id_map, "resident_bytes"):
+        return id_map.resident_bytes()
+    total = sys.getsizeof(id_map)
+    for entry in id_map:
+        total += sys.getsizeof(entry)
+        for value in entry.values():
+            total += sys.getsizeof(value)
+    return total
+
+
+class IndexRegistry:
+    def __init__(self, loader, max_bytes: int):
+        """
+        loader:    callable(index_path, id_map_path) -> (index, id_map)
+        max_bytes: memory budget for all resident entries
+        """
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()   # key -> (index, id_map, nbytes)
+        self._loading = {}              # key -> Lock, so one key loads once
+        self._lock = threading.Lock()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def make_key(index_path, id_map_path, embed_model):
+        index_path = os.path.abspath(index_path)
+        id_map_path = os.path.abspath(id_map_path)
+        return (
+            index_path, os.path.getmtime(index_path),
+            id_map_path, os.path.getmtime(id_map_path),
+            embed_model
+        )
+
+    def get(self, index_path, id_map_path, embed_model=None):
+        """Return (index, id_map), loading from disk only on a miss."""
+        key = self.make_key(index_path, id_map_path, embed_model)
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[0], entry[1]
+            load_lock = self._loading.setdefault(key, threading.Lock())
+
+        with load_lock:
+            # Another thread may have finished loading while we waited
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is not None:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[0], entry[1]
+
+            index, id_map = self.loader(index_path, id_map_path)
+            nbytes = os.path.getsize(key[0]) + estimate_id_map_bytes(id_map)
+
+            with self._lock:
+                self.misses += 1
+                self._drop_stale(key)
+                self._entries[key] = (index, id_map, nbytes)
+                self._bytes += nbytes
+                self._evict()
+                self._loading.pop(key, None)
+        return index, id_map
+
+    def _drop_stale(self, key):
+        """Forget older versions of the same files (caller holds the lock)."""
+        for old in [k for k in self._entries if k[0] == key[0] and k[2] == key[2] and k[4] == key[4]]:
+            self._bytes -= self._entries.pop(old)[2]
+            self.invalidations += 1
+
+    def _evict(self):
+        """Evict least recently used entries until under budget (caller holds the lock)."""
+        while self._bytes > self.max_bytes and len(self._entries) > 1:
+            _, (_, _, nbytes) = self._entries.popitem(last=False)
+            self._bytes -= nbytes
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "resident_bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,168 @@
+# ingest_cache.py
+"""
+Content-addressed ingestion: PDF -> QA JSONL -> FAISS index.
+
+Stage keys:
+  JSONL:     sha256(PDF bytes) + chunking parameters
+  Embedding: chunk_hash (sha256 of the chunk text) + embed model
+
+Re-uploading a PDF that has already been indexed with the same model returns
+the existing index without running either stage. A revised edition gets new
+JSONL, but chunks whose text is unchanged get their vectors from the
+embedding store, so only the changed chunks are encoded.
+
+Every indexed book is also added to its embed model's library index
+(LIBRARY_AUTO_ADD), which the query service searches as one collection.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import re
+from pathlib import Path
+
+from config import (JSONL_DIR, EMBEDDING_DIR, INGEST_MANIFEST, BASE_DIR, FAISS_METRIC, STREAM_BUILD_MIN_BYTES,
+                    LIBRARY_AUTO_ADD)
+from build_faiss_index_core import build_index_streaming, build_index_with_model
+from chunk_store import CHUNK_STORE_EXT
+from library_index import LibraryIndex
+from qa_rule_based_generator import generate_qa_file
+
+# Bump when chunking/QA generation changes so cached JSONL is not reused
+CHUNKER_VERSION = 2
+ROOT_DIR = os.path.normpath(os.path.join(BASE_DIR, ".."))
+
+
+# ========== Keys ==========
+def file_sha256(path, block_size=1 << 20) -> str:
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        while block := f.read(block_size):
+            h.update(block)
+    return h.hexdigest()
+
+
+def jsonl_key(pdf_sha256: str, chunk_size: int) -> str:
+    raw = json.dumps(["qa_rule_based", CHUNKER_VERSION, pdf_sha256, chunk_size])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def index_key(jsonl_key: str, embed_model: str, metric: str = FAISS_METRIC) -> str:
+    return hashlib.sha256(json.dumps([jsonl_key, embed_model, metric]).encode("utf-8")).hexdigest()
+
+
+# ========== Manifest ==========
+def load_manifest(path=INGEST_MANIFEST) -> dict:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {"jsonl": {}, "indexes": {}}
+
+
+def save_manifest(manifest: dict, path=INGEST_MANIFEST):
+    """Write atomically so a concurrent reader never sees a partial manifest."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+
+
+def update_manifest(section: str, key: str, entry: dict, path=INGEST_MANIFEST):
+    """Re-read before writing so entries added by other uploads are kept."""
+    manifest = load_manifest(path)
+    manifest.setdefault(section, {})[key] = entry
+    save_manifest(manifest, path)
+
+
+def _abs(rel_path: str) -> str:
+    return os.path.join(ROOT_DIR, rel_path)
+
+
+def _rel(path: str) -> str:
+    return os.path.relpath(path, ROOT_DIR).replace(os.sep, "/")
+
+
+def library_book_id(name: str, pdf_sha256: str) -> str:
+    """Upload name plus content hash: a re-upload of the same PDF keeps its id, another PDF never shares it."""
+    return f"{name}_{pdf_sha256[:12]}"
+
+
+def add_to_library(embed_model: str, id_map_path: str, name: str, book_id: str, replaces: str = None):
+    """
+    Add a built book to its model's library index. Another book with the
+    same name is left alone unless its id is passed as `replaces` (an
+    earlier edition). Returns the id, or None if the library could not be
+    updated (the upload still succeeds).
+    """
+    if not LIBRARY_AUTO_ADD:
+        return None
+    try:
+        LibraryIndex(embed_model).add_book(book_id, id_map_path, name, replaces)
+    except Exception as e:
+        print(f"[Library] Could not add {book_id}: {e}")
+        return None
+    return book_id
+
+
+# ========== Pipeline ==========
+def ingest_pdf(pdf_path: str, name: str, embed_model: str, chunk_size: int = 180, workers: int = 1,
+               replaces: str = None) -> dict:
+    name = re.sub(r"[^\w.-]+", "_", name) or "book"
+    manifest = load_manifest()
+    pdf_sha = file_sha256(pdf_path)
+    book_id = library_book_id(name, pdf_sha)
+    j_key = jsonl_key(pdf_sha, chunk_size)
+    i_key = index_key(j_key, embed_model)
+
+    # Whole book already indexed with this model
+    entry = manifest.get("indexes", {}).get(i_key)
+    if entry and os.path.exists(_abs(entry["index"])) and os.path.exists(_abs(entry["id_map"])):
+        print(f"[Cache] Index hit for {name} ({embed_model})")
+        book_id = add_to_library(embed_model, _abs(entry["id_map"]), name, book_id, replaces)
+        return {"indexPath": entry["index"], "idMapPath": entry["id_map"], "cached": True,
+                "reused": entry["chunks"], "encoded": 0, "libraryBookId": book_id}
+
+    # JSONL stage
+    j_entry = manifest.get("jsonl", {}).get(j_key)
+    if j_entry and os.path.exists(_abs(j_entry["path"])):
+        jsonl_path = _abs(j_entry["path"])
+        print(f"[Cache] JSONL hit: {j_entry['path']}")
+    else:
+        jsonl_path = os.path.join(JSONL_DIR, f"{name}_{j_key[:12]}.qa_with_answers.jsonl")
+        # Content-defined chunks: an edit in a revised edition only re-embeds the chunks around it
+        generate_qa_file(pdf_path=Path(pdf_path), output_path=Path(jsonl_path),
+                         words_per_chunk=chunk_size, workers=workers, content_defined=True)
+        update_manifest("jsonl", j_key, {"pdf_sha256": pdf_sha, "chunk_size": chunk_size,
+                                         "name": name, "path": _rel(jsonl_path)})
+
+    # Embedding stage: unchanged chunks come from the embedding store
+    os.makedirs(EMBEDDING_DIR, exist_ok=True)
+    index_path = os.path.join(EMBEDDING_DIR, f"faiss_{name}_{i_key[:12]}.index")
+    id_map_path = os.path.join(EMBEDDING_DIR, f"id_map_{name}_{i_key[:12]}{CHUNK_STORE_EXT}")
+    # Large books are built batch by batch to keep memory bounded
+    build = build_index_streaming if os.path.getsize(jsonl_path) >= STREAM_BUILD_MIN_BYTES else build_index_with_model
+    counts = build(jsonl_path, embed_model, index_path, id_map_path)
+    update_manifest("indexes", i_key, {"jsonl_key": j_key, "embed_model": embed_model,
+                                       "index": _rel(index_path), "id_map": _rel(id_map_path),
+                                       "chunks": counts["total"]})
+    book_id = add_to_library(embed_model, id_map_path, name, book_id, replaces)
+    return {"indexPath": _rel(index_path), "idMapPath": _rel(id_map_path), "cached": False,
+            "reused": counts["reused"], "encoded": counts["encoded"], "libraryBookId": book_id}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build (or reuse) the QA JSONL and FAISS index for a PDF")
+    parser.add_argument("--pdf", type=str, required=True, help="Path to input PDF file")
+    parser.add_argument("--name", type=str, required=True, help="Book name used in output file names")
+    parser.add_argument("--embed_model", type=str, default="all-MiniLM-L6-v2")
+    parser.add_argument("--chunk_size", type=int, default=180, help="Average words per (content-defined) chunk")
+    parser.add_argument("--workers", type=int, default=1, help="Processes for PDF page extraction")
+    parser.add_argument("--replaces", type=str, default=None,
+                        help="Library book id of an earlier edition that this PDF replaces")
+    args = parser.parse_args()
+
+    result = ingest_pdf(args.pdf, args.name, args.embed_model, args.chunk_size, args.workers, args.replaces)
+    print(json.dumps({"success": True, **result}), flush=True)
@@ -0,0 +1,522 @@
+# library_index.py
+"""
+Library-level vector index over every book embedded with one model,
+updated online.
+
+    <root>/<model slug>/library.json         manifest (generation, books, shards)
+    <root>/<model slug>/shard_<gen>_<id>.index
+
+Each book is given a contiguous range of vector ids, and its vectors live in
+a FAISS IndexIDMap2 shard under those ids. Adding a book writes one new
+shard from the book's vectors in the embedding store; no other shard is
+rebuilt. Deleting a book drops the shards that held only that book.
+Otherwise its id range becomes a tombstone that search excludes with an
+IDSelector.
+
+Compaction runs in a background thread. It merges the smallest shards once
+there are more than LIBRARY_MAX_SHARDS, and rewrites shards whose deleted
+share reaches LIBRARY_COMPACT_DELETED_RATIO without the deleted books. The
+new shard is built outside the writer lock and then committed on top of
+any adds or deletes made in the meantime.
+
+Readers never take a lock. Every change produces a new immutable snapshot
+(loaded shards, book table and tombstones), which is swapped in with a
+single assignment, so a query finishes on the snapshot it started with.
+Other processes (ingest_cache.py adds uploaded books) serialize their
+writes through a lock file. Their changes are picked up by a background
+reload when the manifest changes.
+"""
+
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+import faiss
+import numpy as np
+
+from config import (LIBRARY_DIR, LIBRARY_INDEX_TYPE, LIBRARY_MAX_SHARDS, LIBRARY_COMPACT_DELETED_RATIO,
+                    FAISS_METRIC, MODEL_NAME)
+from chunk_store import load_id_map
+from faiss_index import SearchIndex, create_index, normalize, train_index
+
+try:
+    import fcntl
+except ImportError:   # Windows: writers are only serialized within one process
+    fcntl = None
+
+MANIFEST = "library.json"
+
+
+def search_params(meta: dict, selector=None):
+    """SearchParameters carrying `selector` plus the shard's stored nprobe/efSearch."""
+    kwargs = {"sel": selector} if selector is not None else {}
+    if meta.get("index_type") == "hnsw":
+        return faiss.SearchParametersHNSW(efSearch=meta["ef_search"], **kwargs)
+    if "nprobe" in meta:
+        return faiss.SearchParametersIVF(nprobe=meta["nprobe"], **kwargs)
+    return faiss.SearchParameters(**kwargs)
+
+
+def book_vectors(model_name, id_map, store=None):
+    """float32 vectors of a book's chunks from the embedding store; missing ones are encoded."""
+    from build_faiss_index_core import chunk_hash, lazy_encoder
+    from embedding_store import embedding_store
+    texts = [entry["context"] for entry in id_map]
+    hashes = [entry.get("chunk_hash") or chunk_hash(text) for entry, text in zip(id_map, texts)]
+    vectors, _ = (store or embedding_store).get_or_encode(model_name, hashes, texts, lazy_encoder(model_name))
+    return vectors
+
+
+def build_shard(vectors, ids, index_type: str, metric: str) -> tuple:
+    """IndexIDMap2 over a new index of `index_type` holding `vectors` under `ids`."""
+    if metric == "cosine":
+        vectors = normalize(vectors)
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    inner, meta = create_index(vectors.shape[1], len(vectors), index_type, metric)
+    train_index(inner, meta, vectors)
+    index = faiss.IndexIDMap2(inner)
+    index.add_with_ids(vectors, np.asarray(ids, dtype=np.int64))
+    return index, meta
+
+
+def dead_vectors(manifest: dict, shard: dict) -> int:
+    """Vectors of deleted books still held by `shard`."""
+    return sum(manifest["books"][key]["count"] for key in shard["books"] if manifest["books"][key]["deleted"])
+
+
+def compaction_plan(manifest: dict, max_shards: int = LIBRARY_MAX_SHARDS,
+                    deleted_ratio: float = LIBRARY_COMPACT_DELETED_RATIO) -> list:
+    """Files of the shards to merge into one; empty when the library needs no compaction."""
+    shards = manifest["shards"]
+    plan = [s for s in shards if dead_vectors(manifest, s) and dead_vectors(manifest, s) >= deleted_ratio * s["ntotal"]]
+    if not plan and len(shards) <= max_shards:
+        return []
+    # Merging p shards into one removes p - 1; add the smallest others until under the cap
+    extra = max(0, len(shards) - len(plan) + 1 - max_shards)
+    rest = sorted((s for s in shards if s not in plan), key=lambda s: s["ntotal"])
+    plan += rest[:extra]
+    return [s["file"] for s in plan]
+
+
+class LibrarySnapshot:
+    """Immutable view of a library at one generation; any thread can search it."""
+
+    def __init__(self, manifest: dict, shards: dict, mtime):
+        self.manifest = manifest
+        self.generation = manifest["generation"]
+        self.mtime = mtime
+        self.shards = shards   # file -> SearchIndex
+        self.books = sorted(manifest["books"].values(), key=lambda b: b["start"])
+        self.starts = np.array([b["start"] for b in self.books], dtype=np.int64)
+
+        # FAISS selectors do not own their children, so every part is kept referenced here
+        self._selectors = []
+        deleted = None
+        for book in self.books:
+            if book["deleted"]:
+                part = faiss.IDSelectorRange(book["start"], book["start"] + book["count"])
+                self._selectors.append(part)
+                deleted = part if deleted is None else faiss.IDSelectorOr(deleted, part)
+                self._selectors.append(deleted)
+        self.selector = faiss.IDSelectorNot(deleted) if deleted is not None else None
+
+    @property
+    def ntotal(self) -> int:
+        return sum(b["count"] for b in self.books if not b["deleted"])
+
+    def search(self, q_vec, k: int) -> tuple:
+        """(global ids, similarities) of the best k live vectors across all shards."""
+        ids, scores = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.float32)]
+        for entry in self.manifest["shards"]:
+            index = self.shards[entry["file"]]
+            D, I = index.search(q_vec, k, search_params(entry["meta"], self.selector))
+            found = I[0] >= 0
+            ids.append(I[0][found])
+            scores.append(index.similarity(D[0][found]))
+        ids, scores = np.concatenate(ids), np.concatenate(scores)
+        order = np.argsort(-scores, kind="stable")[:k]
+        return ids[order], scores[order]
+
+    def book_of(self, vector_id: int) -> dict:
+        return self.books[int(np.searchsorted(self.starts, vector_id, side="right")) - 1]
+
+
+class LibraryIndex:
+    def __init__(self, model_name, root=LIBRARY_DIR, index_type=LIBRARY_INDEX_TYPE, metric=FAISS_METRIC,
+                 auto_compact=False, store=None):
+        """
+        model_name:   embed model of every book in this library
+        index_type:   FAISS type of new shards (see faiss_index.py)
+        metric:       similarity of a new library; an existing one keeps its own
+        auto_compact: compact in a background thread whenever the plan is non-empty
+        store:        embedding store the book vectors are read from
+        """
+        self.model_name = model_name
+        self.dir = os.path.join(root, re.sub(r"[^\w.-]+", "_", model_name))
+        self.index_type = index_type
+        self.metric = metric
+        self.auto_compact = auto_compact
+        self.store = store
+        self._snapshot = None
+        self._write_lock = threading.Lock()   # writers in this process; the lock file covers others
+        self._state_lock = threading.Lock()
+        self._running = set()                 # background tasks in flight
+        self._id_maps = {}                    # id_maps of live books, opened on first hit
+        self._live_id_maps = set()
+        self.queries = 0
+        self.total_ms = 0.0
+        self.reloads = 0
+        self.compactions = 0
+
+    @property
+    def manifest_path(self) -> str:
+        return os.path.join(self.dir, MANIFEST)
+
+    def _mtime(self):
+        try:
+            return os.stat(self.manifest_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _read_manifest(self) -> dict:
+        try:
+            with open(self.manifest_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"model": self.model_name, "metric": self.metric, "dim": None,
+                    "generation": 0, "next_id": 0, "books": {}, "shards": []}
+
+    @contextmanager
+    def _locked(self):
+        """Serialize writers across threads and processes."""
+        with self._write_lock:
+            os.makedirs(self.dir, exist_ok=True)
+            with open(os.path.join(self.dir, "library.lock"), "a") as lock:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(lock, fcntl.LOCK_UN)
+
+    # ========== Snapshots ==========
+    def _load_snapshot(self, manifest: dict, mtime) -> LibrarySnapshot:
+        """Snapshot of `manifest`; shards already loaded by the current snapshot are shared."""
+        loaded = self._snapshot.shards if self._snapshot is not None else {}
+        shards = {}
+        for entry in manifest["shards"]:
+            index = loaded.get(entry["file"])
+            if index is None:
+                index = SearchIndex(faiss.read_index(os.path.join(self.dir, entry["file"])), entry["meta"])
+            shards[entry["file"]] = index
+        return LibrarySnapshot(manifest, shards, mtime)
+
+    def _install(self, snapshot: LibrarySnapshot):
+        with self._state_lock:
+            if self._snapshot is not None and snapshot.generation < self._snapshot.generation:
+                return
+            self._snapshot = snapshot
+            # Deleted and replaced books no longer hold their id_maps open
+            self._live_id_maps = {self._id_map_path(b) for b in snapshot.books if not b["deleted"]}
+            self._id_maps = {path: m for path, m in self._id_maps.items() if path in self._live_id_maps}
+        if self.auto_compact and compaction_plan(snapshot.manifest):
+            self._background("compact", self.compact)
+
+    def _reload(self):
+        for _ in range(3):
+            mtime = self._mtime()
+            manifest = self._read_manifest()
+            try:
+                snapshot = self._load_snapshot(manifest, mtime)
+            except FileNotFoundError:
+                # A shard was replaced by a commit after the manifest was read
+                continue
+            self.reloads += 1
+            self._install(snapshot)
+            return
+
+    def _background(self, name, fn):
+        """Run fn in a daemon thread unless a task of that name is already running."""
+        with self._state_lock:
+            if name in self._running:
+                return
+            self._running.add(name)
+
+        def run():
+            try:
+                fn()
+            except Exception as e:
+                print(f"[Library] {self.model_name}: {name} failed: {e}", flush=True)
+            finally:
+                with self._state_lock:
+                    self._running.discard(name)
+        threading.Thread(target=run, name=f"library-{name}", daemon=True).start()
+
+    def snapshot(self) -> LibrarySnapshot:
+        """
+        Current snapshot. A manifest changed by another process is reloaded
+        in the background; queries keep using this snapshot until it is ready.
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._write_lock:
+                if self._snapshot is None:
+                    self._reload()
+            return self._snapshot
+        if self._mtime() != snapshot.mtime:
+            self._background("reload", self._reload)
+        return snapshot
+
+    # ========== Writes ==========
+    def _commit(self, manifest: dict, previous_files):
+        """
+        Drop what deletes made unreachable, write the manifest atomically and
+        swap in its snapshot (caller holds the writer lock).
+        """
+        books = manifest["books"]
+        manifest["shards"] = [s for s in manifest["shards"] if any(not books[k]["deleted"] for k in s["books"])]
+        held = {k for s in manifest["shards"] for k in s["books"]}
+        manifest["books"] = {k: b for k, b in books.items() if not b["deleted"] or k in held}
+        manifest["generation"] += 1
+
+        tmp = f"{self.manifest_path}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(tmp, self.manifest_path)
+        self._install(self._load_snapshot(manifest, self._mtime()))
+
+        # Only files this commit unlisted; shards being built by a compaction elsewhere are not listed yet
+        listed = {s["file"] for s in manifest["shards"]}
+        for name in set(previous_files) - listed:
+            try:
+                os.remove(os.path.join(self.dir, name))
+            except FileNotFoundError:
+                pass
+
+    def _write_shard(self, index, generation) -> str:
+        name = f"shard_{generation:06d}_{uuid.uuid4().hex[:8]}.index"
+        path = os.path.join(self.dir, name)
+        faiss.write_index(index, path + ".tmp")
+        os.replace(path + ".tmp", path)
+        return name
+
+    def add_book(self, book_id: str, id_map_path: str, name: str = None, replaces: str = None) -> dict:
+        """
+        Add a book's chunks (id_map of a built index) under a new id range.
+        A book already in the library is left as it is. `replaces` names the
+        book id of an earlier edition, which is deleted in the same commit.
+        """
+        id_map = load_id_map(id_map_path)
+        if not len(id_map):
+            raise ValueError(f"{id_map_path} has no chunks")
+        vectors = book_vectors(self.model_name, id_map, self.store)
+
+        rel_id_map = os.path.relpath(os.path.abspath(id_map_path), self.dir)
+        with self._locked():
+            manifest = self._read_manifest()
+            for book in manifest["books"].values():
+                if book["book_id"] == book_id and not book["deleted"]:
+                    return book
+            editions = [b for b in manifest["books"].values()
+                        if replaces and b["book_id"] == replaces and not b["deleted"]]
+            for book in editions:
+                book["deleted"] = True
+            if manifest["dim"] is None:
+                manifest["dim"] = int(vectors.shape[1])
+            elif manifest["dim"] != vectors.shape[1]:
+                raise ValueError(f"{self.model_name} library has dim {manifest['dim']}, got {vectors.shape[1]}")
+
+            start = manifest["next_id"]
+            index, meta = build_shard(vectors, np.arange(start, start + len(vectors)),
+                                      self.index_type, manifest["metric"])
+            book = {"book_id": book_id, "name": name or book_id,
+                    "id_map": rel_id_map,
+                    "start": start, "count": len(vectors), "deleted": False, "added": round(time.time(), 3)}
+            # Keyed by start id: ids are never reused, so a re-added book never collides with its tombstone
+            manifest["books"][str(start)] = book
+            manifest["next_id"] = start + len(vectors)
+            previous = [s["file"] for s in manifest["shards"]]
+            manifest["shards"].append({"file": self._write_shard(index, manifest["generation"] + 1),
+                                       "books": [str(start)], "ntotal": len(vectors), "meta": meta})
+            self._commit(manifest, previous)
+        print(f"[Library] {self.model_name}: added {book_id} ({len(vectors)} chunks, ids {start}-{start + len(vectors) - 1})"
+              f"{f', replacing {replaces}' if editions else ''}")
+        return book
+
+    def delete_book(self, book_id: str) -> bool:
+        """Remove a book's id range from search; its vectors go at the next compaction."""
+        with self._locked():
+            manifest = self._read_manifest()
+            books = [b for b in manifest["books"].values() if b["book_id"] == book_id and not b["deleted"]]
+            if not books:
+                return False
+            for book in books:
+                book["deleted"] = True
+            self._commit(manifest, [s["file"] for s in manifest["shards"]])
+        print(f"[Library] {self.model_name}: deleted {book_id}")
+        return True
+
+    def compact(self, force: bool = False) -> dict:
+        """
+        Merge the shards picked by compaction_plan (all shards with force)
+        into one without deleted books. The merged shard is built without
+        holding the writer lock; the commit is skipped if another compaction
+        replaced any of its shards first.
+        """
+        t0 = time.perf_counter()
+        manifest = self._read_manifest()
+        files = [s["file"] for s in manifest["shards"]] if force else compaction_plan(manifest)
+        selected = [s for s in manifest["shards"] if s["file"] in files]
+        if not selected or (len(selected) == 1 and not dead_vectors(manifest, selected[0])):
+            return {"compacted": 0}
+
+        live = [k for s in selected for k in s["books"] if not manifest["books"][k]["deleted"]]
+        merged = None
+        if live:
+            vectors, ids = [], []
+            for key in live:
+                book = manifest["books"][key]
+                vectors.append(book_vectors(self.model_name, self._id_map(book), self.store))
+                ids.append(np.arange(book["start"], book["start"] + book["count"]))
+            vectors, ids = np.concatenate(vectors), np.concatenate(ids)
+            index, meta = build_shard(vectors, ids, self.index_type, manifest["metric"])
+            merged = {"file": self._write_shard(index, manifest["generation"] + 1),
+                      "books": live, "ntotal": len(ids), "meta": meta}
+
+        with self._locked():
+            current = self._read_manifest()
+            previous = [s["file"] for s in current["shards"]]
+            if not set(files) <= set(previous):
+                if merged is not None:
+                    os.remove(os.path.join(self.dir, merged["file"]))
+                return {"compacted": 0, "conflict": True}
+            # Books deleted meanwhile stay listed in the merged shard as tombstones
+            current["shards"] = [s for s in current["shards"] if s["file"] not in files] + ([merged] if merged else [])
+            self._commit(current, previous)
+        self.compactions += 1
+        ms = (time.perf_counter() - t0) * 1000
+        print(f"[Library] {self.model_name}: compacted {len(selected)} shards into "
+              f"{1 if merged else 0} ({merged['ntotal'] if merged else 0} vectors, {ms:.0f} ms)", flush=True)
+        return {"compacted": len(selected), "vectors": merged["ntotal"] if merged else 0, "ms": round(ms, 1)}
+
+    # ========== Search ==========
+    def _id_map_path(self, book: dict) -> str:
+        return os.path.normpath(os.path.join(self.dir, book["id_map"]))
+
+    def _id_map(self, book: dict):
+        path = self._id_map_path(book)
+        id_map = self._id_maps.get(path)
+        if id_map is None:
+            id_map = load_id_map(path)
+            if path in self._live_id_maps:
+                # Books deleted since an older snapshot was taken are read but not kept
+                id_map = self._id_maps.setdefault(path, id_map)
+        return id_map
+
+    def search(self, q_vec, top_k: int, snapshot: LibrarySnapshot = None) -> list:
+        """
+        Top-k chunks of live books, best first. Each hit:
+        {"book", "book_id", "id" (chunk in the book's id_map), "score", "context"}.
+        """
+        t0 = time.perf_counter()
+        snapshot = snapshot or self.snapshot()
+        ids, scores = snapshot.search(q_vec, top_k)
+        hits = []
+        for vector_id, score in zip(ids, scores):
+            book = snapshot.book_of(vector_id)
+            chunk = int(vector_id) - book["start"]
+            hits.append({"book": book["name"], "book_id": book["book_id"], "id": chunk,
+                         "score": float(score), "context": self._id_map(book)[chunk]["context"]})
+        with self._state_lock:
+            self.queries += 1
+            self.total_ms += (time.perf_counter() - t0) * 1000
+        return hits
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        with self._state_lock:
+            out = {
+                "queries": self.queries,
+                "avg_ms": round(self.total_ms / self.queries, 2) if self.queries else 0.0,
+                "reloads": self.reloads,
+                "compactions": self.compactions,
+                "running": sorted(self._running)
+            }
+        if snapshot is not None:
+            out.update({
+                "generation": snapshot.generation,
+                "books": sum(not b["deleted"] for b in snapshot.books),
+                "tombstones": sum(b["deleted"] for b in snapshot.books),
+                "shards": len(snapshot.shards),
+                "vectors": snapshot.ntotal
+            })
+        return out
+
+
+class LibraryRegistry:
+    """One LibraryIndex per embed model, opened on first use."""
+
+    def __init__(self, root=LIBRARY_DIR, auto_compact=True):
+        self.root = root
+        self.auto_compact = auto_compact
+        self._libraries = {}
+        self._lock = threading.Lock()
+
+    def get(self, model_name) -> LibraryIndex:
+        with self._lock:
+            library = self._libraries.get(model_name)
+            if library is None:
+                library = LibraryIndex(model_name, self.root, auto_compact=self.auto_compact)
+                self._libraries[model_name] = library
+            return library
+
+    def stats(self) -> dict:
+        with self._lock:
+            libraries = dict(self._libraries)
+        return {name: library.stats() for name, library in libraries.items()}
+
+
+# Libraries searched by the RAG engine; compaction runs in the serving process
+libraries = LibraryRegistry()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Manage the library index of an embed model")
+    parser.add_argument("--embed_model", type=str, default=MODEL_NAME)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="Books, shards and tombstones")
+    add = commands.add_parser("add", help="Add a book from the id_map of its index")
+    add.add_argument("book_id")
+    add.add_argument("id_map")
+    add.add_argument("--name", type=str, default=None, help="Name shown in answers (default: book_id)")
+    add.add_argument("--replaces", type=str, default=None, help="Book id of an earlier edition to delete")
+    delete = commands.add_parser("delete", help="Delete a book")
+    delete.add_argument("book_id")
+    compact = commands.add_parser("compact", help="Merge shards and drop deleted books")
+    compact.add_argument("--force", action="store_true", help="Merge every shard, not only the planned ones")
+    args = parser.parse_args()
+
+    library = LibraryIndex(args.embed_model)
+    if args.command == "add":
+        result = library.add_book(args.book_id, args.id_map, args.name, args.replaces)
+    elif args.command == "delete":
+        result = {"deleted": library.delete_book(args.book_id)}
+    elif args.command == "compact":
+        result = library.compact(force=args.force)
+    else:
+        manifest = library._read_manifest()
+        result = {
+            "generation": manifest["generation"],
+            "books": [{k: b[k] for k in ("book_id", "name", "start", "count", "deleted")}
+                      for b in sorted(manifest["books"].values(), key=lambda b: b["start"])],
+            "shards": [{"file": s["file"], "ntotal": s["ntotal"], "index_type": s["meta"]["index_type"],
+                        "deleted": dead_vectors(manifest, s)} for s in manifest["shards"]],
+            "compaction_plan": compaction_plan(manifest)
+        }
+    print(json.dumps(result, ensure_ascii=False, indent=2), flush=True)
@@ -0,0 +1,301 @@
+# model_pool.py
+"""
+Process-wide pool of embedding models.
+
+Each distinct model is loaded lazily on first use and then shared by every
+request and thread. When the estimated resident size of all loaded models
+exceeds the RAM cap, the least recently used idle models are evicted;
+models that have not been used for `idle_seconds` are dropped as well, by a
+background sweep (and on every acquire and stats call).
+"""
+
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from config import EMBED_POOL_MAX_BYTES, EMBED_POOL_IDLE_SECONDS
+
+# A failed preload is not retried for this long, doubling per failure up to the max
+PRELOAD_RETRY_SECONDS = 30.0
+PRELOAD_MAX_RETRY_SECONDS = 600.0
+
+
+def load_sentence_transformer(model_name):
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name, trust_remote_code=True)
+
+
+def estimate_model_bytes(model) -> int:
+    """Sum of parameter and buffer sizes for a torch module (0 if unknown)."""
+    total = 0
+    for attr in ("parameters", "buffers"):
+        tensors = getattr(model, attr, None)
+        if tensors is None:
+            continue
+        for t in tensors():
+            total += t.numel() * t.element_size()
+    return total
+
+
+def model_fingerprint(model_name, model) -> str:
+    """
+    Identify a loaded model's weights cheaply: name, output dimension and a
+    sample of the first parameter tensor.
+    """
+    h = hashlib.sha1(model_name.encode("utf-8"))
+    get_dim = getattr(model, "get_sentence_embedding_dimension", None)
+    if get_dim is not None:
+        h.update(str(get_dim()).encode("utf-8"))
+    params = getattr(model, "parameters", None)
+    if params is not None:
+        for p in params():
+            h.update(p.detach().flatten()[:4096].float().cpu().numpy().tobytes())
+            break
+    return h.hexdigest()
+
+
+def model_files_fingerprint(model_name):
+    """
+    Identify a model's weights from its files, without loading it: the
+    snapshot revision in the Hugging Face cache, or the file sizes and mtimes
+    of a local model directory. None if the model is not on disk yet.
+    """
+    h = hashlib.sha1(model_name.encode("utf-8"))
+    if os.path.isdir(model_name):
+        for root, dirs, files in os.walk(model_name):
+            dirs.sort()
+            for name in sorted(files):
+                path = os.path.join(root, name)
+                st = os.stat(path)
+                h.update(f"{os.path.relpath(path, model_name)}:{st.st_size}:{st.st_mtime_ns}".encode("utf-8"))
+        return h.hexdigest()
+
+    # Bare names resolve to the sentence-transformers organization, as in SentenceTransformer()
+    repo = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    try:
+        from huggingface_hub.constants import HF_HUB_CACHE
+    except ImportError:
+        HF_HUB_CACHE = os.path.join(os.environ.get("HF_HOME", os.path.expanduser("~/.cache/huggingface")), "hub")
+    try:
+        with open(os.path.join(HF_HUB_CACHE, "models--" + repo.replace("/", "--"), "refs", "main"),
+                  "r", encoding="utf-8") as f:
+            h.update(f.read().strip().encode("utf-8"))
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+class _PooledModel:
+    __slots__ = ("model", "fingerprint", "nbytes", "load_seconds", "last_used", "uses", "in_use")
+
+    def __init__(self, model, fingerprint, nbytes, load_seconds):
+        self.model = model
+        self.fingerprint = fingerprint
+        self.nbytes = nbytes
+        self.load_seconds = load_seconds
+        self.last_used = time.time()
+        self.uses = 0
+        self.in_use = 0
+
+
+class ModelPool:
+    def __init__(self, loader=load_sentence_transformer, max_bytes=EMBED_POOL_MAX_BYTES,
+                 idle_seconds=EMBED_POOL_IDLE_SECONDS):
+        """
+        loader:       callable(model_name) -> model
+        max_bytes:    RAM cap for all resident models
+        idle_seconds: drop models unused for this long (0 disables)
+        """
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.idle_seconds = idle_seconds
+        self._models = OrderedDict()   # name -> _PooledModel, LRU order
+        self._loading = {}             # name -> Lock, so each model loads once
+        self._lock = threading.Lock()
+        self._sweeper = None           # idle-timeout thread, started with the first load
+        self._preloading = set()       # names with a preload thread running
+        self._failed = {}              # name -> (retry_at, backoff, error) of failed preloads
+        self.loads = 0
+        self.evictions = 0
+
+    @contextmanager
+    def acquire(self, model_name):
+        """Borrow a model; it will not be evicted while borrowed."""
+        entry = self._get_entry(model_name)
+        try:
+            yield entry.model
+        finally:
+            with self._lock:
+                entry.in_use -= 1
+                entry.last_used = time.time()
+
+    def get(self, model_name):
+        """Return a shared model without pinning it."""
+        with self.acquire(model_name) as model:
+            return model
+
+    def is_loaded(self, model_name) -> bool:
+        with self._lock:
+            return model_name in self._models
+
+    def preload(self, model_name):
+        """
+        Load a model in a background thread. Returns the thread, or None when
+        the model is resident, already loading, or backing off after a failed load.
+        """
+        with self._lock:
+            failed = self._failed.get(model_name)
+            if model_name in self._models or model_name in self._preloading or \
+                    (failed is not None and time.time() < failed[0]):
+                return None
+            self._preloading.add(model_name)
+
+        def load():
+            try:
+                with self.acquire(model_name):
+                    pass
+                with self._lock:
+                    self._failed.pop(model_name, None)
+            except Exception as e:
+                with self._lock:
+                    backoff = min(self._failed[model_name][1] * 2, PRELOAD_MAX_RETRY_SECONDS) \
+                        if model_name in self._failed else PRELOAD_RETRY_SECONDS
+                    self._failed[model_name] = (time.time() + backoff, backoff, str(e))
+                print(f"[ModelPool] Failed to load {model_name}: {e} (retry in {backoff:.0f}s)", flush=True)
+            finally:
+                with self._lock:
+                    self._preloading.discard(model_name)
+        thread = threading.Thread(target=load, name=f"model-preload-{model_name}", daemon=True)
+        thread.start()
+        return thread
+
+    def load_error(self, model_name):
+        """Error of the last failed preload while it is backing off, else None."""
+        with self._lock:
+            failed = self._failed.get(model_name)
+            return failed[2] if failed is not None and time.time() < failed[0] else None
+
+    def files_fingerprint(self, model_name) -> str:
+        """
+        Fingerprint of the model's files on disk (see model_files_fingerprint),
+        so callers need not load the model; falls back to loading it when the
+        files cannot be found.
+        """
+        return model_files_fingerprint(model_name) or self.fingerprint(model_name)
+
+    def fingerprint(self, model_name) -> str:
+        """Fingerprint of the model's weights, loading it if needed."""
+        entry = self._get_entry(model_name)
+        with self._lock:
+            entry.in_use -= 1
+        return entry.fingerprint
+
+    def _get_entry(self, model_name) -> _PooledModel:
+        with self._lock:
+            self._drop_idle(keep=model_name)
+            entry = self._models.get(model_name)
+            if entry is not None:
+                self._models.move_to_end(model_name)
+                entry.in_use += 1
+                entry.uses += 1
+                return entry
+            load_lock = self._loading.setdefault(model_name, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                entry = self._models.get(model_name)
+                if entry is not None:
+                    self._models.move_to_end(model_name)
+                    entry.in_use += 1
+                    entry.uses += 1
+                    return entry
+
+            t0 = time.time()
+            model = self.loader(model_name)
+            load_seconds = time.time() - t0
+            entry = _PooledModel(
+                model, model_fingerprint(model_name, model), estimate_model_bytes(model), load_seconds
+            )
+            print(f"[ModelPool] Loaded {model_name} in {load_seconds:.2f}s "
+                  f"({entry.nbytes / 1024 ** 2:.1f} MB)", flush=True)
+
+            with self._lock:
+                entry.in_use += 1
+                entry.uses += 1
+                self._models[model_name] = entry
+                self.loads += 1
+                self._loading.pop(model_name, None)
+                self._evict(keep=model_name)
+                self._start_sweeper()
+        return entry
+
+    def _drop_idle(self, keep=None):
+        """Drop models unused for idle_seconds (caller holds the lock)."""
+        if not self.idle_seconds:
+            return
+        now = time.time()
+        for name in [n for n, e in self._models.items()
+                     if n != keep and not e.in_use and now - e.last_used > self.idle_seconds]:
+            del self._models[name]
+            self.evictions += 1
+            print(f"[ModelPool] Dropped {name} (idle)", flush=True)
+
+    def _start_sweeper(self):
+        """Drop idle models even when no request comes in (caller holds the lock)."""
+        if not self.idle_seconds or self._sweeper is not None:
+            return
+
+        def sweep():
+            while True:
+                time.sleep(max(1.0, min(self.idle_seconds / 2, 60.0)))
+                with self._lock:
+                    self._drop_idle()
+        self._sweeper = threading.Thread(target=sweep, name="model-pool-sweeper", daemon=True)
+        self._sweeper.start()
+
+    def _evict(self, keep=None):
+        """Drop idle-timeout and over-budget models (caller holds the lock)."""
+        self._drop_idle(keep)
+        total = sum(e.nbytes for e in self._models.values())
+        for name in list(self._models):
+            if total <= self.max_bytes:
+                break
+            entry = self._models[name]
+            if name == keep or entry.in_use:
+                continue
+            del self._models[name]
+            total -= entry.nbytes
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        now = time.time()
+        with self._lock:
+            self._drop_idle()
+            return {
+                "resident_bytes": sum(e.nbytes for e in self._models.values()),
+                "max_bytes": self.max_bytes,
+                "loads": self.loads,
+                "evictions": self.evictions,
+                "models": {
+                    name: {
+                        "fingerprint": e.fingerprint[:12],
+                        "load_seconds": round(e.load_seconds, 3),
+                        "resident_bytes": e.nbytes,
+                        "uses": e.uses,
+                        "in_use": e.in_use,
+                        "idle_seconds": round(now - e.last_used, 1)
+                    }
+                    for name, e in self._models.items()
+                },
+                "failed_loads": {
+                    name: {"error": error, "retry_in": round(max(0.0, retry_at - now), 1)}
+                    for name, (retry_at, _, error) in self._failed.items()
+                }
+            }
+
+
+# Shared pool for SentenceTransformer embedding models
+embed_pool = ModelPool()
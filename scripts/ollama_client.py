@@ -0,0 +1,155 @@
+# ollama_client.py
+"""
+Shared HTTP client for the local Ollama server.
+
+One pooled keep-alive session is reused for every call. Each model gets its
+own concurrency limit, every request has connect/read timeouts, and
+connection failures or 5xx/429 responses are retried a bounded number of
+times with exponential backoff. `AsyncOllamaClient` offers the same calls
+for asyncio code.
+"""
+
+import asyncio
+import json
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from config import (
+    OLLAMA_URL, OLLAMA_CONNECT_TIMEOUT, OLLAMA_READ_TIMEOUT, OLLAMA_MAX_RETRIES,
+    OLLAMA_RETRY_BACKOFF, OLLAMA_MAX_CONCURRENCY, OLLAMA_MODEL_CONCURRENCY
+)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class OllamaClient:
+    def __init__(self, url=OLLAMA_URL, connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+                 read_timeout=OLLAMA_READ_TIMEOUT, max_retries=OLLAMA_MAX_RETRIES,
+                 backoff=OLLAMA_RETRY_BACKOFF, max_concurrency=OLLAMA_MAX_CONCURRENCY,
+                 model_concurrency=None):
+        """
+        url:               Ollama /api/generate endpoint
+        connect_timeout:   seconds to establish a connection
+        read_timeout:      seconds to wait between bytes of the response
+        max_retries:       retries after the first attempt
+        backoff:           base delay in seconds, doubled per retry
+        max_concurrency:   in-flight requests per model by default
+        model_concurrency: per-model overrides, e.g. {"llama3:8b": 1}
+        """
+        self.url = url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_concurrency = max_concurrency
+        self.model_concurrency = dict(OLLAMA_MODEL_CONCURRENCY if model_concurrency is None else model_concurrency)
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+        self.session = requests.Session()
+        self._pool_size = 0
+        self._size_pool()
+
+    def _size_pool(self):
+        """Mount a larger connection pool if the concurrency limits outgrew it."""
+        pool_size = max([self.max_concurrency, *self.model_concurrency.values()]) * 4
+        if pool_size <= self._pool_size:
+            return
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool_size = pool_size
+
+    def set_model_concurrency(self, model, limit):
+        """Change a model's in-flight limit, growing the connection pool to match."""
+        with self._lock:
+            self.model_concurrency[model] = limit
+            self._semaphores.pop(model, None)
+            self._size_pool()
+
+    @contextmanager
+    def _slot(self, model):
+        """Hold one of the model's concurrency slots."""
+        with self._lock:
+            sem = self._semaphores.get(model)
+            if sem is None:
+                sem = threading.BoundedSemaphore(self.model_concurrency.get(model, self.max_concurrency))
+                self._semaphores[model] = sem
+        with sem:
+            yield
+
+    def _post(self, payload, stream):
+        """POST with retries on connection errors, timeouts and retryable statuses."""
+        for attempt in range(self.max_retries + 1):
+            last = attempt == self.max_retries
+            try:
+                response = self.session.post(self.url, json=payload, timeout=self.timeout, stream=stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if last:
+                    raise
+                print(f"[Ollama] {type(e).__name__}, retrying ({attempt + 1}/{self.max_retries})", flush=True)
+            else:
+                if response.status_code not in RETRY_STATUSES or last:
+                    return response
+                response.close()
+                print(f"[Ollama] HTTP {response.status_code}, retrying ({attempt + 1}/{self.max_retries})", flush=True)
+            time.sleep(self.backoff * (2 ** attempt) * (0.5 + random.random()))
+
+    def generate(self, model, prompt, **options):
+        """Non-streaming generation; returns Ollama's JSON response."""
+        payload = {"model": model, "prompt": prompt, "stream": False, **options}
+        with self._slot(model):
+            response = self._post(payload, stream=False)
+            try:
+                return response.json()
+            finally:
+                response.close()
+
+    def generate_stream(self, model, prompt, **options):
+        """Streaming generation; yields Ollama's NDJSON chunks as dicts."""
+        payload = {"model": model, "prompt": prompt, "stream": True, **options}
+        with self._slot(model):
+            with self._post(payload, stream=True) as response:
+                for line in response.iter_lines():
+                    if line:
+                        yield json.loads(line)
+
+
+class AsyncOllamaClient:
+    """asyncio front-end that runs an OllamaClient's calls in worker threads."""
+
+    def __init__(self, client=None):
+        self.client = client or ollama
+
+    async def generate(self, model, prompt, **options):
+        return await asyncio.to_thread(self.client.generate, model, prompt, **options)
+
+    async def generate_stream(self, model, prompt, **options):
+        loop = asyncio.get_running_loop()
+        queue = asyncio.Queue()
+        done = object()
+
+        def pump():
+            try:
+                for chunk in self.client.generate_stream(model, prompt, **options):
+                    loop.call_soon_threadsafe(queue.put_nowait, chunk)
+            except Exception as e:
+                loop.call_soon_threadsafe(queue.put_nowait, e)
+            loop.call_soon_threadsafe(queue.put_nowait, done)
+
+        loop.run_in_executor(None, pump)
+        while True:
+            item = await queue.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+# Shared client used by all scripts
+ollama = OllamaClient()
@@ -0,0 +1,95 @@
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from config import *
+from chunk_store import ChunkStore, convert_json_id_map, load_id_map
+
+
+# ========== Configuration Section ==========
+ID_MAP_PATH = ID_MAP
+LOOKUPS = 1000  # queries of TOP_K fetches each
+TOP_K = 3
+# ===========================================
+
+def rss_bytes():
+    """Current resident set size of this process."""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+def measure(path, fmt):
+    """Load one format and fetch TOP_K records per lookup; runs in a fresh process."""
+    rss0 = rss_bytes()
+    t0 = time.perf_counter()
+    if fmt == "json":
+        with open(path, "r", encoding="utf-8") as f:
+            id_map = json.load(f)
+    else:
+        id_map = ChunkStore(path)
+    load_ms = (time.perf_counter() - t0) * 1000
+    rss_loaded = rss_bytes()
+
+    rng = random.Random(0)
+    t0 = time.perf_counter()
+    for _ in range(LOOKUPS):
+        for i in rng.sample(range(len(id_map)), min(TOP_K, len(id_map))):
+            id_map[i]["context"]
+    fetch_us = (time.perf_counter() - t0) * 1e6 / LOOKUPS
+    return {
+        "format": fmt,
+        "file_bytes": os.path.getsize(path),
+        "load_ms": round(load_ms, 2),
+        "rss_delta_bytes": rss_loaded - rss0,
+        "fetch_top_k_us": round(fetch_us, 2)
+    }
+
+def synthetic_id_map(n, path):
+    words = "probability random variable expectation variance distribution theorem proof sample".split()
+    rng = random.Random(0)
+    id_map = [{"index": i, "context": " ".join(rng.choice(words) for _ in range(180)),
+               "question": "What is this paragraph about?", "chunk_hash": f"{i:064x}"} for i in range(n)]
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(id_map, f, ensure_ascii=False, indent=2)
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(description="Load time, RSS and fetch latency: id_map JSON vs binary chunk store")
+    cli.add_argument("--id_map", type=str, default=ID_MAP_PATH, help="Legacy id_map_*.json file")
+    cli.add_argument("--synthetic", type=int, default=0, help="Benchmark N synthetic chunks instead")
+    cli.add_argument("--_measure", nargs=2, metavar=("FORMAT", "PATH"), help=argparse.SUPPRESS)
+    args = cli.parse_args()
+
+    if args._measure:
+        print(json.dumps(measure(args._measure[1], args._measure[0])))
+        sys.exit(0)
+
+    tmp_dir = tempfile.mkdtemp()
+    json_path = args.id_map
+    if args.synthetic:
+        json_path = os.path.join(tmp_dir, "id_map.json")
+        synthetic_id_map(args.synthetic, json_path)
+    chunks_path = convert_json_id_map(json_path, os.path.join(tmp_dir, "id_map.chunks"))
+
+    # Each format is measured in its own interpreter so RSS is not shared
+    results = []
+    for fmt, path in (("json", json_path), ("chunks", chunks_path)):
+        out = subprocess.run([sys.executable, __file__, "--_measure", fmt, path],
+                             capture_output=True, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{len(load_id_map(chunks_path))} chunks")
+    for r in results:
+        print(f"{r['format']:7s} file={r['file_bytes'] / 1e6:8.2f}MB  load={r['load_ms']:9.2f}ms  "
+              f"rss+={r['rss_delta_bytes'] / 1e6:8.2f}MB  fetch top-{TOP_K}={r['fetch_top_k_us']:.1f}us")
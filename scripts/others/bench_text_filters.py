@@ -0,0 +1,139 @@
+import argparse
+import re
+import time
+from pathlib import Path
+import fitz  # PyMuPDF
+from config import *
+from text_filters import (
+    clean_line, is_probably_toc_line, is_numbered_toc_line, is_valid_paragraph,
+    split_sentences, find_defined_term, extract_main_concept
+)
+
+
+# ========== Configuration Section ==========
+PDF_PATH = DEFAULT_PDF
+REPEAT = 5
+# ===========================================
+
+# ========== Legacy Filters (per-call re.* over pattern lists) ==========
+LEGACY_HEADER_PATTERNS = [
+    r"^\d+\s+CHAPTER\s+\d+",
+    r"^CHAPTER\s+\d+(\.\d+)?",
+    r"^Figure\s+\d+(\.\d+)?",
+    r"^Table\s+\d+(\.\d+)?",
+    r"^Page\s+\d+$"
+]
+
+LEGACY_REGEX_PATTERNS = [
+    r"([A-Z][\w\s-]{2,}) is defined as",
+    r"([A-Z][\w\s-]{2,}) is called",
+    r"([A-Z][\w\s-]{2,}) refers to",
+    r"([A-Z][\w\s-]{2,}) represents",
+    r"([A-Z][\w\s-]{2,}) denotes",
+    r"([A-Z][\w\s-]{2,}) means"
+]
+
+def legacy_clean_line(line: str) -> str:
+    for pat in LEGACY_HEADER_PATTERNS:
+        if re.match(pat, line, re.IGNORECASE):
+            return ""
+    return line.strip()
+
+def legacy_is_probably_toc_line(line: str) -> bool:
+    if not line.strip():
+        return True
+    if "table of contents" in line.lower():
+        return True
+    if re.search(r'\.{3,}', line):
+        return True
+    if re.search(r'\s\.+\s*\d{1,3}$', line):
+        return True
+    if re.fullmatch(r'[\d\.\s]+', line.strip()):
+        return True
+    toc_keywords = ["exercise", "section", "chapter", "contents", "index"]
+    if any(k in line.lower() for k in toc_keywords) and len(line.split()) <= 10:
+        return True
+    return False
+
+def legacy_is_numbered_toc_line(line: str) -> bool:
+    return bool(
+        "table of contents" in line.lower()
+        or re.search(r'\.{3,}', line)
+        or re.match(r'\s*\d+(\.\d+)*\s+.*', line)
+        or re.search(r'\s\.+\s\d{1,3}$', line)
+    )
+
+def legacy_is_valid_paragraph(text: str) -> bool:
+    if len(text) < 40:
+        return False
+    if re.fullmatch(r'[\d\s.]+', text):
+        return False
+    if text.count('.') > 30:
+        return False
+    return True
+
+def legacy_find_defined_term(text: str):
+    for pat in LEGACY_REGEX_PATTERNS:
+        if m := re.search(pat, text):
+            return m.group(1)
+    return None
+
+def legacy_extract_main_concept(text: str):
+    if m := re.search(r"([A-Z][\w ]+?)\s+(is|are|denotes|means|represents|refers to|called)", text):
+        c = m.group(1).strip()
+        return None if c.lower() in {"it", "this", "that"} else c
+    return None
+
+LEGACY = (legacy_clean_line, legacy_is_probably_toc_line, legacy_is_numbered_toc_line,
+          lambda s: re.split(r'(?<=[.!?])\s+', s), legacy_is_valid_paragraph,
+          legacy_find_defined_term, legacy_extract_main_concept)
+CURRENT = (clean_line, is_probably_toc_line, is_numbered_toc_line, split_sentences,
+           is_valid_paragraph, find_defined_term, extract_main_concept)
+
+# ========== Benchmark ==========
+def load_lines(pdf_path: Path) -> list:
+    """Raw text blocks of every page, flattened the way the generators see them."""
+    doc = fitz.open(pdf_path)
+    lines = [block[4].replace("\n", " ").strip() for page in doc for block in page.get_text("blocks")]
+    doc.close()
+    return [ln for ln in lines if ln]
+
+def run_filters(lines: list, filters) -> list:
+    """Apply the full line -> sentence -> paragraph filter chain; returns every decision."""
+    clean, toc, numbered_toc, split, valid, defined, concept = filters
+    out = []
+    for ln in lines:
+        cleaned = clean(ln)
+        out.append((cleaned, toc(cleaned) if cleaned else None, numbered_toc(cleaned)))
+        if cleaned and not toc(cleaned):
+            out.append(split(cleaned))
+            if valid(cleaned):
+                out.append((defined(cleaned), concept(cleaned)))
+    return out
+
+def bench(lines: list, filters, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        run_filters(lines, filters)
+        best = min(best, time.perf_counter() - t0)
+    return len(lines) / best
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(description="Lines/sec of the PDF text filters, legacy vs precompiled")
+    cli.add_argument("--pdf", type=str, default=PDF_PATH)
+    cli.add_argument("--repeat", type=int, default=REPEAT, help="Best-of-N timing runs")
+    args = cli.parse_args()
+
+    lines = load_lines(Path(args.pdf))
+    print(f"Loaded {len(lines)} text blocks from {args.pdf}")
+
+    if run_filters(lines, LEGACY) != run_filters(lines, CURRENT):
+        raise SystemExit("Mismatch: precompiled filters disagree with the legacy implementation")
+    print("Outputs identical to the legacy implementation")
+
+    legacy_rate = bench(lines, LEGACY, args.repeat)
+    current_rate = bench(lines, CURRENT, args.repeat)
+    print(f"Legacy:      {legacy_rate:,.0f} lines/sec")
+    print(f"Precompiled: {current_rate:,.0f} lines/sec")
+    print(f"Speedup:     {current_rate / legacy_rate:.2f}x")
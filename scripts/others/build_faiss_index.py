@@ -2,9 +2,11 @@ import json
 import os
 from pathlib import Path
 from sentence_transformers import SentenceTransformer
-import faiss
 import numpy as np
 from config import *
+from bm25_index import bm25_path, write_bm25
+from chunk_store import write_id_map
+from faiss_index import build_index, write_index
 
 
 # ========== Configuration Section ==========
@@ -12,6 +14,8 @@ JSONL_PATH = QA_WITH_ANS
 INDEX_OUT = FAISS_INDEX
 ID_MAP_OUT = ID_MAP
 EMBED_MODEL = MODEL_NAME
+INDEX_TYPE = FAISS_INDEX_TYPE  # auto | flat | hnsw | ivf_flat | ivf_pq
+METRIC = FAISS_METRIC  # cosine | l2
 # ===========================================
 
 def load_contexts(jsonl_path):
@@ -37,15 +41,12 @@ def embed_texts(texts, model_name):
     return embeddings
 
 def build_and_save_faiss_index(embeddings, index_path, id_map_path, id_map):
-    """Build FAISS index and save it along with the ID map."""
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
-
-    faiss.write_index(index, index_path)
-    with open(id_map_path, "w", encoding="utf-8") as f:
-        json.dump(id_map, f, ensure_ascii=False, indent=2)
-    print(f"Index saved to {index_path}, ID map saved to {id_map_path}")
+    """Build FAISS index and save it along with the ID map and the BM25 index."""
+    index, meta = build_index(embeddings, INDEX_TYPE, METRIC)
+    write_index(index, {**meta, "embed_model": EMBED_MODEL}, index_path)
+    write_bm25([item["context"] for item in id_map], bm25_path(index_path))
+    write_id_map(id_map, id_map_path)
+    print(f"{meta['index_type']} index saved to {index_path}, ID map saved to {id_map_path}")
 
 def main():
     print("Loading data...")
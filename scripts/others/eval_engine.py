@@ -0,0 +1,250 @@
+# eval_engine.py
+"""
+Batched, resumable evaluation engine shared by batch_eval.py and
+batch_eval_multi_model.py.
+
+For each embed model, every question is encoded in one batched call and
+searched with one FAISS call over the whole question matrix. This retrieval
+stage (plus the index build, if one is requested) runs in a worker process.
+The next model is therefore embedded and searched while the current model's
+answers are still being generated, and each model's memory is freed when its
+stage ends. LLM calls go through a bounded thread pool; they are I/O-bound,
+and the shared Ollama client caps in-flight requests per model as well.
+
+Each finished LLM call is appended to a JSONL records file straight away. A
+rerun reads the file first and skips every (question, embed model, mode)
+already answered, so an interrupted evaluation resumes where it stopped.
+Failed calls are recorded with "error" and retried on the next run.
+"""
+
+import json
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from config import OLLAMA_MODEL
+from ollama_client import ollama
+
+LLM_ERROR_PREFIXES = ("Ollama returned error:", "Unknown error:")
+
+
+# ========== Retrieval Stage (worker process) ==========
+def retrieve_batch(model_name, questions, index_path, id_map_path, top_k, batch_size=64, jsonl_path=None):
+    """
+    Top-k contexts of every question for one embed model, building the index
+    from jsonl_path first when given. Returns the contexts plus stage timings.
+    """
+    from sentence_transformers import SentenceTransformer
+    from build_faiss_index_core import build_index_with_model
+    from chunk_store import load_id_map
+    from faiss_index import load_index
+
+    started = time.time()
+    build_time = 0.0
+    if jsonl_path:
+        t_build = time.time()
+        counts = build_index_with_model(jsonl_path, model_name, index_path, id_map_path)
+        build_time = time.time() - t_build
+        print(f"  → {model_name}: {counts['encoded']} contexts encoded, {counts['reused']} from the embedding store",
+              flush=True)
+
+    model = SentenceTransformer(model_name, trust_remote_code=True)
+    t_embed = time.time()
+    q_vecs = model.encode(questions, batch_size=batch_size, convert_to_numpy=True).astype("float32")
+    embed_time = time.time() - t_embed
+
+    index = load_index(index_path)
+    id_map = load_id_map(id_map_path)
+    t_search = time.time()
+    _, I = index.search(q_vecs, top_k)
+    contexts = [[id_map[i]["context"] for i in row if i >= 0] for row in I]
+    search_time = time.time() - t_search
+
+    return {
+        "contexts": contexts,
+        "started": started,
+        "index_build_time": build_time,
+        "embedding_time": embed_time,
+        "retrieval_time": search_time
+    }
+
+
+# ========== Records ==========
+RECORD_FIELDS = ("question_id", "question", "embed_model", "mode")
+
+
+def record_key(record) -> tuple:
+    return tuple(record[field] for field in RECORD_FIELDS)
+
+
+def load_records(path) -> tuple:
+    """
+    Successful records of an earlier (possibly interrupted) run, by
+    record_key, plus the number of lines that are not engine records
+    (e.g. results written by the scripts before they used the engine).
+    """
+    records, foreign = {}, 0
+    if not os.path.exists(path):
+        return records, foreign
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue   # last line of a run that was killed mid-write
+            if not isinstance(record, dict) or any(field not in record for field in RECORD_FIELDS):
+                foreign += 1
+            elif not record.get("error"):
+                records[record_key(record)] = record
+    return records, foreign
+
+
+def write_records(records, path):
+    """Rewrite the records file atomically (e.g. in question order once a run is complete)."""
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp, path)
+
+
+# ========== Engine ==========
+class EvalEngine:
+    def __init__(self, records_path, llm_model=OLLAMA_MODEL, llm_workers=2, embed_processes=1, embed_batch_size=64):
+        """
+        records_path:     JSONL file that finished LLM calls are appended to (and resumed from)
+        llm_model:        Ollama model that answers every prompt
+        llm_workers:      concurrent LLM calls
+        embed_processes:  embed models retrieved in parallel worker processes
+        embed_batch_size: questions per encode batch
+        """
+        self.records_path = records_path
+        self.llm_model = llm_model
+        self.llm_workers = llm_workers
+        self.embed_processes = embed_processes
+        self.embed_batch_size = embed_batch_size
+        self._write_lock = threading.Lock()
+
+    def _answer(self, prompt) -> tuple:
+        """(answer, seconds, error) for one prompt."""
+        t0 = time.time()
+        try:
+            result = ollama.generate(self.llm_model, prompt)
+        except Exception as e:
+            return f"Ollama returned error: {e}", time.time() - t0, True
+        if "response" in result:
+            answer = result["response"].strip()
+        elif "error" in result:
+            answer = f"Ollama returned error: {result['error']}"
+        else:
+            answer = "Unknown error: no response field"
+        return answer, time.time() - t0, answer.startswith(LLM_ERROR_PREFIXES)
+
+    def run(self, questions, modes, retrievals=None, top_k=3) -> tuple:
+        """
+        Answer every question in every mode.
+
+        modes:      [{"mode", "embed_model" (None = no retrieval), "prompt": fn(question, contexts) -> str}]
+        retrievals: {embed_model: {"index", "id_map", "jsonl"?}} for the modes that retrieve;
+                    with "jsonl" the index is (re)built in the worker first
+        Returns (records in question/mode order, timings per embed model).
+        """
+        retrievals = retrievals or {}
+        done, foreign = load_records(self.records_path)
+        if foreign:
+            # Never append records to a file in another format; keep it aside instead
+            legacy = f"{self.records_path}.legacy"
+            os.replace(self.records_path, legacy)
+            write_records(done.values(), self.records_path)
+            print(f"[Eval] {self.records_path} holds {foreign} lines in an older format; moved to {legacy}",
+                  flush=True)
+        pending = {(m["mode"], m["embed_model"]): [qid for qid, q in enumerate(questions)
+                                                    if (qid, q, m["embed_model"], m["mode"]) not in done]
+                   for m in modes}
+        total = sum(len(qids) for qids in pending.values())
+        print(f"[Eval] {len(questions)} questions x {len(modes)} modes: "
+              f"{len(done)} answers resumed, {total} to generate", flush=True)
+
+        timings = {}
+        progress = {"done": 0}
+        t_run = time.time()
+
+        def answer_task(qid, mode, contexts):
+            question = questions[qid]
+            prompt = mode["prompt"](question, contexts)
+            answer, seconds, error = self._answer(prompt)
+            record = {"question_id": qid, "question": question, "embed_model": mode["embed_model"],
+                      "mode": mode["mode"], "prompt": prompt, "answer": answer, "llm_time": round(seconds, 3)}
+            if mode["embed_model"] is not None:
+                record["retrieved"] = contexts
+            if error:
+                record["error"] = True
+            with self._write_lock:
+                log.write(json.dumps(record, ensure_ascii=False) + "\n")
+                log.flush()
+                if not error:
+                    done[record_key(record)] = record
+                progress["done"] += 1
+                finished = progress["done"]
+                if mode["embed_model"] in timings:
+                    timings[mode["embed_model"]]["finished"] = time.time()
+            print(f"  → [{finished}/{total}] {mode['mode']}"
+                  f"{' (' + mode['embed_model'] + ')' if mode['embed_model'] else ''} q{qid + 1}"
+                  f"{' failed' if error else ''} in {seconds:.1f}s", flush=True)
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.records_path)), exist_ok=True)
+        spawn = multiprocessing.get_context("spawn")   # workers never inherit the LLM threads
+        with open(self.records_path, "a", encoding="utf-8") as log, \
+                ThreadPoolExecutor(max_workers=self.llm_workers, thread_name_prefix="eval-llm") as llm, \
+                ProcessPoolExecutor(max_workers=self.embed_processes, mp_context=spawn) as workers:
+            stages = {}
+            for model_name, spec in retrievals.items():
+                if not any(pending[(m["mode"], m["embed_model"])] for m in modes if m["embed_model"] == model_name):
+                    continue
+                print(f"[Eval] Retrieving with {model_name}", flush=True)
+                stages[workers.submit(retrieve_batch, model_name, questions, spec["index"], spec["id_map"], top_k,
+                                      self.embed_batch_size, spec.get("jsonl"))] = model_name
+
+            calls = [llm.submit(answer_task, qid, m, []) for m in modes if m["embed_model"] is None
+                     for qid in pending[(m["mode"], None)]]
+            for stage in as_completed(stages):
+                model_name = stages[stage]
+                result = stage.result()
+                timings[model_name] = {**{k: result[k] for k in ("index_build_time", "embedding_time",
+                                                                 "retrieval_time")},
+                                       "started": result["started"], "finished": time.time()}
+                print(f"[Eval] {model_name}: embed {result['embedding_time']:.2f}s, "
+                      f"search {result['retrieval_time']:.2f}s", flush=True)
+                for m in modes:
+                    if m["embed_model"] == model_name:
+                        calls += [llm.submit(answer_task, qid, m, result["contexts"][qid])
+                                  for qid in pending[(m["mode"], model_name)]]
+            for call in calls:
+                call.result()
+
+        records = [done[(qid, q, m["embed_model"], m["mode"])] for qid, q in enumerate(questions) for m in modes
+                   if (qid, q, m["embed_model"], m["mode"]) in done]
+        failed = len(questions) * len(modes) - len(records)
+        if not failed:
+            write_records(records, self.records_path)
+        print(f"[Eval] Finished in {time.time() - t_run:.1f}s"
+              f"{f'; {failed} answers failed, rerun to retry them' if failed else ''}", flush=True)
+
+        report = []
+        for model_name in retrievals:
+            model_records = [r for r in records if r["embed_model"] == model_name]
+            stage = timings.get(model_name, {})
+            report.append({
+                "model": model_name,
+                "total_questions": len(questions),
+                "total_time": round(stage["finished"] - stage["started"], 2) if stage else 0.0,
+                "index_build_time": round(stage.get("index_build_time", 0.0), 2),
+                "embedding_time": round(stage.get("embedding_time", 0.0), 2),
+                "retrieval_time": round(stage.get("retrieval_time", 0.0), 2),
+                # Sum of per-call times; calls overlap, so this can exceed total_time
+                "llm_inference_time": round(sum(r["llm_time"] for r in model_records), 2),
+                "resumed": not stage
+            })
+        return records, report
@@ -0,0 +1,121 @@
+import argparse
+import json
+import time
+import faiss
+import numpy as np
+from config import *
+from build_faiss_index_core import chunk_hash
+from embedding_store import embedding_store
+from faiss_index import INDEX_TYPES, SearchIndex, build_index, apply_search_params
+
+
+# ========== Configuration Section ==========
+JSONL_PATH = QA_WITH_ANS
+EMBED_MODEL = MODEL_NAME
+TOP_K = 10
+MAX_QUERIES = 500
+METRIC = FAISS_METRIC
+OUTPUT_FILE = "../report/index_recall_report.jsonl"
+
+# Search-time settings swept per index type
+SWEEP = {
+    "flat": [{}],
+    "hnsw": [{"ef_search": ef} for ef in (16, 32, 64, 128, 256)],
+    "ivf_flat": [{"nprobe": p} for p in (1, 4, 16, 64)],
+    "ivf_pq": [{"nprobe": p} for p in (1, 4, 16, 64)],
+}
+# ===========================================
+
+def load_book_vectors(jsonl_path, model_name, max_queries):
+    """Context embeddings (via the embedding store) and question embeddings of one book."""
+    from sentence_transformers import SentenceTransformer
+    contexts, questions = [], []
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            obj = json.loads(line)
+            ctx = obj.get("context", "").strip()
+            if len(ctx) > 30:
+                contexts.append(ctx)
+                if obj.get("question"):
+                    questions.append(obj["question"])
+
+    model = SentenceTransformer(model_name, trust_remote_code=True)
+    encode = lambda texts: model.encode(texts, batch_size=64, convert_to_numpy=True)
+    corpus, _ = embedding_store.get_or_encode(model_name, [chunk_hash(c) for c in contexts], contexts, encode)
+    queries = encode(questions[:max_queries]).astype("float32")
+    return corpus, queries
+
+def synthetic_vectors(n, dim, n_queries, seed=0):
+    """Clustered random vectors, for sizing settings beyond the books we have."""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((max(1, n // 1000), dim)).astype("float32")
+    corpus = centers[rng.integers(len(centers), size=n)] + 0.3 * rng.standard_normal((n, dim)).astype("float32")
+    queries = corpus[rng.choice(n, size=n_queries, replace=False)] + 0.05 * rng.standard_normal((n_queries, dim)).astype("float32")
+    return corpus, queries
+
+def measure(index, queries, ground_truth, k):
+    """Recall@k against the flat results and per-query latency (one query at a time, as served)."""
+    latencies, found = [], []
+    for q, truth in zip(queries, ground_truth):
+        t0 = time.perf_counter()
+        _, I = index.search(q[None, :], k)
+        latencies.append((time.perf_counter() - t0) * 1000)
+        found.append(len(set(I[0]) & set(truth)) / k)
+    return {
+        "recall_at_k": round(float(np.mean(found)), 4),
+        "latency_ms_mean": round(float(np.mean(latencies)), 4),
+        "latency_ms_p95": round(float(np.percentile(latencies, 95)), 4)
+    }
+
+def run_report(corpus, queries, k, types, metric="l2"):
+    results = []
+    baseline = None
+    for index_type in types:
+        t0 = time.time()
+        raw_index, meta = build_index(corpus, index_type, metric)
+        index = SearchIndex(raw_index, meta)
+        build_seconds = time.time() - t0
+        index_bytes = len(faiss.serialize_index(raw_index))
+        if index_type == "flat":
+            _, baseline = index.search(queries, k)
+
+        for params in SWEEP[index_type]:
+            apply_search_params(raw_index, {**meta, **params})
+            row = {
+                "index_type": index_type, **params,
+                "build_seconds": round(build_seconds, 2),
+                "index_bytes": index_bytes,
+                **measure(index, queries, baseline, k)
+            }
+            results.append(row)
+            settings = " ".join(f"{key}={v}" for key, v in params.items())
+            print(f"{index_type:9s} {settings:15s} recall@{k}={row['recall_at_k']:.3f}  "
+                  f"mean={row['latency_ms_mean']:.3f}ms  p95={row['latency_ms_p95']:.3f}ms  "
+                  f"size={index_bytes / 1e6:.1f}MB  build={row['build_seconds']}s")
+    return results
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(description="Recall@k vs latency of approximate FAISS indexes against the flat baseline")
+    cli.add_argument("--jsonl", type=str, default=JSONL_PATH, help="QA .jsonl whose contexts form the corpus")
+    cli.add_argument("--model", type=str, default=EMBED_MODEL)
+    cli.add_argument("--synthetic", type=int, default=0, help="Use N synthetic vectors instead of a book")
+    cli.add_argument("--dim", type=int, default=384, help="Dimension of synthetic vectors")
+    cli.add_argument("--metric", type=str, default=METRIC, help="cosine | l2")
+    cli.add_argument("--k", type=int, default=TOP_K)
+    cli.add_argument("--queries", type=int, default=MAX_QUERIES)
+    cli.add_argument("--types", type=str, default=",".join(INDEX_TYPES), help="Comma-separated index types")
+    cli.add_argument("--out", type=str, default=OUTPUT_FILE)
+    args = cli.parse_args()
+
+    if args.synthetic:
+        corpus, queries = synthetic_vectors(args.synthetic, args.dim, args.queries)
+    else:
+        corpus, queries = load_book_vectors(args.jsonl, args.model, args.queries)
+    types = ["flat"] + [t for t in args.types.split(",") if t != "flat"]
+    print(f"Corpus: {len(corpus)} vectors (dim {corpus.shape[1]}), {len(queries)} queries, k={args.k}, metric={args.metric}")
+
+    results = run_report(corpus, queries, args.k, types, args.metric)
+    with open(args.out, "w", encoding="utf-8") as f:
+        for row in results:
+            f.write(json.dumps(row) + "\n")
+    print(f"Report saved to {args.out}")
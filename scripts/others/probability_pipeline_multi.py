@@ -6,6 +6,11 @@ from pathlib import Path
 from random import choice
 import fitz  # PyMuPDF
 from config import *
+from text_filters import (
+    clean_line, is_numbered_toc_line as is_probably_toc_line, is_valid_paragraph as _is_valid_paragraph,
+    split_sentences, find_defined_term, extract_main_concept as _extract_main_concept,
+    strip_punctuation, CHAPTER_TITLE_RE
+)
 
 
 # ========== Configuration Section ==========
@@ -13,29 +18,6 @@ DEFAULT_PDF_DIR = DEFAULT_PDF
 DEFAULT_CHUNK_SIZE = 180
 # ==========================================
 
-def clean_line(line: str) -> str:
-    """Remove headers, footers, figure/table references from text lines."""
-    patterns = [
-        r"^\d+\s+CHAPTER\s+\d+",
-        r"^CHAPTER\s+\d+(\.\d+)?",
-        r"^Figure\s+\d+(\.\d+)?",
-        r"^Table\s+\d+(\.\d+)?",
-        r"^Page\s+\d+$"
-    ]
-    for p in patterns:
-        if re.match(p, line, re.IGNORECASE):
-            return ""
-    return line
-
-def is_probably_toc_line(line: str) -> bool:
-    """Heuristic to detect lines that belong to table of contents."""
-    return (
-        "table of contents" in line.lower()
-        or re.search(r'\.{3,}', line)
-        or re.match(r'\s*\d+(\.\d+)*\s+.*', line)
-        or re.search(r'\s\.+\s\d{1,3}$', line)
-    )
-
 def pdf_to_clean_paragraphs(pdf_path: Path, words_per_chunk: int = 180):
     """Extract and yield cleaned paragraph chunks with metadata from a PDF."""
     doc = fitz.open(pdf_path)
@@ -55,13 +37,13 @@ def pdf_to_clean_paragraphs(pdf_path: Path, words_per_chunk: int = 180):
                 lines.append(cleaned)
 
         for ln in lines:
-            if m := re.match(r"CHAPTER\s+\d+(\.\d+)?\s*(.*)", ln, re.IGNORECASE):
+            if m := CHAPTER_TITLE_RE.match(ln):
                 chunk_title = m.group(2).strip() or m.group(0).strip()
                 continue
             if is_probably_toc_line(ln):
                 continue
 
-            for sent in re.split(r'(?<=[.!?])\s+', ln):
+            for sent in split_sentences(ln):
                 words = sent.split()
                 buffer.append(sent)
                 wc += len(words)
@@ -90,13 +72,7 @@ def pdf_to_clean_paragraphs(pdf_path: Path, words_per_chunk: int = 180):
 
 def is_valid_paragraph(paragraph: str) -> bool:
     """Filter out invalid paragraphs (TOC lines, short text, numeric only, etc)."""
-    if len(paragraph) < 40:
-        return False
-    if re.fullmatch(r'[\d\s.]+', paragraph):
-        return False
-    if paragraph.count('.') > 20:
-        return False
-    return True
+    return _is_valid_paragraph(paragraph, max_dots=20)
 
 def save_jsonl(items, path: Path):
     """Save a list of JSON objects to a JSONL file."""
@@ -129,28 +105,14 @@ TOPIC_TEMPLATES = {
     "General Probability": GENERAL_TEMPLATES
 }
 
-REGEX_PATTERNS = [
-    r"([A-Z][\w\s-]{2,}) is defined as",
-    r"([A-Z][\w\s-]{2,}) is called",
-    r"([A-Z][\w\s-]{2,}) refers to",
-    r"([A-Z][\w\s-]{2,}) represents",
-    r"([A-Z][\w\s-]{2,}) denotes",
-    r"([A-Z][\w\s-]{2,}) means"
-]
-
 def extract_main_concept(text: str):
     """Attempt to extract main noun phrase from a definition-like sentence."""
-    text = re.sub(r"(Let|Suppose|Assume|Consider)\s+", "", text, flags=re.IGNORECASE)
-    if m := re.search(r"([A-Z][\w ]+?)\s+(is|are|denotes|means|represents|refers to|called)", text):
-        c = m.group(1).strip()
-        return None if c.lower() in {"it", "this", "that"} else c
-    return None
+    return _extract_main_concept(text, strip_leadins=True)
 
 def generate_question(paragraph: str, topic: str, title: str):
     """Generate a question from a paragraph, using patterns or fallback templates."""
-    for pat in REGEX_PATTERNS:
-        if m := re.search(pat, paragraph):
-            return f"What is {m.group(1).strip()}?", False
+    if term := find_defined_term(paragraph):
+        return f"What is {term.strip()}?", False
 
     if concept := extract_main_concept(paragraph):
         verb = "do" if concept.lower().endswith("s") else "does"
@@ -167,11 +129,11 @@ def extract_answer_span(paragraph: str, question: str):
     if m := re.search(r"definition of (.+?)\?", question, re.IGNORECASE):
         key = m.group(1).strip()
     else:
-        toks = [w for w in re.sub(r"[^\w\s]", "", question).split() if len(w) > 4]
+        toks = [w for w in strip_punctuation(question).split() if len(w) > 4]
         key = toks[-1] if toks else None
 
     if key:
-        for sent in re.split(r'(?<=[.!?])\s+', paragraph):
+        for sent in split_sentences(paragraph):
             if key.lower() in sent.lower():
                 return sent.strip()
     return paragraph.strip()
@@ -1,11 +1,12 @@
 print("Python script started", flush=True)
 
 import json
-import faiss
-import numpy as np
 from sentence_transformers import SentenceTransformer
-import requests
 from config import *
+from chunk_store import load_id_map
+from faiss_index import load_index
+from ollama_client import ollama
+from prompt_builder import prompt_builder
 
 import sys
 import io
@@ -22,13 +23,19 @@ OLLAMA_MODEL = OLLAMA_MODEL
 
 TOP_K = 3  # Number of top context to retrieve
 MAX_TOKENS = 500  # Maximum token length for prompt
+PROMPT_TEMPLATE = """You are a helpful math tutor. Based on the following context, answer the question clearly.
+
+Context:
+{context_block}
+
+Question: {query}
+Answer:"""
 # ===========================================
 
 def load_index_and_map():
     """Load the FAISS index and corresponding ID map."""
-    index = faiss.read_index(INDEX_PATH)
-    with open(ID_MAP_PATH, "r", encoding="utf-8") as f:
-        id_map = json.load(f)
+    index = load_index(INDEX_PATH)
+    id_map = load_id_map(ID_MAP_PATH)
     return index, id_map
 
 def embed_query(query, model):
@@ -36,27 +43,20 @@ def embed_query(query, model):
     return model.encode([query])[0]
 
 def build_prompt(query, contexts):
-    """Construct the full prompt for the LLM using retrieved contexts."""
-    context_block = "\n\n".join([f"{i+1}. {ctx.strip()}" for i, ctx in enumerate(contexts)])
-    prompt = f"""You are a helpful math tutor. Based on the following context, answer the question clearly.
-
-Context:
-{context_block}
-
-Question: {query}
-Answer:"""
+    """Construct the full prompt for the LLM, trimming contexts to fit MAX_TOKENS."""
+    prompt, report = prompt_builder.build(PROMPT_TEMPLATE, query, contexts, OLLAMA_MODEL, MAX_TOKENS)
+    print(f"Prompt: {report['prompt_tokens']}/{MAX_TOKENS} tokens ({report['tokenizer']}), "
+          f"{report['chunks_used']}/{report['chunks']} contexts, "
+          f"{report['sentences_dropped']} sentences trimmed, {report['duplicates_dropped']} duplicates dropped")
     return prompt
 
 def query_ollama(prompt):
     """Send the constructed prompt to the local Ollama server."""
-    payload = {
-        "model": OLLAMA_MODEL,
-        "prompt": prompt,
-        "stream": False
-    }
-    response = requests.post(OLLAMA_URL, json=payload)
-    result = response.json()
+    result = ollama.generate(OLLAMA_MODEL, prompt)
     print("Ollama returned:", result)
+    if "prompt_eval_count" in result:
+        prompt_builder.observe(OLLAMA_MODEL, prompt, result["prompt_eval_count"])
+        print(f"Ollama prompt tokens: {result['prompt_eval_count']}")
 
     if "response" in result:
         return result["response"].strip()
@@ -96,9 +96,9 @@ def answer_question(query):
     embed_model = SentenceTransformer(MODEL_NAME)
 
     q_vec = embed_query(query, embed_model).astype("float32")
-    _, I = index.search(np.array([q_vec]), TOP_K)
+    _, I = index.search(q_vec, TOP_K)
 
-    retrieved = [id_map[i]["context"] for i in I[0]]
+    retrieved = [id_map[i]["context"] for i in I[0] if i >= 0]   # -1 pads results beyond ntotal
     prompt = build_prompt(query, retrieved)
     response = query_ollama(prompt)
     return response  
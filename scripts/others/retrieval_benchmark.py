@@ -0,0 +1,200 @@
+import argparse
+import json
+import sys
+import time
+from collections import defaultdict
+import faiss
+import numpy as np
+from config import *
+from build_faiss_index_core import chunk_hash, iter_chunk_batches
+from chunk_store import load_id_map
+from embedding_store import embedding_store
+from faiss_index import SearchIndex, build_index, load_index
+
+
+# ========== Configuration Section ==========
+JSONL_PATH = QA_WITH_ANS
+EMBED_MODELS = [MODEL_NAME]
+INDEX_TYPES = ["flat"]
+METRIC = FAISS_METRIC
+KS = (1, 3, 10)
+MAX_QUESTIONS = 5000      # questions scored for recall/MRR (batched)
+LATENCY_QUERIES = 200     # questions timed one at a time, as served
+OUTPUT_FILE = "../report/retrieval_benchmark.jsonl"
+
+# Regression gate against a baseline report (--baseline)
+MAX_RECALL_DROP = 0.01        # absolute drop allowed in recall@k and MRR
+MAX_LATENCY_GROWTH = 1.5      # allowed ratio of search p95 latency
+# ===========================================
+
+def load_questions(jsonl_path, max_questions):
+    """
+    (question, context hash) pairs from the QA JSONL. The generator pairs
+    each question with the context it was written from, which is the ground
+    truth. Question texts shared by several contexts (template questions)
+    cannot identify one chunk and are left out.
+    """
+    pairs = []
+    with open(jsonl_path, "r", encoding="utf-8") as f:
+        for line in f:
+            obj = json.loads(line)
+            ctx = obj.get("context", "").strip()
+            if obj.get("question") and len(ctx) > 30:
+                pairs.append((obj["question"], chunk_hash(ctx)))
+    contexts_of = defaultdict(set)
+    for question, h in pairs:
+        contexts_of[question].add(h)
+    kept = [(q, h) for q, h in pairs if len(contexts_of[q]) == 1]
+    print(f"Questions: {len(kept)} with a unique source context ({len(pairs) - len(kept)} ambiguous skipped)")
+    return kept[:max_questions]
+
+def relevant_ids(id_map_hashes, questions):
+    """Chunk ids holding each question's context (duplicated contexts give several)."""
+    ids_of = defaultdict(set)
+    for i, h in enumerate(id_map_hashes):
+        ids_of[h].add(i)
+    return [ids_of[h] for _, h in questions]
+
+def percentiles(latencies_ms):
+    return {f"p{p}": round(float(np.percentile(latencies_ms, p)), 4) for p in (50, 95, 99)}
+
+def score(index, q_vecs, truth, ks):
+    """recall@k for each k and MRR@max(k), from one batched search."""
+    k_max = max(ks)
+    _, I = index.search(q_vecs, k_max)
+    ranks = []
+    for row, relevant in zip(I, truth):
+        hit = [r for r, i in enumerate(row) if i in relevant]
+        ranks.append(hit[0] + 1 if hit else None)
+    result = {f"recall@{k}": round(float(np.mean([r is not None and r <= k for r in ranks])), 4) for k in ks}
+    result[f"mrr@{k_max}"] = round(float(np.mean([1 / r if r else 0.0 for r in ranks])), 4)
+    return result
+
+def time_queries(encode_one, index, questions, k, n):
+    """Per-question embed and search latency (ms), one query at a time."""
+    sample = [q for q, _ in questions[:n]]
+    for q in sample[:5]:   # warm-up
+        index.search(encode_one(q), k)
+    embed_ms, search_ms = [], []
+    for q in sample:
+        t0 = time.perf_counter()
+        q_vec = encode_one(q)
+        t1 = time.perf_counter()
+        index.search(q_vec, k)
+        t2 = time.perf_counter()
+        embed_ms.append((t1 - t0) * 1000)
+        search_ms.append((t2 - t1) * 1000)
+    return {"embed_ms": percentiles(embed_ms), "search_ms": percentiles(search_ms)}
+
+def benchmark(index, id_map_hashes, model, questions, embed_model, build_seconds, ks, latency_queries, **row):
+    truth = relevant_ids(id_map_hashes, questions)
+    q_vecs = model.encode([q for q, _ in questions], batch_size=64, convert_to_numpy=True).astype("float32")
+    encode_one = lambda q: model.encode([q], convert_to_numpy=True)[0].astype("float32")
+    result = {
+        "embed_model": embed_model,
+        "index_type": index.meta.get("index_type", "flat"),
+        "metric": index.metric,
+        **row,
+        "chunks": int(index.ntotal),
+        "questions": len(questions),
+        **score(index, q_vecs, truth, ks),
+        **time_queries(encode_one, index, questions, max(ks), latency_queries),
+        "index_serialized_bytes": len(faiss.serialize_index(index.index)),
+        "build_seconds": build_seconds
+    }
+    recalls = "  ".join(f"{key}={v:.3f}" for key, v in result.items() if key.startswith(("recall@", "mrr@")))
+    print(f"{embed_model} {result['index_type']:8s} {recalls}  "
+          f"embed p50/p95/p99={result['embed_ms']['p50']:.2f}/{result['embed_ms']['p95']:.2f}/{result['embed_ms']['p99']:.2f}ms  "
+          f"search p50/p95/p99={result['search_ms']['p50']:.3f}/{result['search_ms']['p95']:.3f}/{result['search_ms']['p99']:.3f}ms  "
+          f"index size={result['index_serialized_bytes'] / 1e6:.1f}MB (serialized)  build={build_seconds}s")
+    return result
+
+def run_from_jsonl(jsonl_path, embed_models, index_types, metric, questions, ks, latency_queries):
+    """Build every index type for every embed model in memory and benchmark it."""
+    id_map = [item for batch in iter_chunk_batches(jsonl_path, 4096) for item in batch]
+    hashes = [item["chunk_hash"] for item in id_map]
+    results = []
+    for embed_model in embed_models:
+        from sentence_transformers import SentenceTransformer
+        model = SentenceTransformer(embed_model, trust_remote_code=True)
+        t0 = time.time()
+        corpus, encoded = embedding_store.get_or_encode(embed_model, hashes, [item["context"] for item in id_map],
+                                                        lambda texts: model.encode(texts, convert_to_numpy=True))
+        encode_seconds = round(time.time() - t0, 2)
+        for index_type in index_types:
+            t0 = time.perf_counter()
+            raw_index, meta = build_index(corpus, index_type, metric)
+            build_seconds = round(time.perf_counter() - t0, 3)
+            results.append(benchmark(SearchIndex(raw_index, meta), hashes, model, questions, embed_model,
+                                     build_seconds, ks, latency_queries,
+                                     corpus_encode_seconds=encode_seconds, corpus_encoded=encoded))
+    return results
+
+def run_on_index(index_path, id_map_path, embed_model, questions, ks, latency_queries):
+    """Benchmark an index that is already built (build time from its meta, if recorded)."""
+    from sentence_transformers import SentenceTransformer
+    index = load_index(index_path)
+    id_map = load_id_map(id_map_path)
+    hashes = [entry.get("chunk_hash") or chunk_hash(entry["context"]) for entry in id_map]
+    embed_model = embed_model or index.meta.get("embed_model") or MODEL_NAME
+    model = SentenceTransformer(embed_model, trust_remote_code=True)
+    return [benchmark(index, hashes, model, questions, embed_model, index.meta.get("build_seconds"), ks,
+                      latency_queries, index_path=index_path)]
+
+def check_regressions(results, baseline_path, max_recall_drop, max_latency_growth):
+    """Failures of `results` against the matching rows (embed model, index type, metric) of a baseline report."""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {(r["embed_model"], r["index_type"], r["metric"]): r for r in map(json.loads, f)}
+    failures = []
+    for row in results:
+        base = baseline.get((row["embed_model"], row["index_type"], row["metric"]))
+        if base is None:
+            continue
+        name = f"{row['embed_model']}/{row['index_type']}"
+        for key in row:
+            if key.startswith(("recall@", "mrr@")) and key in base and row[key] < base[key] - max_recall_drop:
+                failures.append(f"{name}: {key} {base[key]:.4f} → {row[key]:.4f}")
+        if row["search_ms"]["p95"] > base["search_ms"]["p95"] * max_latency_growth:
+            failures.append(f"{name}: search p95 {base['search_ms']['p95']:.3f}ms → {row['search_ms']['p95']:.3f}ms")
+    return failures
+
+if __name__ == "__main__":
+    cli = argparse.ArgumentParser(description="Retrieval-only benchmark: recall@k, MRR, latency percentiles, "
+                                              "serialized index size and build time; no LLM calls")
+    cli.add_argument("--jsonl", type=str, default=JSONL_PATH, help="QA .jsonl (questions + source contexts)")
+    cli.add_argument("--models", type=str, default=None,
+                     help="Comma-separated embed models (default EMBED_MODELS; with --index, the one in its meta)")
+    cli.add_argument("--types", type=str, default=",".join(INDEX_TYPES), help="Comma-separated index types")
+    cli.add_argument("--metric", type=str, default=METRIC, help="cosine | l2")
+    cli.add_argument("--index", type=str, default=None, help="Benchmark this built index instead of building")
+    cli.add_argument("--id_map", type=str, default=None, help="ID map of --index")
+    cli.add_argument("--max_questions", type=int, default=MAX_QUESTIONS)
+    cli.add_argument("--latency_queries", type=int, default=LATENCY_QUERIES)
+    cli.add_argument("--out", type=str, default=OUTPUT_FILE)
+    cli.add_argument("--baseline", type=str, default=None, help="Earlier report; exit 1 on regressions")
+    cli.add_argument("--max_recall_drop", type=float, default=MAX_RECALL_DROP)
+    cli.add_argument("--max_latency_growth", type=float, default=MAX_LATENCY_GROWTH)
+    args = cli.parse_args()
+
+    questions = load_questions(args.jsonl, args.max_questions)
+    if args.index:
+        if not args.id_map:
+            cli.error("--index needs --id_map")
+        results = run_on_index(args.index, args.id_map, args.models, questions, KS, args.latency_queries)
+    else:
+        models = args.models.split(",") if args.models else EMBED_MODELS
+        results = run_from_jsonl(args.jsonl, models, args.types.split(","), args.metric,
+                                 questions, KS, args.latency_queries)
+
+    with open(args.out, "w", encoding="utf-8") as f:
+        for row in results:
+            f.write(json.dumps(row) + "\n")
+    print(f"Report saved to {args.out}")
+
+    if args.baseline:
+        failures = check_regressions(results, args.baseline, args.max_recall_drop, args.max_latency_growth)
+        for failure in failures:
+            print(f"[Regression] {failure}")
+        if failures:
+            sys.exit(1)
+        print("No regressions against the baseline")
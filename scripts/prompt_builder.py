@@ -0,0 +1,254 @@
+# prompt_builder.py
+"""
+Token-budgeted prompt assembly for RAG answers.
+
+Retrieved chunks are first deduplicated: sentences repeated (or nearly
+repeated) across overlapping chunks are kept once. If the prompt still
+exceeds the token budget, each chunk is trimmed to its most query-relevant
+sentences. Higher-ranked chunks get a larger share of the budget, and any
+unused share passes on to the next chunk. Kept sentences stay in their
+original order.
+
+Tokens are counted with the target model's Hugging Face tokenizer when one
+is configured (PROMPT_TOKENIZERS) and has finished loading in the
+background. Until then, or if it cannot be loaded, a chars-per-token
+estimate is used and calibrated against the prompt_eval_count that Ollama
+reports. Every prompt comes with a report of its token counts, for tuning
+prefill cost.
+"""
+
+import re
+import threading
+
+from config import PROMPT_MAX_TOKENS, PROMPT_TOKENIZERS, PROMPT_CHARS_PER_TOKEN, PROMPT_DEDUPE_SIMILARITY
+from bm25_index import tokenize
+from text_filters import split_sentences
+
+_WORD_RE = re.compile(r"\w+")
+_WS_RE = re.compile(r"\s+")
+# Observed chars/token outside this range (e.g. a prompt prefix served from
+# Ollama's KV cache) are not used for calibration
+_CALIBRATION_RANGE = (1.5, 8.0)
+# Longer "sentences" (PDF text often lacks full stops) are cut into pieces of this many words
+MAX_SENTENCE_WORDS = 40
+
+
+def sentence_pieces(text: str) -> list:
+    """Sentences of `text`, long ones split into MAX_SENTENCE_WORDS-word pieces."""
+    pieces = []
+    for sentence in split_sentences(text.strip()):
+        words = sentence.split()
+        for start in range(0, len(words), MAX_SENTENCE_WORDS):
+            pieces.append(" ".join(words[start:start + MAX_SENTENCE_WORDS]))
+    return pieces
+
+
+class TokenCounter:
+    """Token counts for one Ollama model."""
+
+    def __init__(self, tokenizer_name=None, chars_per_token=PROMPT_CHARS_PER_TOKEN):
+        self.tokenizer_name = tokenizer_name
+        self.chars_per_token = chars_per_token
+        self._tokenizer = None
+        self._started = tokenizer_name is None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        """
+        The tokenizer, or None while it is loading (or unavailable). The first
+        call starts the load in a background thread, so no prompt waits on
+        the hub, and no lock is held during the download.
+        """
+        if self._started:
+            return self._tokenizer
+        with self._lock:
+            if self._started:
+                return self._tokenizer
+            self._started = True
+        threading.Thread(target=self._load_tokenizer, name=f"tokenizer-{self.tokenizer_name}", daemon=True).start()
+        return None
+
+    def _load_tokenizer(self):
+        try:
+            from transformers import AutoTokenizer
+            self._tokenizer = AutoTokenizer.from_pretrained(self.tokenizer_name)
+        except Exception as e:
+            print(f"[PromptBuilder] Tokenizer {self.tokenizer_name} unavailable ({e}); "
+                  f"estimating tokens", flush=True)
+
+    @property
+    def kind(self) -> str:
+        return f"hf:{self.tokenizer_name}" if self._load() is not None else "estimate"
+
+    def count(self, text: str) -> int:
+        tokenizer = self._load()
+        if tokenizer is not None:
+            return len(tokenizer.encode(text, add_special_tokens=False))
+        return max(1, round(len(text) / self.chars_per_token)) if text else 0
+
+    def observe(self, prompt: str, prompt_tokens: int):
+        """Move the estimate towards the count Ollama reported for `prompt`."""
+        if self._tokenizer is not None or not prompt_tokens:
+            return
+        observed = len(prompt) / prompt_tokens
+        if _CALIBRATION_RANGE[0] <= observed <= _CALIBRATION_RANGE[1]:
+            with self._lock:
+                self.chars_per_token = 0.8 * self.chars_per_token + 0.2 * observed
+
+
+class PromptBuilder:
+    def __init__(self, tokenizers=PROMPT_TOKENIZERS, dedupe_similarity=PROMPT_DEDUPE_SIMILARITY):
+        """
+        tokenizers:        Ollama model family -> Hugging Face tokenizer name
+        dedupe_similarity: word-set Jaccard at which two sentences count as duplicates
+        """
+        self.tokenizers = dict(tokenizers)
+        self.dedupe_similarity = dedupe_similarity
+        self._counters = {}
+        self._lock = threading.Lock()
+        self.prompts = 0
+        self.trimmed = 0
+        self.prompt_tokens = 0
+        self.duplicates = 0
+
+    def counter(self, model_name) -> TokenCounter:
+        with self._lock:
+            counter = self._counters.get(model_name)
+            if counter is None:
+                counter = TokenCounter(self.tokenizers.get(model_name.split(":")[0]))
+                self._counters[model_name] = counter
+            return counter
+
+    def observe(self, model_name, prompt, prompt_tokens):
+        """Record the prompt token count Ollama reported (prompt_eval_count)."""
+        self.counter(model_name).observe(prompt, prompt_tokens)
+
+    def _dedupe(self, contexts) -> tuple:
+        """Sentences per chunk with repeats across chunks removed, and the number dropped."""
+        seen, word_sets, chunks, dropped = set(), [], [], 0
+        for ctx in contexts:
+            sentences = []
+            for sentence in sentence_pieces(ctx):
+                key = _WS_RE.sub(" ", sentence.casefold())
+                words = frozenset(_WORD_RE.findall(key))
+                if key in seen or (len(words) >= 4 and any(
+                        len(words & other) >= self.dedupe_similarity * len(words | other) for other in word_sets)):
+                    dropped += 1
+                    continue
+                seen.add(key)
+                word_sets.append(words)
+                sentences.append(sentence)
+            chunks.append(sentences)
+        return chunks, dropped
+
+    def build(self, template: str, query: str, contexts, model_name: str, max_tokens: int = PROMPT_MAX_TOKENS) -> tuple:
+        """
+        Fill `template` ({context_block}, {query}) with as much of `contexts`
+        (best first) as fits in max_tokens. Returns (prompt, report).
+        """
+        counter = self.counter(model_name)
+
+        def render(chunks):
+            block = "\n\n".join(f"{i + 1}. {text}" for i, text in enumerate(chunks))
+            return template.format(context_block=block, query=query)
+
+        chunks, duplicates = self._dedupe(contexts)
+        n_sentences = sum(len(s) for s in chunks)
+        chunks = [s for s in chunks if s]
+        prompt = render([" ".join(s) for s in chunks])
+        tokens = counter.count(prompt)
+        kept = n_sentences
+
+        trimmed = tokens > max_tokens
+        if trimmed:
+            keep = self._allocate(query, chunks, counter, max_tokens - counter.count(render([])))
+            while True:
+                kept_at = set(keep)
+                selected = [[s for j, s in enumerate(sentences) if (i, j) in kept_at] for i, sentences in enumerate(chunks)]
+                prompt = render([" ".join(s) for s in selected if s])
+                tokens = counter.count(prompt)
+                if tokens <= max_tokens or not keep:
+                    break
+                # Joining can cost a few tokens more than the parts; drop the least relevant sentence
+                keep.pop()
+            kept = sum(len(s) for s in selected)
+            chunks = [s for s in selected if s]
+
+        report = {
+            "prompt_tokens": tokens,
+            "max_tokens": max_tokens,
+            "tokenizer": counter.kind,
+            "chunks": len(contexts),
+            "chunks_used": len(chunks),
+            "sentences_kept": kept,
+            "sentences_dropped": n_sentences - kept,
+            "duplicates_dropped": duplicates,
+            "trimmed": trimmed
+        }
+        with self._lock:
+            self.prompts += 1
+            self.trimmed += int(trimmed)
+            self.prompt_tokens += tokens
+            self.duplicates += duplicates
+        return prompt, report
+
+    @staticmethod
+    def _allocate(query, chunks, counter, budget) -> list:
+        """
+        (chunk, sentence) positions to keep within `budget` tokens, in the
+        order they were chosen. Chunk i gets a share proportional to 1/(i+1)
+        and picks its most query-relevant sentences; leftover budget then
+        goes to the best remaining sentences of any chunk.
+        """
+        terms = set(tokenize(query))
+        candidates = []   # (relevance, chunk, sentence, tokens)
+        for i, sentences in enumerate(chunks):
+            for j, sentence in enumerate(sentences):
+                relevance = len(terms & set(tokenize(sentence)))
+                candidates.append((relevance, i, j, counter.count(sentence) + 1))
+        overhead = [counter.count(f"{i + 1}. ") + 1 for i in range(len(chunks))]
+
+        keep, used_chunks, used = [], set(), 0
+
+        def take(i, j, cost):
+            nonlocal used
+            keep.append((i, j))
+            used += cost + (overhead[i] if i not in used_chunks else 0)
+            used_chunks.add(i)
+
+        def cost_of(i, cost):
+            return cost + (overhead[i] if i not in used_chunks else 0)
+
+        weights = [1 / (i + 1) for i in range(len(chunks))]
+        carry = 0.0
+        for i in range(len(chunks)):
+            allowance = max(0, budget) * weights[i] / sum(weights) + carry
+            start = used
+            for relevance, _, j, cost in sorted((c for c in candidates if c[1] == i), key=lambda c: (-c[0], c[2])):
+                if used - start + cost_of(i, cost) <= allowance:
+                    take(i, j, cost)
+            carry = allowance - (used - start)
+
+        chosen = set(keep)
+        for relevance, i, j, cost in sorted(candidates, key=lambda c: (-c[0], c[1], c[2])):
+            if (i, j) not in chosen and used + cost_of(i, cost) <= budget:
+                take(i, j, cost)
+        return keep
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "prompts": self.prompts,
+                "trimmed": self.trimmed,
+                "avg_prompt_tokens": round(self.prompt_tokens / self.prompts, 1) if self.prompts else 0.0,
+                "duplicates_dropped": self.duplicates,
+                "counters": {
+                    name: {"tokenizer": c.tokenizer_name if c._tokenizer is not None else "estimate",
+                           "chars_per_token": round(c.chars_per_token, 3)}
+                    for name, c in self._counters.items()
+                }
+            }
+
+
+# Shared builder used by the RAG engine
+prompt_builder = PromptBuilder()
@@ -1,80 +1,103 @@
-import re
 import json
 import uuid
+import zlib
 from pathlib import Path
 import fitz
 from random import choice
+from concurrent.futures import ProcessPoolExecutor
 import sys
+from text_filters import (
+    clean_line, is_probably_toc_line, is_valid_paragraph, split_sentences,
+    find_defined_term, extract_main_concept, strip_punctuation
+)
 sys.stdout.reconfigure(encoding='utf-8')
 
-# ========== Cleaning Rules ==========
-def clean_line(line: str) -> str:
-    patterns = [
-        r"^\d+\s+CHAPTER\s+\d+",
-        r"^CHAPTER\s+\d+(\.\d+)?",
-        r"^Figure\s+\d+(\.\d+)?",
-        r"^Table\s+\d+(\.\d+)?",
-        r"^Page\s+\d+$"
-    ]
-    for pat in patterns:
-        if re.match(pat, line, re.IGNORECASE):
-            return ""
-    return line.strip()
-
-def is_probably_toc_line(line: str) -> bool:
-    if not line.strip():
-        return True
-    if "table of contents" in line.lower():
-        return True
-    if re.search(r'\.{3,}', line):
-        return True
-    if re.search(r'\s\.+\s*\d{1,3}$', line):
-        return True
-    if re.fullmatch(r'[\d\.\s]+', line.strip()):
-        return True
-    toc_keywords = ["exercise", "section", "chapter", "contents", "index"]
-    if any(k in line.lower() for k in toc_keywords) and len(line.split()) <= 10:
-        return True
-    return False
+# Below this many pages per worker, process startup costs more than it saves
+MIN_PAGES_PER_WORKER = 16
 
 # ========== Paragraph Chunking ==========
-def is_valid_paragraph(text: str) -> bool:
-    if len(text) < 40:
-        return False
-    if re.fullmatch(r'[\d\s.]+', text):
-        return False
-    if text.count('.') > 30:
-        return False
-    return True
-
-def extract_paragraphs(pdf_path: Path, words_per_chunk: int = 180):
+def _page_sentences(page) -> list:
+    """Cleaned, non-TOC sentences of one page, in reading order."""
+    lines = []
+    for block in page.get_text("blocks"):
+        text = block[4].replace("\n", " ").strip()
+        if not text:
+            continue
+        cleaned = clean_line(text)
+        if cleaned:
+            lines.append(cleaned)
+
+    sentences = []
+    for ln in lines:
+        if is_probably_toc_line(ln):
+            continue
+        sentences.extend(split_sentences(ln))
+    return sentences
+
+def _extract_page_range(job) -> list:
+    """Worker: open a private document handle and extract pages [start, end)."""
+    pdf_path, start, end = job
     doc = fitz.open(pdf_path)
+    try:
+        return [sent for i in range(start, end) for sent in _page_sentences(doc[i])]
+    finally:
+        doc.close()
+
+def _iter_sentences(pdf_path: Path, workers: int = 1):
+    """
+    Yield page sentences in document order. With several workers, page ranges
+    are extracted in a process pool and stitched back in order, so the
+    chunking below sees exactly the same sentence stream as a serial run.
+    """
+    doc = fitz.open(pdf_path)
+    n_pages = doc.page_count
+    workers = min(workers, -(-n_pages // MIN_PAGES_PER_WORKER))
+    if workers <= 1:
+        for page in doc:
+            yield from _page_sentences(page)
+        return
+    doc.close()
+
+    # Several small shards per worker keep the pool busy when pages differ in cost
+    shard = max(1, -(-n_pages // (workers * 4)))
+    jobs = [(str(pdf_path), start, min(start + shard, n_pages)) for start in range(0, n_pages, shard)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for sentences in pool.map(_extract_page_range, jobs):
+            yield from sentences
+
+def is_chunk_boundary(sentence: str, n_words: int, wc: int, words_per_chunk: int) -> bool:
+    """
+    Content-defined cut after `sentence`: chunks are at least half and at most
+    twice words_per_chunk long, and in between a sentence ends one with a
+    probability (from its own text's hash, proportional to its length) that
+    averages words_per_chunk. Boundaries depend on the text around them, not
+    on a count from the start of the book, so an edit only changes the
+    chunks near it and later chunks keep their hashes (and embeddings).
+    """
+    if wc >= 2 * words_per_chunk:
+        return True
+    if wc < words_per_chunk // 2:
+        return False
+    odds = 2 * n_words / words_per_chunk
+    return zlib.crc32(sentence.encode("utf-8")) / 2 ** 32 < odds
+
+def extract_paragraphs(pdf_path: Path, words_per_chunk: int = 180, workers: int = 1, content_defined: bool = False):
+    """
+    Paragraph chunks of about words_per_chunk words: a chunk ends at the first
+    sentence that reaches it, or with content_defined at is_chunk_boundary
+    (words_per_chunk is then the average).
+    """
     buffer, wc = [], 0
 
-    for page in doc:
-        blocks = page.get_text("blocks")
-        lines = []
-
-        for block in blocks:
-            text = block[4].replace("\n", " ").strip()
-            if not text:
-                continue
-            cleaned = clean_line(text)
-            if cleaned:
-                lines.append(cleaned)
-
-        for ln in lines:
-            if is_probably_toc_line(ln):
-                continue
-            for sent in re.split(r'(?<=[.!?])\s+', ln):
-                words = sent.split()
-                buffer.append(sent)
-                wc += len(words)
-                if wc >= words_per_chunk:
-                    paragraph = " ".join(buffer).strip()
-                    if is_valid_paragraph(paragraph):
-                        yield paragraph
-                    buffer, wc = [], 0
+    for sent in _iter_sentences(pdf_path, workers):
+        words = sent.split()
+        buffer.append(sent)
+        wc += len(words)
+        if is_chunk_boundary(sent, len(words), wc, words_per_chunk) if content_defined else wc >= words_per_chunk:
+            paragraph = " ".join(buffer).strip()
+            if is_valid_paragraph(paragraph):
+                yield paragraph
+            buffer, wc = [], 0
 
     if buffer:
         paragraph = " ".join(buffer).strip()
@@ -90,26 +113,10 @@ GENERAL_TEMPLATES = [
     "What question does this paragraph try to answer?"
 ]
 
-REGEX_PATTERNS = [
-    r"([A-Z][\w\s-]{2,}) is defined as",
-    r"([A-Z][\w\s-]{2,}) is called",
-    r"([A-Z][\w\s-]{2,}) refers to",
-    r"([A-Z][\w\s-]{2,}) represents",
-    r"([A-Z][\w\s-]{2,}) denotes",
-    r"([A-Z][\w\s-]{2,}) means"
-]
-
-def extract_main_concept(text: str):
-    if m := re.search(r"([A-Z][\w ]+?)\s+(is|are|denotes|means|represents|refers to|called)", text):
-        c = m.group(1).strip()
-        return None if c.lower() in {"it", "this", "that"} else c
-    return None
-
 def generate_question(paragraph: str):
-    for pat in REGEX_PATTERNS:
-        if m := re.search(pat, paragraph):
-            qterm = m.group(1).strip().rstrip(".")
-            return f"What is {qterm}?", False
+    if term := find_defined_term(paragraph):
+        qterm = term.strip().rstrip(".")
+        return f"What is {qterm}?", False
 
     if concept := extract_main_concept(paragraph):
         verb = "do" if concept.lower().endswith("s") else "does"
@@ -119,19 +126,19 @@ def generate_question(paragraph: str):
 
 # ========== Answer Extraction ==========
 def extract_answer(paragraph: str, question: str):
-    tokens = re.sub(r"[^\w\s]", "", question).split()
+    tokens = strip_punctuation(question).split()
     key = tokens[-1] if tokens else None
     if key:
-        for sent in re.split(r'(?<=[.!?])\s+', paragraph):
+        for sent in split_sentences(paragraph):
             if key.lower() in sent.lower():
                 return sent.strip()
     return paragraph.strip()
 
 # ========== Main QA Generation ==========
-def generate_qa_file(pdf_path: Path, output_path: Path, words_per_chunk=180):
+def generate_qa_file(pdf_path: Path, output_path: Path, words_per_chunk=180, workers=1, content_defined=False):
     output_path.parent.mkdir(parents=True, exist_ok=True)
     with output_path.open("w", encoding="utf-8") as fout:
-        for para in extract_paragraphs(pdf_path, words_per_chunk):
+        for para in extract_paragraphs(pdf_path, words_per_chunk, workers, content_defined):
             question, is_fb = generate_question(para)
             answer = extract_answer(para, question)
             qa = {
@@ -150,13 +157,18 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--pdf", type=str, required=True, help="Path to input PDF file")
     parser.add_argument("--out", type=str, required=True, help="Path to output .jsonl")
-    parser.add_argument("--chunk_size", type=int, default=180, help="Words per chunk")
+    parser.add_argument("--chunk_size", type=int, default=180, help="Words per chunk (average with --cdc)")
+    parser.add_argument("--workers", type=int, default=1, help="Processes for PDF page extraction")
+    parser.add_argument("--cdc", action="store_true",
+                        help="Content-defined chunk boundaries (0.5-2x chunk_size), stable across edits")
     args = parser.parse_args()
 
     generate_qa_file(
         pdf_path=Path(args.pdf),
         output_path=Path(args.out),
-        words_per_chunk=args.chunk_size
+        words_per_chunk=args.chunk_size,
+        workers=args.workers,
+        content_defined=args.cdc
     )
 
     print(json.dumps({
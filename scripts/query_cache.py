@@ -0,0 +1,158 @@
+# query_cache.py
+"""
+Two-tier cache of query embeddings.
+
+Tier 1 is an in-memory LRU, tier 2 a sqlite table on disk that survives
+restarts. Keys are (embed model, normalized query text). Each model's
+fingerprint is recorded alongside its entries; when a model's weights
+change, its cached embeddings are dropped. The fingerprint function should
+not need the loaded model, or a hit would still pay for loading it.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+
+import numpy as np
+
+from config import QUERY_CACHE_DB, QUERY_CACHE_MAX_ENTRIES, QUERY_CACHE_DISK_MAX_ENTRIES
+
+_WS_RE = re.compile(r"\s+")
+
+
+def normalize_query(text: str) -> str:
+    """Case-fold, collapse whitespace and strip trailing punctuation."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    text = _WS_RE.sub(" ", text).strip()
+    return text.rstrip(" ?!.;:")
+
+
+class QueryEmbeddingCache:
+    def __init__(self, fingerprint_fn, db_path=QUERY_CACHE_DB,
+                 max_entries=QUERY_CACHE_MAX_ENTRIES, disk_max_entries=QUERY_CACHE_DISK_MAX_ENTRIES):
+        """
+        fingerprint_fn:   callable(model_name) -> str identifying the model weights
+        db_path:          sqlite file for the on-disk tier (None disables it)
+        max_entries:      size of the in-memory LRU
+        disk_max_entries: rows kept on disk before the oldest are pruned
+        """
+        self.fingerprint_fn = fingerprint_fn
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self._memory = OrderedDict()
+        self._verified = set()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._db = None
+        if db_path:
+            os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+            self._db = sqlite3.connect(db_path, check_same_thread=False)
+            self._db.executescript("""
+                CREATE TABLE IF NOT EXISTS models (
+                    model TEXT PRIMARY KEY,
+                    fingerprint TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS query_embeddings (
+                    model TEXT NOT NULL,
+                    query TEXT NOT NULL,
+                    vec BLOB NOT NULL,
+                    created REAL DEFAULT (julianday('now')),
+                    PRIMARY KEY (model, query)
+                );
+            """)
+            self._db.commit()
+
+    def _verify_model(self, model_name):
+        """Drop cached rows once per process if the model's fingerprint changed."""
+        if model_name in self._verified:
+            return
+        fingerprint = self.fingerprint_fn(model_name)
+        with self._lock:
+            if model_name in self._verified:
+                return
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT fingerprint FROM models WHERE model = ?", (model_name,)
+                ).fetchone()
+                if row is None or row[0] != fingerprint:
+                    self._db.execute("DELETE FROM query_embeddings WHERE model = ?", (model_name,))
+                    self._db.execute(
+                        "INSERT OR REPLACE INTO models (model, fingerprint) VALUES (?, ?)",
+                        (model_name, fingerprint)
+                    )
+                    self._db.commit()
+            for key in [k for k in self._memory if k[0] == model_name]:
+                del self._memory[key]
+            self._verified.add(model_name)
+
+    def get(self, model_name, query):
+        """Return the cached embedding or None."""
+        self._verify_model(model_name)
+        key = (model_name, normalize_query(query))
+        with self._lock:
+            vec = self._memory.get(key)
+            if vec is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return vec
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT vec FROM query_embeddings WHERE model = ? AND query = ?", key
+                ).fetchone()
+                if row is not None:
+                    vec = np.frombuffer(row[0], dtype=np.float32)
+                    self._remember(key, vec)
+                    self.disk_hits += 1
+                    return vec
+            self.misses += 1
+        return None
+
+    def put(self, model_name, query, vec):
+        self._verify_model(model_name)   # records the fingerprint the row belongs to
+        key = (model_name, normalize_query(query))
+        vec = np.asarray(vec, dtype=np.float32)
+        with self._lock:
+            self._remember(key, vec)
+            if self._db is None:
+                return
+            self._db.execute(
+                "INSERT OR REPLACE INTO query_embeddings (model, query, vec) VALUES (?, ?, ?)",
+                (key[0], key[1], vec.tobytes())
+            )
+            self._db.commit()
+            self._puts += 1
+            if self._puts % 1000 == 0:
+                self._prune_disk()
+
+    def _remember(self, key, vec):
+        self._memory[key] = vec
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def _prune_disk(self):
+        self._db.execute(
+            """DELETE FROM query_embeddings WHERE rowid IN (
+                   SELECT rowid FROM query_embeddings ORDER BY created DESC LIMIT -1 OFFSET ?
+               )""",
+            (self.disk_max_entries,)
+        )
+        self._db.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "memory_entries": len(self._memory),
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": round((self.memory_hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+            }
@@ -1,37 +1,71 @@
-print("Python script started", flush=True)
-
 import json
-import faiss
-import numpy as np
-import requests
 import argparse
 import sys
 import io
-from sentence_transformers import SentenceTransformer
+import time
 from config import *
-
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
-
-# ========== Argument Parser ==========
-parser = argparse.ArgumentParser()
-parser.add_argument("--query", type=str, required=True, help="Question to ask")
-parser.add_argument("--index", type=str, default=FAISS_INDEX, help="FAISS index path")
-parser.add_argument("--id_map", type=str, default=ID_MAP, help="ID map path")
-parser.add_argument("--embed_model", type=str, default=MODEL_NAME, help="Embedding model name")
-parser.add_argument("--llm_model", type=str, default=OLLAMA_MODEL, help="Ollama model name")
-parser.add_argument("--top_k", type=int, default=3, help="Number of contexts to retrieve")
-args = parser.parse_args()
+from bm25_index import hybrid_fuse, load_bm25
+from chunk_store import load_id_map
+from faiss_index import load_index
+from index_registry import IndexRegistry
+from model_pool import embed_pool
+from embed_batcher import EmbedBatcher
+from federated_search import FederatedSearcher
+from library_index import libraries
+from query_cache import QueryEmbeddingCache
+from answer_cache import AnswerCache
+from ollama_client import ollama
+from prompt_builder import prompt_builder
+from reranker import reranker
 
 # ========== Loaders ==========
 def load_index_and_map(index_path, id_map_path):
-    index = faiss.read_index(index_path)
-    with open(id_map_path, "r", encoding="utf-8") as f:
-        id_map = json.load(f)
+    index = load_index(index_path)
+    index.bm25 = load_bm25(index_path)
+    id_map = load_id_map(id_map_path)
     return index, id_map
 
+# ========== Resident Caches ==========
+# Models and indexes stay loaded for the lifetime of the process, so a
+# long-running caller (rag_server.py) only pays the load cost once.
+index_registry = IndexRegistry(load_index_and_map, INDEX_CACHE_MAX_BYTES)
+embed_batcher = EmbedBatcher(embed_pool)
+# Verified from the model's files, so a cache hit never loads the model
+query_cache = QueryEmbeddingCache(embed_pool.files_fingerprint)
+answer_cache = AnswerCache()
+
 def embed_query(query, model_name):
-    model = SentenceTransformer(model_name, trust_remote_code=True)
-    return model.encode([query])[0]
+    vec = query_cache.get(model_name, query)
+    if vec is None:
+        vec = embed_batcher.encode(model_name, query)
+        query_cache.put(model_name, query, vec)
+    return vec
+
+federated = FederatedSearcher(index_registry.get, embed_query)
+
+# ========== Retrieval ==========
+def retrieve(query, q_vec, index, top_k, mode=RETRIEVAL_MODE, fusion=HYBRID_FUSION):
+    """
+    Chunk ids for a query. "hybrid" fuses the vector and BM25 rankings,
+    "bm25" ranks lexically only; indexes built without a BM25 file (or a
+    query with no indexed terms) use plain vector search.
+    """
+    if mode not in ("vector", "bm25", "hybrid"):
+        raise ValueError(f"Unknown retrieval mode {mode!r}; expected vector, bm25 or hybrid")
+    bm25 = index.bm25 if mode != "vector" else None
+    if bm25 is not None and mode == "bm25":
+        _, ids = bm25.search(query, top_k)
+        if len(ids):
+            return ids.tolist()
+        bm25 = None
+    n = max(top_k, HYBRID_CANDIDATES) if bm25 is not None else top_k
+    D, I = index.search(q_vec, n)
+    found = I[0] >= 0
+    vec_ids, vec_scores = I[0][found], index.similarity(D[0][found])
+    if bm25 is None:
+        return [int(i) for i in vec_ids]
+    lex_scores, lex_ids = bm25.search(query, n)
+    return hybrid_fuse(vec_ids, vec_scores, lex_ids, lex_scores, top_k, fusion)
 
 # def build_prompt(query, contexts):
 #     context_block = "\n\n".join([f"{i+1}. {ctx.strip()}" for i, ctx in enumerate(contexts)])
@@ -43,9 +77,7 @@ def embed_query(query, model_name):
 # Question: {query}
 # Answer:"""
 
-def build_prompt(query, contexts):
-    context_block = "\n\n".join([f"{i+1}. {ctx.strip()}" for i, ctx in enumerate(contexts)])
-    return f"""You are a helpful math tutor. Based on the following context, answer the question clearly.
+RAG_PROMPT_TEMPLATE = """You are a helpful math tutor. Based on the following context, answer the question clearly.
 
     - Format your answer in **Markdown**.
     - Use **LaTeX** syntax for math.
@@ -58,16 +90,30 @@ def build_prompt(query, contexts):
     Question: {query}
     Answer:"""
 
+def build_prompt(query, contexts, llm_model, max_tokens=PROMPT_MAX_TOKENS):
+    """
+    Prompt with as much of the retrieved contexts as fits in max_tokens
+    (deduplicated, trimmed to query-relevant sentences; see prompt_builder).
+    Returns (prompt, report with token counts).
+    """
+    return prompt_builder.build(RAG_PROMPT_TEMPLATE, query, contexts, llm_model, max_tokens)
 
-def query_ollama(prompt, model_name):
-    payload = {
-        "model": model_name,
-        "prompt": prompt,
-        "stream": False
-    }
-    response = requests.post(OLLAMA_URL, json=payload)
-    result = response.json()
+# Ollama response fields copied into `usage`
+USAGE_FIELDS = ("prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration")
+
+def query_ollama(prompt, model_name, on_token=None, usage=None):
+    """
+    Generate an answer with Ollama. When `on_token` is given, the answer is
+    streamed and each text fragment is passed to it as soon as it arrives.
+    If `usage` (a dict) is given, Ollama's token counts and timings are added to it.
+    """
+    if on_token is not None:
+        return _query_ollama_stream(prompt, model_name, on_token, usage)
+
+    result = ollama.generate(model_name, prompt)
     print("Ollama returned:", result)
+    if usage is not None:
+        usage.update({k: result[k] for k in USAGE_FIELDS if k in result})
 
     if "response" in result:
         return result["response"].strip()
@@ -76,52 +122,220 @@ def query_ollama(prompt, model_name):
     else:
         return "Unknown error: no response field returned"
 
+def _query_ollama_stream(prompt, model_name, on_token, usage=None):
+    parts = []
+    for chunk in ollama.generate_stream(model_name, prompt):
+        if "error" in chunk:
+            return f"Ollama returned error: {chunk['error']}"
+        token = chunk.get("response", "")
+        if token:
+            # Ollama's first fragments are often leading whitespace
+            if not parts and not token.strip():
+                continue
+            parts.append(token)
+            on_token(token)
+        if chunk.get("done"):
+            print("Ollama stream done:", {k: v for k, v in chunk.items() if k != "context"})
+            if usage is not None:
+                usage.update({k: chunk[k] for k in USAGE_FIELDS if k in chunk})
+            break
+    if not parts:
+        return "Unknown error: no response field returned"
+    return "".join(parts).strip()
+
+# Answers starting with these are failures and must not be cached
+LLM_ERROR_PREFIXES = ("Ollama returned error:", "Unknown error:")
+
+def index_identity(index_path, id_map_path):
+    """Identify a book by its files and their modification times."""
+    return "|".join(str(part) for part in IndexRegistry.make_key(index_path, id_map_path, None)[:4])
+
+def generate_answer(query, contexts, llm_model, max_tokens, on_token=None):
+    """Budgeted prompt + Ollama call; returns (answer, prompt report)."""
+    prompt, prompt_report = build_prompt(query, contexts, llm_model, max_tokens)
+    usage = {}
+    answer = query_ollama(prompt, llm_model, on_token, usage)
+    prompt_builder.observe(llm_model, prompt, usage.get("prompt_eval_count"))
+    prompt_report["ollama_prompt_tokens"] = usage.get("prompt_eval_count")
+    print(f"[Prompt] {prompt_report}")
+    return answer, prompt_report
+
 # ========== Main Logic ==========
-def answer_question(query, index_path, id_map_path, embed_model, llm_model, top_k):
+def answer_question(query, index_path, id_map_path, embed_model, llm_model, top_k, on_token=None,
+                    retrieval_mode=RETRIEVAL_MODE, rerank=RERANK_ENABLED, max_tokens=PROMPT_MAX_TOKENS,
+                    books=None, library=False):
+    """
+    Answer one question, with retrieval when an index is given. If `on_token`
+    is set the answer is streamed through it (a cached answer arrives as a
+    single fragment) and the result includes the time to first token.
+    retrieval_mode: "vector", "bm25" or "hybrid" (see `retrieve`).
+    rerank: retrieve RERANK_CANDIDATES chunks and keep the cross-encoder's
+    best top_k (within RERANK_BUDGET_MS, else the retrieval order).
+    max_tokens: prompt token budget; result["prompt"] reports the counts.
+    books: [{"index", "id_map", "name"?}] to search several books at once
+    (federated vector search; index_path/id_map_path are then ignored).
+    library: search every book in the embed model's library index instead.
+    result["sources"] names the book of each context.
+    """
     print(f"User query: {query}")
+    t0 = time.time()
+    first_token = []
+
+    def emit(token):
+        if not first_token:
+            first_token.append(time.time())
+        on_token(token)
+
+    def finish(result):
+        if on_token is not None:
+            if result["cached"]:
+                emit(result["answer"])
+            result["ttft_ms"] = round((first_token[0] - t0) * 1000, 1) if first_token else None
+        return result
+
+    if books:
+        return finish(_answer_federated(query, books, embed_model, llm_model, top_k, rerank, max_tokens,
+                                        emit if on_token else None))
+    if library:
+        return finish(_answer_library(query, embed_model, llm_model, top_k, rerank, max_tokens,
+                                      emit if on_token else None))
 
     if not index_path or not id_map_path:
         # no RAG - pure prompt
-        prompt = f"You are a helpful tutor. Answer the following question clearly:\n\nQuestion: {query}\nAnswer:"
-        answer = query_ollama(prompt, llm_model)
-        return {
+        answer = answer_cache.get(llm_model, "", [], query)
+        cached = answer is not None
+        if not cached:
+            prompt = f"You are a helpful tutor. Answer the following question clearly:\n\nQuestion: {query}\nAnswer:"
+            answer = query_ollama(prompt, llm_model, emit if on_token else None)
+            if not answer.startswith(LLM_ERROR_PREFIXES):
+                answer_cache.put(llm_model, "", [], query, answer)
+        return finish({
             "answer": answer,
             "question": query,
             "retrieved": [],
             "embed_model": None,
-            "llm_model": llm_model
-        }
+            "llm_model": llm_model,
+            "cached": cached
+        })
 
     # RAG logic below as before
-    index, id_map = load_index_and_map(index_path, id_map_path)
+    index, id_map = index_registry.get(index_path, id_map_path, embed_model)
+    book = index_identity(index_path, id_map_path)
     q_vec = embed_query(query, embed_model).astype("float32")
-    _, I = index.search(np.array([q_vec]), top_k)
-    retrieved = [id_map[i]["context"] for i in I[0]]
-    prompt = build_prompt(query, retrieved)
-    answer = query_ollama(prompt, llm_model)
 
-    return {
+    answer = answer_cache.get_semantic(llm_model, book, q_vec)
+    if answer is None:
+        if rerank:
+            candidates = retrieve(query, q_vec, index, max(top_k, RERANK_CANDIDATES), retrieval_mode)
+            context_ids, _ = reranker.rerank(query, candidates, [id_map[i]["context"] for i in candidates], top_k)
+        else:
+            context_ids = retrieve(query, q_vec, index, top_k, retrieval_mode)
+        answer = answer_cache.get(llm_model, book, context_ids, query)
+    cached = answer is not None
+
+    prompt_report = None
+    if not cached:
+        retrieved = [id_map[i]["context"] for i in context_ids]
+        answer, prompt_report = generate_answer(query, retrieved, llm_model, max_tokens, emit if on_token else None)
+        if not answer.startswith(LLM_ERROR_PREFIXES):
+            answer_cache.put(llm_model, book, context_ids, query, answer, q_vec)
+
+    return finish({
         "answer": answer,
         # "question": query,
         # "retrieved": retrieved,
         "embed_model": embed_model,
-        "llm_model": llm_model
+        "llm_model": llm_model,
+        "cached": cached,
+        "prompt": prompt_report
+    })
+
+def _answer_federated(query, books, embed_model, llm_model, top_k, rerank, max_tokens, on_token):
+    """answer_question over several books; contexts are labelled with their book."""
+    n = max(top_k, RERANK_CANDIDATES) if rerank else top_k
+    hits = federated.search(query, books, n, embed_model)
+    shelf = "+".join(index_identity(b["index"], b["id_map"]) for b in books)
+    return _answer_from_hits(query, hits, shelf, [f"{h['book_no']}:{h['id']}" for h in hits],
+                             embed_model, llm_model, top_k, rerank, max_tokens, on_token)
+
+def _answer_library(query, embed_model, llm_model, top_k, rerank, max_tokens, on_token):
+    """answer_question over the embed model's library index."""
+    library = libraries.get(embed_model)
+    snapshot = library.snapshot()
+    n = max(top_k, RERANK_CANDIDATES) if rerank else top_k
+    hits = library.search(embed_query(query, embed_model), n, snapshot)
+    # Cached answers are tied to the library generation, so adds and deletes invalidate them
+    source = f"library:{library.dir}:{snapshot.generation}"
+    return _answer_from_hits(query, hits, source, [f"{h['book_id']}:{h['id']}" for h in hits],
+                             embed_model, llm_model, top_k, rerank, max_tokens, on_token)
+
+def _answer_from_hits(query, hits, source, context_ids, embed_model, llm_model, top_k, rerank, max_tokens,
+                      on_token):
+    """Rerank (optionally), cache and answer from multi-book hits labelled with their book."""
+    if rerank:
+        order, _ = reranker.rerank(query, list(range(len(hits))), [h["context"] for h in hits], top_k)
+        hits, context_ids = [hits[i] for i in order], [context_ids[i] for i in order]
+    hits, context_ids = hits[:top_k], context_ids[:top_k]
+
+    answer = answer_cache.get(llm_model, source, context_ids, query)
+    cached = answer is not None
+    prompt_report = None
+    if not cached:
+        retrieved = [f"[{h['book']}] {h['context']}" for h in hits]
+        answer, prompt_report = generate_answer(query, retrieved, llm_model, max_tokens, on_token)
+        if not answer.startswith(LLM_ERROR_PREFIXES):
+            answer_cache.put(llm_model, source, context_ids, query, answer)
+    return {
+        "answer": answer,
+        "embed_model": embed_model,
+        "llm_model": llm_model,
+        "cached": cached,
+        "prompt": prompt_report,
+        "sources": [{"book": h["book"], "id": h["id"], "score": round(h["score"], 4)} for h in hits]
     }
 
 # ========== Run ==========
 if __name__ == "__main__":
+    print("Python script started", flush=True)
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--query", type=str, required=True, help="Question to ask")
+    parser.add_argument("--index", type=str, default=FAISS_INDEX, help="FAISS index path")
+    parser.add_argument("--id_map", type=str, default=ID_MAP, help="ID map path")
+    parser.add_argument("--embed_model", type=str, default=MODEL_NAME, help="Embedding model name")
+    parser.add_argument("--llm_model", type=str, default=OLLAMA_MODEL, help="Ollama model name")
+    parser.add_argument("--top_k", type=int, default=3, help="Number of contexts to retrieve")
+    parser.add_argument("--retrieval_mode", type=str, default=RETRIEVAL_MODE, help="vector | bm25 | hybrid")
+    parser.add_argument("--rerank", action=argparse.BooleanOptionalAction, default=RERANK_ENABLED,
+                        help="Cross-encoder rerank of a larger candidate set")
+    parser.add_argument("--max_tokens", type=int, default=PROMPT_MAX_TOKENS, help="Prompt token budget")
+    parser.add_argument("--book", nargs=2, action="append", metavar=("INDEX", "ID_MAP"),
+                        help="Search several books at once (repeat per book)")
+    parser.add_argument("--library", action="store_true", help="Search every book in the embed model's library")
+    args = parser.parse_args()
+
     result = answer_question(
         args.query,
         args.index,
         args.id_map,
         args.embed_model,
         args.llm_model,
-        args.top_k
+        args.top_k,
+        retrieval_mode=args.retrieval_mode,
+        rerank=args.rerank,
+        max_tokens=args.max_tokens,
+        books=[{"index": i, "id_map": m} for i, m in args.book] if args.book else None,
+        library=args.library
     )
     # print(json.dumps(result, ensure_ascii=False), flush=True)
     final_output = {
         "answer": result["answer"],
         "llm_model": result["llm_model"],
-        "embed_model": result["embed_model"]
+        "embed_model": result["embed_model"],
+        "cached": result["cached"],
+        "prompt": result.get("prompt")
     }
+    if "sources" in result:
+        final_output["sources"] = result["sources"]
     print(json.dumps(final_output, ensure_ascii=False), flush=True)
@@ -0,0 +1,295 @@
+# rag_server.py
+"""
+Long-lived RAG query service.
+
+Keeps embedding models and FAISS indexes resident between questions so that
+/ask no longer pays the import + load cost of rag_rag_engine.py per request.
+
+Two transports are supported:
+  * HTTP (default):  GET /health, GET /stats, POST /ask, POST /ask/stream
+  * stdio JSON-lines (--stdio): one request object per stdin line, one
+    response object per stdout line, matched by "id".
+
+Streaming requests (/ask/stream, or "stream": true over stdio) emit
+{"token": ...} messages as the answer is generated, followed by the final
+result, which includes "ttft_ms" (time to first token).
+"""
+
+import argparse
+import io
+import json
+import os
+import sys
+import threading
+import time
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from config import *
+import rag_rag_engine as engine
+
+STARTED_AT = time.time()
+_stats = {"requests": 0, "errors": 0, "disconnects": 0}
+_stats_lock = threading.Lock()
+
+
+# ========== Request Handling ==========
+def handle_ask(payload: dict, on_token=None) -> dict:
+    """
+    Run one question through the engine, using the same defaults as the CLI.
+    With `on_token`, answer fragments are streamed to it as they are generated.
+    """
+    query = payload.get("query")
+    if not query or not isinstance(query, str):
+        raise ValueError("Missing or invalid query")
+
+    result = engine.answer_question(
+        query,
+        payload.get("index", FAISS_INDEX),
+        payload.get("id_map", ID_MAP),
+        payload.get("embed_model") or MODEL_NAME,
+        payload.get("llm_model") or OLLAMA_MODEL,
+        int(payload.get("top_k", 3)),
+        on_token=on_token,
+        retrieval_mode=payload.get("retrieval_mode") or RETRIEVAL_MODE,
+        rerank=bool(payload.get("rerank", RERANK_ENABLED)),
+        max_tokens=int(payload.get("max_tokens") or PROMPT_MAX_TOKENS),
+        books=parse_books(payload.get("books")),
+        library=bool(payload.get("library"))
+    )
+    response = {
+        "answer": result["answer"],
+        "llm_model": result["llm_model"],
+        "embed_model": result["embed_model"],
+        "cached": result["cached"],
+        "prompt": result.get("prompt")
+    }
+    if "sources" in result:
+        response["sources"] = result["sources"]
+    if on_token is not None:
+        response["ttft_ms"] = result["ttft_ms"]
+    return response
+
+
+def parse_books(books):
+    """Validate the optional "books" list of a federated request."""
+    if books is None:
+        return None
+    if not isinstance(books, list) or not all(
+            isinstance(b, dict) and isinstance(b.get("index"), str) and isinstance(b.get("id_map"), str)
+            for b in books):
+        raise ValueError('"books" must be a list of {"index", "id_map", "name"?} objects')
+    return books
+
+
+def health() -> dict:
+    with _stats_lock:
+        counters = dict(_stats)
+    return {
+        "status": "ok",
+        "pid": os.getpid(),
+        "uptime": round(time.time() - STARTED_AT, 1),
+        **counters
+    }
+
+
+def stats() -> dict:
+    return {
+        "index_registry": engine.index_registry.stats(),
+        "embed_pool": engine.embed_pool.stats(),
+        "embed_batcher": engine.embed_batcher.stats(),
+        "query_cache": engine.query_cache.stats(),
+        "answer_cache": engine.answer_cache.stats(),
+        "reranker": engine.reranker.stats(),
+        "prompt_builder": engine.prompt_builder.stats(),
+        "federated": engine.federated.stats(),
+        "library": engine.libraries.stats()
+    }
+
+
+def _count(ok: bool, disconnected: bool = False):
+    with _stats_lock:
+        _stats["requests"] += 1
+        if disconnected:
+            _stats["disconnects"] += 1
+        elif not ok:
+            _stats["errors"] += 1
+
+
+# ========== HTTP Transport ==========
+class RagRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _send_json(self, status: int, body: dict):
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == "/health":
+            self._send_json(200, health())
+        elif self.path == "/stats":
+            self._send_json(200, stats())
+        else:
+            self._send_json(404, {"error": "Not found"})
+
+    def _write_chunk(self, body: dict):
+        data = (json.dumps(body, ensure_ascii=False) + "\n").encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _stream_ask(self, payload: dict):
+        """Relay answer fragments as NDJSON over a chunked response."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            try:
+                result = handle_ask(payload, on_token=lambda token: self._write_chunk({"token": token}))
+                self._write_chunk({"done": True, **result})
+                _count(True)
+            except (BrokenPipeError, ConnectionResetError):
+                raise
+            except Exception as e:
+                if not isinstance(e, ValueError):
+                    traceback.print_exc()
+                self._write_chunk({"error": str(e)})
+                _count(False)
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            # The client went away. A failed token write has already closed the
+            # Ollama stream (freeing its slot); there is no one to send an error to
+            _count(False, disconnected=True)
+            self.close_connection = True
+
+    def do_POST(self):
+        if self.path not in ("/ask", "/ask/stream"):
+            self._send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+        except (ValueError, json.JSONDecodeError) as e:
+            _count(False)
+            self._send_json(400, {"error": f"Invalid JSON body: {e}"})
+            return
+
+        if self.path == "/ask/stream":
+            self._stream_ask(payload)
+            return
+
+        try:
+            result = handle_ask(payload)
+        except ValueError as e:
+            _count(False)
+            self._send_json(400, {"error": str(e)})
+            return
+        except Exception as e:
+            _count(False)
+            traceback.print_exc()
+            self._send_json(500, {"error": str(e)})
+            return
+        _count(True)
+        self._send_json(200, result)
+
+    def log_message(self, fmt, *args):
+        print(f"[rag_server] {self.address_string()} {fmt % args}", file=sys.stderr, flush=True)
+
+
+def serve_http(host: str, port: int):
+    server = ThreadingHTTPServer((host, port), RagRequestHandler)
+    server.daemon_threads = True
+    print(f"[rag_server] Listening on http://{host}:{port}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+# ========== stdio Transport ==========
+def serve_stdio(workers: int):
+    """
+    Serve JSON-lines requests from stdin. The real stdout is reserved for
+    protocol messages; engine logging is redirected to stderr.
+    """
+    out = io.TextIOWrapper(sys.__stdout__.buffer, encoding="utf-8", line_buffering=True)
+    sys.stdout = sys.stderr
+    write_lock = threading.Lock()
+
+    def reply(msg: dict):
+        line = json.dumps(msg, ensure_ascii=False)
+        with write_lock:
+            out.write(line + "\n")
+            out.flush()
+
+    def process(req: dict):
+        req_id = req.get("id")
+        if req.get("op") == "health":
+            reply({"id": req_id, "result": health()})
+            return
+        if req.get("op") == "stats":
+            reply({"id": req_id, "result": stats()})
+            return
+        on_token = None
+        if req.get("stream"):
+            on_token = lambda token: reply({"id": req_id, "token": token})
+        try:
+            result = handle_ask(req, on_token=on_token)
+        except Exception as e:
+            _count(False)
+            if not isinstance(e, ValueError):
+                traceback.print_exc()
+            reply({"id": req_id, "error": str(e)})
+            return
+        _count(True)
+        reply({"id": req_id, "result": result})
+
+    reply({"event": "ready", "pid": os.getpid()})
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for raw in io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8"):
+            raw = raw.strip()
+            if not raw:
+                continue
+            try:
+                req = json.loads(raw)
+            except json.JSONDecodeError as e:
+                reply({"id": None, "error": f"Invalid JSON line: {e}"})
+                continue
+            pool.submit(process, req)
+
+
+# ========== CLI ==========
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default=RAG_SERVER_HOST, help="Bind address for HTTP mode")
+    parser.add_argument("--port", type=int, default=RAG_SERVER_PORT, help="Port for HTTP mode")
+    parser.add_argument("--stdio", action="store_true", help="Serve JSON-lines over stdin/stdout instead of HTTP")
+    parser.add_argument("--workers", type=int, default=RAG_SERVER_WORKERS, help="Concurrent requests in stdio mode")
+    parser.add_argument("--preload_model", type=str, default=MODEL_NAME,
+                        help="Embedding model to load at startup (empty to skip)")
+    parser.add_argument("--preload_reranker", type=str, default=RERANK_MODEL if RERANK_ENABLED else "",
+                        help="Cross-encoder to load at startup (empty to skip)")
+    args = parser.parse_args()
+
+    if args.stdio:
+        sys.stdout = sys.stderr  # keep stdout clean for protocol messages
+
+    if args.preload_model:
+        print(f"[rag_server] Preloading embedding model: {args.preload_model}", file=sys.stderr, flush=True)
+        engine.embed_pool.get(args.preload_model)
+    if args.preload_reranker:
+        print(f"[rag_server] Preloading cross-encoder: {args.preload_reranker}", file=sys.stderr, flush=True)
+        engine.reranker.pool.get(args.preload_reranker)
+
+    if args.stdio:
+        serve_stdio(args.workers)
+    else:
+        serve_http(args.host, args.port)
@@ -0,0 +1,102 @@
+# reranker.py
+"""
+Cross-encoder reranking of retrieved chunks under a per-request time budget.
+
+A larger candidate set is retrieved, scored with a small CPU cross-encoder
+in batches, and the best k are kept. The clock is checked after every
+batch: once the budget is spent, the remaining work is abandoned and the
+retrieval (vector/hybrid) order is used instead. A cross-encoder that is
+not loaded yet is loaded in the background, so no request waits for it.
+"""
+
+import threading
+import time
+
+import numpy as np
+
+from config import RERANK_MODEL, RERANK_BATCH_SIZE, RERANK_BUDGET_MS, RERANK_MAX_LENGTH
+from model_pool import ModelPool
+
+
+def load_cross_encoder(model_name):
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(model_name, max_length=RERANK_MAX_LENGTH, device="cpu")
+
+
+class Reranker:
+    def __init__(self, pool, batch_size=RERANK_BATCH_SIZE, budget_ms=RERANK_BUDGET_MS):
+        """
+        pool:       ModelPool of cross-encoders
+        batch_size: (query, chunk) pairs scored per predict call
+        budget_ms:  default time budget per request
+        """
+        self.pool = pool
+        self.batch_size = batch_size
+        self.budget_ms = budget_ms
+        self._lock = threading.Lock()
+        self.reranked = 0
+        self.fallbacks = {"budget": 0, "loading": 0, "error": 0}
+        self.total_ms = 0.0
+
+    def rerank(self, query, candidate_ids, texts, k, model_name=RERANK_MODEL, budget_ms=None) -> tuple:
+        """
+        Best k of `candidate_ids` (in retrieval order, with their `texts`).
+        Returns (ids, info); info["reranked"] is False when the retrieval
+        order was kept, with the reason in info["fallback"].
+        """
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        t0 = time.perf_counter()
+        if len(candidate_ids) <= 1:
+            return list(candidate_ids[:k]), {"reranked": False, "fallback": None, "ms": 0.0}
+        if not self.pool.is_loaded(model_name):
+            if self.pool.load_error(model_name) is not None:
+                return self._fallback(candidate_ids, k, "error", t0)
+            self.pool.preload(model_name)
+            return self._fallback(candidate_ids, k, "loading", t0)
+
+        deadline = t0 + budget_ms / 1000.0
+        scores = []
+        try:
+            with self.pool.acquire(model_name) as model:
+                for start in range(0, len(texts), self.batch_size):
+                    pairs = [(query, text) for text in texts[start:start + self.batch_size]]
+                    scores.extend(np.asarray(model.predict(pairs, batch_size=len(pairs),
+                                                           show_progress_bar=False)).ravel().tolist())
+                    if time.perf_counter() > deadline and start + self.batch_size < len(texts):
+                        return self._fallback(candidate_ids, k, "budget", t0)
+        except Exception as e:
+            print(f"[Reranker] {model_name} failed: {e}", flush=True)
+            return self._fallback(candidate_ids, k, "error", t0)
+
+        # Stable sort: equal scores keep their retrieval order
+        order = sorted(range(len(scores)), key=lambda i: -scores[i])[:k]
+        ms = (time.perf_counter() - t0) * 1000
+        with self._lock:
+            self.reranked += 1
+            self.total_ms += ms
+        return [candidate_ids[i] for i in order], {"reranked": True, "fallback": None, "ms": round(ms, 1)}
+
+    def _fallback(self, candidate_ids, k, reason, t0):
+        ms = (time.perf_counter() - t0) * 1000
+        with self._lock:
+            self.fallbacks[reason] += 1
+            self.total_ms += ms
+        print(f"[Reranker] Keeping retrieval order ({reason}, {ms:.1f} ms)", flush=True)
+        return list(candidate_ids[:k]), {"reranked": False, "fallback": reason, "ms": round(ms, 1)}
+
+    def stats(self) -> dict:
+        with self._lock:
+            calls = self.reranked + sum(self.fallbacks.values())
+            return {
+                "reranked": self.reranked,
+                "fallbacks": dict(self.fallbacks),
+                "avg_ms": round(self.total_ms / calls, 2) if calls else 0.0,
+                "budget_ms": self.budget_ms,
+                "batch_size": self.batch_size,
+                "models": self.pool.stats()["models"]
+            }
+
+
+# Shared cross-encoder pool and reranker
+rerank_pool = ModelPool(loader=load_cross_encoder)
+reranker = Reranker(rerank_pool)
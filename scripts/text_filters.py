@@ -0,0 +1,111 @@
+# text_filters.py
+"""
+Precompiled line and paragraph filters shared by the QA generators.
+
+Each rule family is compiled once and, where the original code looped over
+a list of patterns, combined into a single alternation so a line is
+classified in one regex pass.
+"""
+
+import re
+
+# ========== Line Cleaning ==========
+# Chapter headers, figure/table captions and page footers
+_HEADER_RE = re.compile(
+    r"\d+\s+CHAPTER\s+\d+"
+    r"|CHAPTER\s+\d+(?:\.\d+)?"
+    r"|Figure\s+\d+(?:\.\d+)?"
+    r"|Table\s+\d+(?:\.\d+)?"
+    r"|Page\s+\d+$",
+    re.IGNORECASE
+)
+CHAPTER_TITLE_RE = re.compile(r"CHAPTER\s+\d+(\.\d+)?\s*(.*)", re.IGNORECASE)
+
+
+def clean_line(line: str) -> str:
+    """Drop header/footer/caption lines; otherwise return the stripped line."""
+    if _HEADER_RE.match(line):
+        return ""
+    return line.strip()
+
+
+# ========== TOC Detection ==========
+# Applied to the lower-cased line
+_TOC_RE = re.compile(r"table of contents|\.{3,}|\s\.+\s*\d{1,3}$")
+_TOC_KEYWORD_RE = re.compile(r"exercise|section|chapter|contents|index")
+_NUMERIC_ONLY_RE = re.compile(r"[\d\.\s]+")
+# Variant used by the LLM generator: also treats "1.2 Title" lines as TOC
+_NUMBERED_TOC_RE = re.compile(r"^\s*\d+(?:\.\d+)*\s|table of contents|\.{3,}|\s\.+\s\d{1,3}$")
+
+
+def is_probably_toc_line(line: str) -> bool:
+    """TOC entries, dot leaders, bare page numbers and short keyword lines."""
+    stripped = line.strip()
+    if not stripped:
+        return True
+    low = line.lower()
+    if _TOC_RE.search(low):
+        return True
+    if _NUMERIC_ONLY_RE.fullmatch(stripped):
+        return True
+    return bool(_TOC_KEYWORD_RE.search(low)) and len(line.split()) <= 10
+
+
+def is_numbered_toc_line(line: str) -> bool:
+    """TOC entries, dot leaders and lines starting with a section number."""
+    return bool(_NUMBERED_TOC_RE.search(line.lower()))
+
+
+# ========== Paragraphs ==========
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def split_sentences(text: str) -> list:
+    return _SENTENCE_SPLIT_RE.split(text)
+
+
+def is_valid_paragraph(text: str, max_dots: int = 30) -> bool:
+    """Reject short, numeric-only or dot-heavy (TOC-like) paragraphs."""
+    if len(text) < 40:
+        return False
+    if _NUMERIC_ONLY_RE.fullmatch(text):
+        return False
+    return text.count(".") <= max_dots
+
+
+# ========== Concept Extraction ==========
+DEFINITION_VERBS = ["is defined as", "is called", "refers to", "represents", "denotes", "means"]
+DEFINITION_PATTERNS = [re.compile(rf"([A-Z][\w\s-]{{2,}}) {verb}") for verb in DEFINITION_VERBS]
+# Matches iff at least one of DEFINITION_PATTERNS matches
+_DEFINITION_ANY_RE = re.compile(rf"([A-Z][\w\s-]{{2,}}) (?:{'|'.join(DEFINITION_VERBS)})")
+_MAIN_CONCEPT_RE = re.compile(r"([A-Z][\w ]+?)\s+(is|are|denotes|means|represents|refers to|called)")
+_LEADIN_RE = re.compile(r"(Let|Suppose|Assume|Consider)\s+", re.IGNORECASE)
+_PUNCT_RE = re.compile(r"[^\w\s]")
+
+
+def find_defined_term(text: str):
+    """
+    Term introduced by the first matching definition verb, in verb priority
+    order. The combined pattern rejects the common no-definition case in one
+    pass; the per-verb patterns then preserve the original priority.
+    """
+    if not _DEFINITION_ANY_RE.search(text):
+        return None
+    for pattern in DEFINITION_PATTERNS:
+        if m := pattern.search(text):
+            return m.group(1)
+    return None
+
+
+def extract_main_concept(text: str, strip_leadins: bool = False):
+    """Subject of the first "<Concept> is/means/..." phrase, if any."""
+    if strip_leadins:
+        text = _LEADIN_RE.sub("", text)
+    if m := _MAIN_CONCEPT_RE.search(text):
+        c = m.group(1).strip()
+        return None if c.lower() in {"it", "this", "that"} else c
+    return None
+
+
+def strip_punctuation(text: str) -> str:
+    return _PUNCT_RE.sub("", text)